@@ -1,11 +1,65 @@
-import ipaddress
+import hashlib
 import json
+import os
+import re
+import tempfile
 
 from subprocess import check_output
-from charms.docker import DockerOpts
 from charmhelpers.core import hookenv
+from charmhelpers.core import host
 from charmhelpers.core import unitdata
 from charmhelpers.core.templating import render
+from charms.layer.docker_proxy import proxy_settings
+
+DAEMON_JSON = "/etc/docker/daemon.json"
+DOCKER_DEFAULTS = "/etc/default/docker"
+DOCKER_SERVICE = "/lib/systemd/system/docker.service"
+DOCKER_DROPIN_DIR = "/etc/systemd/system/docker.service.d"
+DOCKER_PROXY_ENV = "/etc/default/docker-proxy"
+# Drop-ins rendered with the `drop-in` systemd-unit mode: template -> path.
+DOCKER_DROPINS = {
+    "docker-limits.conf": os.path.join(DOCKER_DROPIN_DIR, "10-charm-limits.conf"),
+    "docker-exec.conf": os.path.join(DOCKER_DROPIN_DIR, "20-charm-exec.conf"),
+    "docker-proxy.conf": os.path.join(DOCKER_DROPIN_DIR, "30-charm-proxy.conf"),
+    "docker-proxy.env": DOCKER_PROXY_ENV,
+}
+
+# docker.service properties systemd applies to the running daemon on
+# daemon-reload. Changing any other one needs a restart.
+RELOADABLE_UNIT_PROPERTIES = frozenset(
+    [
+        "Unit.Description",
+        "Unit.Documentation",
+        "Service.CPUAccounting",
+        "Service.MemoryAccounting",
+        "Service.TasksAccounting",
+        "Service.TasksMax",
+        "Service.TimeoutStartSec",
+        "Service.TimeoutStopSec",
+    ]
+)
+
+# daemon.json keys that dockerd applies on SIGHUP, without a restart. See
+# https://docs.docker.com/engine/reference/commandline/dockerd/#configuration-reload-behavior
+RELOADABLE_DAEMON_OPTS = frozenset(
+    [
+        "allow-nondistributable-artifacts",
+        "authorization-plugins",
+        "builder",
+        "debug",
+        "default-runtime",
+        "features",
+        "insecure-registries",
+        "labels",
+        "live-restore",
+        "max-concurrent-downloads",
+        "max-concurrent-uploads",
+        "max-download-attempts",
+        "registry-mirrors",
+        "runtimes",
+        "shutdown-timeout",
+    ]
+)
 
 docker_packages = {
     "apt": ["docker.io"],
@@ -19,13 +73,130 @@ docker_packages = {
 }
 
 
+_DURATION = re.compile(r"^(\d+)([smhd])$")
+_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_duration(value):
+    """
+    :param value: String like 30m, 24h or 7d; empty for no limit
+    :return: Integer seconds or None
+    """
+    if not value:
+        return None
+    match = _DURATION.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration {value!r}, expected e.g. 30m or 24h.")
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def _command_output(*command):
+    return check_output(list(command)).rstrip().decode("utf-8")
+
+
+def _boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# Host facts: name -> (function to gather it, subprocesses it spawns).
+# They can only change across a reboot, or a package upgrade for lsb-release.
+HOST_FACTS = {
+    "arch": (lambda: _command_output("dpkg", "--print-architecture"), 1),
+    "kernel-release": (lambda: _command_output("uname", "-r"), 1),
+    "lsb-release": (host.lsb_release, 0),
+    "lspci": (lambda: _command_output("lspci", "-nnk"), 1),
+}
+
+# Facts gathered during this hook, and how many subprocesses were spawned
+# to gather them or avoided by the cache.
+_host_facts = {}
+_host_fact_stats = {"spawned": 0, "saved": 0}
+
+
+def host_fact(name, persist=True):
+    """
+    Return a fact about this host, gathering it at most once per hook.
+
+    With `persist`, the fact is also kept in unitdata and reused by later
+    hooks until the machine reboots.
+
+    :param name: String one of HOST_FACTS
+    :param persist: Boolean keep the fact across hooks
+    :return: The fact
+    """
+    gather, spawns = HOST_FACTS[name]
+    if name in _host_facts:
+        _count_host_fact_spawns("saved", spawns)
+        return _host_facts[name]
+
+    kv = unitdata.kv()
+    boot_id = _boot_id()
+    stored = kv.get("host-facts", default={}) if persist else {}
+    if stored.get("boot-id") == boot_id and name in stored.get("facts", {}):
+        _count_host_fact_spawns("saved", spawns)
+        value = stored["facts"][name]
+    else:
+        _count_host_fact_spawns("spawned", spawns)
+        value = gather()
+        if persist:
+            if stored.get("boot-id") != boot_id:
+                stored = {"boot-id": boot_id, "facts": {}}
+            stored["facts"][name] = value
+            kv.set("host-facts", stored)
+            kv.flush()
+
+    _host_facts[name] = value
+    return value
+
+
+def _count_host_fact_spawns(key, spawns):
+    if key == "saved" and spawns and not _host_fact_stats["saved"]:
+        hookenv.atexit(
+            lambda: hookenv.log(
+                "Host facts cache saved {saved} subprocess spawns, "
+                "{spawned} spawned.".format(**_host_fact_stats)
+            )
+        )
+    _host_fact_stats[key] += spawns
+
+
+def host_fact_stats():
+    """
+    :return: Dict with the number of subprocesses `spawned` to gather host
+      facts during this hook, and the number `saved` by the cache
+    """
+    return dict(_host_fact_stats)
+
+
+def invalidate_host_facts(*names):
+    """
+    Forget cached host facts, in this hook and in unitdata, so they are
+    gathered again on next use.
+
+    :param names: String facts to forget, all of them when empty
+    :return: None
+    """
+    names = names or list(HOST_FACTS)
+    kv = unitdata.kv()
+    stored = kv.get("host-facts", default={})
+    for name in names:
+        _host_facts.pop(name, None)
+        stored.get("facts", {}).pop(name, None)
+    kv.set("host-facts", stored)
+    kv.flush()
+
+
 def arch():
     """
     Return the package architecture as a string.
 
     :return: String
     """
-    return check_output(["dpkg", "--print-architecture"]).rstrip().decode("utf-8")
+    return host_fact("arch")
 
 
 def determine_apt_source():
@@ -40,8 +211,8 @@ def determine_apt_source():
         docker_runtime = "upstream"
 
     if docker_runtime == "auto":
-        out = check_output(["lspci", "-nnk"]).rstrip()
-        if arch() == "amd64" and out.decode("utf-8").lower().count("nvidia") > 0:
+        out = host_fact("lspci")
+        if arch() == "amd64" and out.lower().count("nvidia") > 0:
             docker_runtime = "nvidia"
         else:
             docker_runtime = "apt"
@@ -52,58 +223,216 @@ def determine_apt_source():
 
 def render_configuration_template(service=False):
     """
+    Render the docker configuration files. Files whose content would not
+    change are left untouched.
+
     :param service: Boolean also render service file
-    :return: None
+    :return: List of the paths that were written
     """
+    from charms.docker import DockerOpts
+
     opts = DockerOpts()
     config = hookenv.config
 
-    environment_config = hookenv.env_proxy_settings()
     modified_config = dict(config())
-    parsed_hosts = ""
-    if environment_config is not None:
-        hosts = []
-        for address in environment_config.get("NO_PROXY", "").split(","):
-            address = address.strip()
-            try:
-                net = ipaddress.ip_network(address)
-                ip_addresses = [str(ip) for ip in net.hosts()]
-                if ip_addresses == []:
-                    hosts.append(address)
-                else:
-                    hosts += ip_addresses
-            except ValueError:
-                hosts.append(address)
-        parsed_hosts = ",".join(hosts)
-        environment_config.update({"NO_PROXY": parsed_hosts, "no_proxy": parsed_hosts})
-        for key in ["http_proxy", "https_proxy", "no_proxy"]:
-            if not modified_config.get(key):
-                modified_config[key] = environment_config.get(key)
+    modified_config.update(proxy_settings())
 
     runtime = determine_apt_source()
 
-    render(
-        "docker.defaults",
-        "/etc/default/docker",
-        {
-            "opts": opts.to_s(),
-            "manual": config("docker-opts"),
-            "docker_runtime": runtime,
-        },
-    )
-
+    rendered = {
+        DOCKER_DEFAULTS: render(
+            "docker.defaults",
+            None,
+            {
+                "opts": opts.to_s(),
+                "manual": config("docker-opts"),
+                "docker_runtime": runtime,
+            },
+        )
+    }
+
+    units = {}
     if service:
-        render("docker.systemd", "/lib/systemd/system/docker.service", modified_config)
+        if config("systemd-unit") == "drop-in":
+            units = _render_dropins(modified_config)
+        else:
+            rendered[DOCKER_SERVICE] = render("docker.systemd", None, modified_config)
+            # Drop-ins left from the other mode would override the unit.
+            units = dict.fromkeys(DOCKER_DROPINS.values())
+
+    changed = [path for path, content in rendered.items() if write_file(path, content)]
+    properties = set()
+    for path, content in units.items():
+        written, diff = _write_unit_file(path, content)
+        if written:
+            changed.append(path)
+            properties |= diff
+    if changed:
+        kv = unitdata.kv()
+        pending = set(kv.get("docker-files-pending", default=[]))
+        pending |= {path for path in changed if path not in units}
+        kv.set("docker-files-pending", sorted(pending))
+        pending = set(kv.get("docker-unit-pending", default=[]))
+        kv.set("docker-unit-pending", sorted(pending | properties))
+        kv.flush()
+
+    if _write_daemon_json()[1]:
+        changed.append(DAEMON_JSON)
+
+    return changed
+
+
+def _render_dropins(context):
+    """
+    :param context: Dict template context
+    :return: Dict path to the content of each drop-in, None for those to
+      remove
+    """
+    context = dict(context, proxy_env=DOCKER_PROXY_ENV)
+    proxy = context.get("http_proxy") or context.get("https_proxy")
+    return {
+        path: (
+            render(template, None, context)
+            if proxy or "proxy" not in template
+            else None
+        )
+        for template, path in DOCKER_DROPINS.items()
+    }
+
+
+def _write_unit_file(path, content):
+    """
+    Write or, when `content` is None, remove a drop-in or environment file.
 
-    write_daemon_json()
+    :return: Tuple of whether the file changed, and the Set of unit
+      properties that changed with it
+    """
+    try:
+        with open(path) as f:
+            previous = f.read()
+    except OSError:
+        previous = None
+    if content == previous:
+        return False, set()
+
+    if path == DOCKER_PROXY_ENV:
+        # The environment is only read when the daemon starts.
+        properties = {"Service.Environment"}
+    else:
+        properties = diff_unit(parse_unit(previous or ""), parse_unit(content or ""))
+    if content is None:
+        os.unlink(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Proxy URLs may hold credentials.
+        write_file(path, content, perms=0o600 if path == DOCKER_PROXY_ENV else 0o644)
+    return True, properties
+
+
+def parse_unit(content):
+    """Parse a systemd unit file or drop-in.
+
+    :param content str: The unit file
+    :return: Dict `Section.Property` to the List of its values, an empty
+      assignment resetting the list as it does in systemd
+
+    """
+    properties = {}
+    section = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1]
+            continue
+        key, _, value = line.partition("=")
+        name = f"{section}.{key.strip()}"
+        value = value.strip()
+        properties[name] = (properties.get(name, []) + [value]) if value else []
+    return properties
+
+
+def diff_unit(old, new):
+    """Compare two parsed unit files.
+
+    :param old dict: The previous unit, see parse_unit()
+    :param new dict: The new unit
+    :return: Set of the properties that were added, removed or changed
+
+    """
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+
+def unit_restart_required(properties):
+    """Tell if changes to docker.service properties need a daemon restart.
+
+    :param properties: Iterable of changed `Section.Property` names
+    :return: False if a daemon-reload applies every change, else True
+
+    """
+    return any(name not in RELOADABLE_UNIT_PROPERTIES for name in properties)
+
+
+def write_file(path, content, perms=0o444):
+    """Atomically replace `path` with `content`, unless it already holds
+    exactly that content.
+
+    The sha256 of the new content is compared with that of the file on
+    disk. When they differ the content is written to a temporary file in
+    the same directory, synced and renamed over `path`.
+
+    :param path str: The file to write
+    :param content: The str or bytes to write
+    :param perms int: The mode of the written file
+    :return: True if the file was written, False if it was unchanged
+
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    try:
+        with open(path, "rb") as f:
+            current = hashlib.sha256(f.read()).digest()
+    except OSError:
+        current = None
+    if current == hashlib.sha256(content).digest():
+        return False
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o755, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, perms)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
 
 
 def write_daemon_json():
     """Reads Docker daemon options from `daemon-opts` charm config and
     writes them to /etc/docker/daemon.json.
 
+    The keys whose values differ from the file previously on disk are
+    recorded until the daemon picks them up, see
+    pending_daemon_json_changes(). The file is not rewritten when nothing
+    changed.
+
     :return: The dict written to /etc/docker/daemon.json
 
+    """
+    return _write_daemon_json()[0]
+
+
+def _write_daemon_json():
+    """
+    :return: Tuple of the daemon.json dict and whether the file was written
     """
     daemon_opts = hookenv.config("daemon-opts")
     daemon_opts = json.loads(daemon_opts)
@@ -115,10 +444,91 @@ def write_daemon_json():
     # If there are any shared keys, we want the value from charm config to win.
     daemon_opts_additions.update(daemon_opts)
 
-    with open("/etc/docker/daemon.json", "w") as f:
-        json.dump(daemon_opts_additions, f)
+    # The data-root being moved is switched over while the daemon is
+    # stopped, until then it must start on the one it runs from.
+    migration = kv.get("docker.data-root-migration")
+    if migration:
+        daemon_opts_additions["data-root"] = migration["source"]
+
+    try:
+        with open(DAEMON_JSON) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    changed = diff_daemon_json(previous, daemon_opts_additions)
+    if changed:
+        pending = set(kv.get("daemon-json-pending", default=[]))
+        kv.set("daemon-json-pending", sorted(pending | changed))
+        kv.flush()
+
+    written = write_file(DAEMON_JSON, json.dumps(daemon_opts_additions), perms=0o644)
+
+    return daemon_opts_additions, written
+
+
+def diff_daemon_json(old, new):
+    """Compare two daemon.json documents.
+
+    :param old dict: The previous document
+    :param new dict: The new document
+    :return: Set of the keys that were added, removed or changed
+
+    """
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+
+def restart_required(keys):
+    """Tell if changes to daemon.json keys need a daemon restart.
 
-    return daemon_opts_additions
+    :param keys: Iterable of changed daemon.json keys
+    :return: False if dockerd can apply every change on SIGHUP, else True
+
+    """
+    return any(key not in RELOADABLE_DAEMON_OPTS for key in keys)
+
+
+def pending_daemon_json_changes():
+    """Return the daemon.json keys changed since the daemon last loaded it.
+
+    :return: List of keys
+
+    """
+    return unitdata.kv().get("daemon-json-pending", default=[])
+
+
+def pending_file_changes():
+    """Return the docker configuration files rewritten since the daemon was
+    last restarted.
+
+    :return: List of paths
+
+    """
+    return unitdata.kv().get("docker-files-pending", default=[])
+
+
+def pending_unit_changes():
+    """Return the docker.service properties changed in the charm's drop-ins
+    since systemd and the daemon last loaded them.
+
+    :return: List of `Section.Property` names
+
+    """
+    return unitdata.kv().get("docker-unit-pending", default=[])
+
+
+def clear_pending_changes():
+    """Record that the daemon has been restarted or reloaded, and is
+    running with the configuration currently on disk.
+
+    :return: None
+
+    """
+    kv = unitdata.kv()
+    kv.unset("daemon-json-pending")
+    kv.unset("docker-files-pending")
+    kv.unset("docker-unit-pending")
+    kv.flush()
 
 
 def set_daemon_json(key, value):
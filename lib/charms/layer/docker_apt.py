@@ -0,0 +1,320 @@
+import os
+from shlex import split
+from subprocess import check_call
+from subprocess import check_output
+
+from charmhelpers.core import hookenv
+from charmhelpers.fetch import apt_cache
+from charmhelpers.fetch import apt_hold
+from charmhelpers.fetch import apt_install
+from charmhelpers.fetch import apt_purge
+from charmhelpers.fetch import apt_unhold
+from charmhelpers.fetch import apt_update
+from charms.layer.docker_cache import KEY_MAX_AGE
+from charms.layer.docker_cache import artifact_cache
+
+DOCKER_SOURCES = "/etc/apt/sources.list.d/docker.list"
+# The apt-get options charmhelpers uses by default.
+APT_OPTIONS = ["--option=Dpkg::Options::=--force-confold"]
+
+
+def installed_packages(packages):
+    """
+    Return the packages that are installed, with a single dpkg-query.
+
+    :param packages: List String
+    :return: List String
+    """
+    if not packages:
+        return []
+    installed = apt_cache().dpkg_list(packages)
+    return [package for package in packages if package in installed]
+
+
+def installed_versions(packages):
+    """
+    Return the installed version of each of the packages that are
+    installed, with a single dpkg-query.
+
+    :param packages: List String
+    :return: Dict String package to String version
+    """
+    if not packages:
+        return {}
+    installed = apt_cache().dpkg_list(packages)
+    return {p: installed[p]["version"] for p in packages if p in installed}
+
+
+def installable_packages(packages):
+    """
+    Return the packages apt has an installation candidate for, with a
+    single apt-cache call.
+
+    :param packages: List String
+    :return: List String
+    """
+    if not packages:
+        return []
+    names = [package.split("=")[0] for package in packages]
+    output = check_output(["apt-cache", "policy"] + names).decode("utf-8")
+    candidates = set()
+    name = None
+    for line in output.splitlines():
+        if not line.startswith(" ") and line.endswith(":"):
+            name = line[:-1]
+        elif line.strip().startswith("Candidate:") and "(none)" not in line:
+            candidates.add(name)
+    return [p for p, n in zip(packages, names) if n in candidates]
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
+
+
+class AptPlan:
+    """
+    The apt operations of a hook, collected so they can be run with as few
+    apt and dpkg invocations as possible: every source and key is written
+    before a single update, followed by one purge, one install and one
+    hold.
+    """
+
+    def __init__(self):
+        self.key_urls = []
+        self.keys = []
+        self.sources = []
+        self.deb_urls = []
+        self.deb_sha256 = {}
+        self.purges = []
+        self.downloads = []
+        self.installs = []
+        self.optional = []
+        self.downgrades = False
+        self.holds = []
+        self.unholds = []
+        self.refresh = False
+
+    def add_key_url(self, url):
+        """Trust the apt signing key served at `url`."""
+        self.key_urls = _unique(self.key_urls + [url])
+
+    def add_key(self, key):
+        """Trust the apt signing key `key`, fetched from the keyserver."""
+        self.keys = _unique(self.keys + [key])
+
+    def add_source(self, line):
+        """Add a line to the docker apt sources list."""
+        self.sources = _unique(self.sources + [line])
+
+    def add_deb_url(self, url, sha256=None):
+        """
+        Download the .deb at `url` and install it with dpkg, failing if
+        `sha256` is given and is not its hex digest.
+        """
+        self.deb_urls = _unique(self.deb_urls + [url])
+        if sha256:
+            self.deb_sha256[url] = sha256
+
+    def update(self):
+        """Update the package lists even if no source is added."""
+        self.refresh = True
+
+    def install(self, packages, optional=False):
+        """
+        Install `packages`. Optional packages are dropped when apt has no
+        candidate for them, instead of failing the whole install.
+        """
+        if optional:
+            self.optional = _unique(self.optional + packages)
+        else:
+            self.installs = _unique(self.installs + packages)
+
+    def download(self, packages):
+        """
+        Download `packages` and their dependencies to the apt cache without
+        installing them, so a later install does not wait on the network.
+        """
+        self.downloads = _unique(self.downloads + packages)
+
+    def allow_downgrades(self):
+        """Let the install replace packages with older versions."""
+        self.downgrades = True
+
+    def purge(self, packages):
+        """Purge `packages`, if they are installed."""
+        self.purges = _unique(self.purges + packages)
+
+    def hold(self, packages):
+        """Hold `packages` at their installed version, if they are installed."""
+        self.holds = _unique(self.holds + packages)
+
+    def unhold(self, packages):
+        """Release the hold on `packages`, if they are installed."""
+        self.unholds = _unique(self.unholds + packages)
+
+    def steps(self):
+        """
+        :return: List of (String description, callable) in execution order
+        """
+        steps = []
+        if self.unholds:
+            steps.append(
+                (
+                    "apt-mark unhold {}".format(" ".join(self.unholds)),
+                    lambda: apt_unhold(installed_packages(self.unholds)),
+                )
+            )
+        if self.purges:
+            steps.append(
+                (
+                    "apt-get purge {}".format(" ".join(self.purges)),
+                    lambda: apt_purge(installed_packages(self.purges)),
+                )
+            )
+        for url in self.key_urls:
+            steps.append((f"apt-key add {url}", lambda url=url: _add_key_url(url)))
+        if self.keys:
+            steps.append(
+                (
+                    "apt-key adv --recv-keys {}".format(" ".join(self.keys)),
+                    lambda: _add_keys(self.keys),
+                )
+            )
+        if self.sources:
+            steps.append(
+                (
+                    f"write {DOCKER_SOURCES}",
+                    lambda: write_docker_sources(self.sources),
+                )
+            )
+        if self.deb_urls:
+            steps.append(
+                (
+                    "dpkg -i {}".format(" ".join(self.deb_urls)),
+                    lambda: _install_debs(self.deb_urls, self.deb_sha256),
+                )
+            )
+        if self.refresh or self.key_urls or self.keys or self.sources or self.deb_urls:
+            steps.append(("apt-get update", lambda: apt_update(fatal=True)))
+        if self.downloads:
+            steps.append(
+                (
+                    "apt-get install --download-only {}".format(
+                        " ".join(self.downloads)
+                    ),
+                    lambda: apt_install(
+                        self.downloads,
+                        options=APT_OPTIONS
+                        + ["--download-only", "--allow-change-held-packages"],
+                        fatal=True,
+                    ),
+                )
+            )
+        if self.installs or self.optional:
+            steps.append(
+                (
+                    "apt-get install {}".format(
+                        " ".join(self.installs + self.optional)
+                    ),
+                    self._install,
+                )
+            )
+        if self.holds:
+            steps.append(
+                (
+                    "apt-mark hold {}".format(" ".join(self.holds)),
+                    lambda: apt_hold(installed_packages(self.holds)),
+                )
+            )
+        return steps
+
+    def dump(self):
+        """
+        :return: List String the operations execute() would run
+        """
+        return [description for description, _ in self.steps()]
+
+    def execute(self, dry_run=False):
+        """
+        Run the plan.
+
+        :param dry_run: Boolean only log the operations
+        :return: List String the operations that were run
+        """
+        done = []
+        for description, step in self.steps():
+            hookenv.log("{}{}".format("(dry run) " if dry_run else "", description))
+            if not dry_run:
+                step()
+            done.append(description)
+        return done
+
+    def _install(self):
+        optional = installable_packages(self.optional)
+        skipped = [p for p in self.optional if p not in optional]
+        if skipped:
+            hookenv.log("No installation candidate for {}.".format(", ".join(skipped)))
+        options = APT_OPTIONS + (["--allow-downgrades"] if self.downgrades else [])
+        apt_install(self.installs + optional, options=options, fatal=True)
+
+
+def write_docker_sources(debs):
+    """
+    Write docker.list under etc/apt/sources.list.d.
+
+    :param debs: List String
+    :return: None
+    """
+    # Run mkdir -p /etc/apt/sources.list.d.
+    if not os.path.isdir(os.path.dirname(DOCKER_SOURCES)):
+        os.makedirs(os.path.dirname(DOCKER_SOURCES))
+
+    # Write the docker source file to the apt sources.list.d directory.
+    with open(DOCKER_SOURCES, "w+") as stream:
+        stream.write("\n".join(debs))
+
+
+def _add_key_url(url):
+    """
+    Add a key from a URL, through the artifact cache.
+
+    :param url: String
+    :return: None
+    """
+    key = artifact_cache().fetch(url, max_age=KEY_MAX_AGE)
+    check_call(["apt-key", "add", key])
+
+
+def _add_keys(keys):
+    """
+    Enter the server and keys in the apt-key management tool.
+
+    :param keys: List String
+    :return: None
+    """
+    keyserver = hookenv.config("apt-key-server")
+    http_proxy = hookenv.config("http_proxy")
+    cmd = f"apt-key adv --keyserver {keyserver}"
+    if http_proxy:
+        cmd = f"{cmd} --keyserver-options http-proxy={http_proxy}"
+    cmd = f"{cmd} --recv-keys {' '.join(keys)}"
+
+    # "apt-key adv --keyserver hkp://p80.pool.sks-keyservers.net:80
+    # --recv-keys 58118E89F3A912897C070ADBF76221572C52609D"
+    check_call(split(cmd))
+
+
+def _install_debs(urls, sha256=None):
+    """
+    Fetch .deb packages through the artifact cache and install them with a
+    single dpkg call.
+
+    :param urls: List String
+    :param sha256: Dict String URL to the String hex digest its package
+      must have
+    :return: None
+    """
+    sha256 = sha256 or {}
+    cache = artifact_cache()
+    debs = [cache.fetch(url, sha256=sha256.get(url)) for url in urls]
+    check_call(["dpkg", "-i"] + debs)
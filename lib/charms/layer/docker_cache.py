@@ -0,0 +1,227 @@
+import contextlib
+import hashlib
+import json
+import os
+import time
+from urllib.error import HTTPError
+from urllib.error import URLError
+from urllib.request import Request
+from urllib.request import urlopen
+
+from charmhelpers.core import hookenv
+from charms.layer.docker import write_file
+
+# How long downloaded apt signing keys are trusted before they are fetched
+# again. Some of them, like nvidia's, are rotated frequently.
+KEY_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class ArtifactCacheError(Exception):
+    pass
+
+
+class ArtifactCache:
+    """
+    A content-addressed cache for downloaded artifacts, such as .deb
+    packages and apt signing keys.
+
+    Blobs are stored by sha256 under `directory`, with an index mapping
+    each URL to its blob. Interrupted downloads are resumed with range
+    requests, and the least recently used entries are evicted once the
+    blobs grow past `max_size` bytes. In `offline` mode nothing is
+    downloaded and only cached artifacts are served.
+    """
+
+    def __init__(self, directory, max_size, offline=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.offline = offline
+        self.index_path = os.path.join(directory, "index.json")
+
+    def fetch(self, url, sha256=None, max_age=None):
+        """
+        Return the path of the cached artifact for `url`, downloading it
+        first if needed.
+
+        :param url: String
+        :param sha256: String expected hex digest of the artifact
+        :param max_age: Number of seconds after which a cached artifact is
+          downloaded again, unless the cache is offline. It is still served
+          if that download fails.
+        :return: String path
+        """
+        index = self._load_index()
+        entry = index.get(url)
+        cached = entry if entry and self._valid(entry, sha256) else None
+        if cached:
+            stale = max_age is not None and time.time() - entry["fetched"] > max_age
+            if not stale or self.offline:
+                return self._use(index, url)
+
+        if self.offline:
+            raise ArtifactCacheError(f"{url} is not cached and the cache is offline.")
+
+        partial = os.path.join(
+            self.directory, "partial", hashlib.sha256(url.encode("utf-8")).hexdigest()
+        )
+        try:
+            self._download(url, partial)
+            digest, size = _digest(partial)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(f"{partial}.validator")
+            if sha256 and digest != sha256:
+                os.unlink(partial)
+                raise ArtifactCacheError(
+                    f"{url} has sha256 {digest}, expected {sha256}."
+                )
+        except ArtifactCacheError as e:
+            if not cached:
+                raise
+            # Better the copy we have than failing without the network.
+            hookenv.log(
+                "{} Using the copy cached {} seconds ago.".format(
+                    e, int(time.time() - cached["fetched"])
+                ),
+                hookenv.WARNING,
+            )
+            return self._use(index, url)
+        blob = self._blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.replace(partial, blob)
+
+        now = time.time()
+        index[url] = {"sha256": digest, "size": size, "fetched": now, "used": now}
+        self._evict(index)
+        self._save_index(index)
+        return blob
+
+    def _use(self, index, url):
+        """Record that the cached artifact for `url` was used, and return it."""
+        index[url]["used"] = time.time()
+        self._save_index(index)
+        return self._blob_path(index[url]["sha256"])
+
+    def _download(self, url, partial, resume=True):
+        os.makedirs(os.path.dirname(partial), exist_ok=True)
+        # The validator of the response the partial download came from.
+        validator_path = f"{partial}.validator"
+        validator = None
+        if resume and os.path.exists(partial):
+            with contextlib.suppress(OSError), open(validator_path) as f:
+                validator = f.read().strip() or None
+        # Without a validator, the partial download can not be told apart
+        # from a prefix of a different version of the file.
+        offset = os.path.getsize(partial) if validator else 0
+        request = Request(url)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+            # The server sends the whole file instead if it changed since.
+            request.add_header("If-Range", validator)
+
+        try:
+            response = urlopen(request, timeout=60)
+        except HTTPError as e:
+            if offset and e.code == 416:
+                # The partial download is not a prefix we can resume from.
+                return self._download(url, partial, resume=False)
+            raise ArtifactCacheError(f"Downloading {url} failed: {e}") from e
+        except URLError as e:
+            raise ArtifactCacheError(f"Downloading {url} failed: {e}") from e
+
+        mode = "ab" if offset and response.status == 206 else "wb"
+        if offset and mode == "ab":
+            hookenv.log(f"Resuming download of {url} at byte {offset}.")
+        else:
+            validator = _validator(response)
+            if validator:
+                write_file(validator_path, validator, perms=0o600)
+            elif os.path.exists(validator_path):
+                os.unlink(validator_path)
+        length = response.getheader("Content-Length")
+        received = 0
+        try:
+            with contextlib.closing(response), open(partial, mode) as f:
+                for chunk in iter(lambda: response.read(1024 * 1024), b""):
+                    f.write(chunk)
+                    received += len(chunk)
+        except OSError as e:
+            raise ArtifactCacheError(f"Downloading {url} failed: {e}") from e
+        if length is not None and received != int(length):
+            # Keep what was received, the next fetch resumes from there.
+            raise ArtifactCacheError(
+                f"Downloading {url} failed: got {received} of {length} bytes."
+            )
+
+    def _valid(self, entry, sha256):
+        if sha256 and entry["sha256"] != sha256:
+            return False
+        try:
+            return _digest(self._blob_path(entry["sha256"])) == (
+                entry["sha256"],
+                entry["size"],
+            )
+        except OSError:
+            return False
+
+    def _evict(self, index):
+        """Drop the least recently used entries until the blobs fit."""
+        sizes = {entry["sha256"]: entry["size"] for entry in index.values()}
+        by_use = sorted(index, key=lambda url: index[url]["used"])
+        while sum(sizes.values()) > self.max_size and len(by_use) > 1:
+            url = by_use.pop(0)
+            digest = index.pop(url)["sha256"]
+            if all(entry["sha256"] != digest for entry in index.values()):
+                hookenv.log(f"Evicting {url} from the artifact cache.")
+                sizes.pop(digest)
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(self._blob_path(digest))
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, "blobs", "sha256", digest)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        write_file(self.index_path, json.dumps(index, sort_keys=True), perms=0o600)
+
+
+def _validator(response):
+    """
+    :return: String the strong ETag or the Last-Modified date of the
+      response, usable in If-Range, or None
+    """
+    etag = response.getheader("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.getheader("Last-Modified")
+
+
+def _digest(path):
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+
+def artifact_cache():
+    """
+    :return: The ArtifactCache of this unit, configured from charm config
+    """
+    # Keep the cache next to, not inside, the charm directory so it
+    # survives charm upgrades.
+    directory = os.path.join(
+        os.path.dirname(os.path.abspath(hookenv.charm_dir())), "artifact-cache"
+    )
+    return ArtifactCache(
+        directory,
+        max_size=hookenv.config("artifact-cache-size") * 1024 * 1024,
+        offline=hookenv.config("artifact-cache-offline"),
+    )
@@ -0,0 +1,169 @@
+import os
+from subprocess import CalledProcessError
+from subprocess import check_call
+
+from charms.layer.docker import write_file
+
+CGROUP_DRIVERS = ("auto", "systemd", "cgroupfs")
+GRUB_DROPIN = "/etc/default/grub.d/60-charm-docker-cgroups.cfg"
+# Units whose cgroups get memory and tasks accounting. On the unified
+# hierarchy systemd only enables a controller along the path to a unit
+# that asks for it, which is how it reaches the containers under them.
+ACCOUNTING_UNITS = ("containerd.service", "docker.service")
+ACCOUNTING_PROPERTIES = ("MemoryAccounting=yes", "TasksAccounting=yes")
+
+
+def cgroup_hierarchy(root="/"):
+    """
+    :param root: String root of the /sys tree to read
+    :return: String `unified` for cgroup v2 only, `hybrid` for the v1
+      controllers with cgroup v2 mounted alongside, or `v1`
+    """
+    cgroup = os.path.join(root, "sys/fs/cgroup")
+    if os.path.exists(os.path.join(cgroup, "cgroup.controllers")):
+        return "unified"
+    if os.path.exists(os.path.join(cgroup, "unified", "cgroup.controllers")):
+        return "hybrid"
+    return "v1"
+
+
+def controllers(hierarchy, root="/"):
+    """
+    :param hierarchy: String from cgroup_hierarchy()
+    :param root: String root of the /proc and /sys trees to read
+    :return: Set String names of the controllers the kernel has enabled
+    """
+    if hierarchy == "unified":
+        with open(os.path.join(root, "sys/fs/cgroup/cgroup.controllers")) as f:
+            return set(f.read().split())
+    enabled = set()
+    with open(os.path.join(root, "proc/cgroups")) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            # subsys_name hierarchy num_cgroups enabled
+            fields = line.split()
+            if len(fields) == 4 and fields[3] == "1":
+                enabled.add(fields[0])
+    return enabled
+
+
+def swap_accounting(hierarchy, root="/"):
+    """
+    :param hierarchy: String from cgroup_hierarchy()
+    :param root: String root of the /sys tree to read
+    :return: Boolean True if swap usage is accounted and can be limited
+    """
+    cgroup = os.path.join(root, "sys/fs/cgroup")
+    if hierarchy == "unified":
+        # The root cgroup has no memory files, look at a child instead.
+        path = os.path.join(cgroup, "system.slice", "memory.swap.max")
+    else:
+        path = os.path.join(cgroup, "memory", "memory.memsw.limit_in_bytes")
+    return os.path.exists(path)
+
+
+def init_system(root="/"):
+    """
+    :param root: String root of the /proc tree to read
+    :return: String name of PID 1, e.g. systemd
+    """
+    try:
+        with open(os.path.join(root, "proc/1/comm")) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def cgroup_driver(setting, hierarchy, init):
+    """
+    Pick the cgroup driver. With `auto`, systemd manages the container
+    cgroups when it is the init system and cgroup v2 is the only hierarchy,
+    where a second manager of the cgroup tree next to systemd is not
+    supported. Otherwise the daemon's default, cgroupfs, is kept.
+
+    :param setting: String one of CGROUP_DRIVERS
+    :param hierarchy: String from cgroup_hierarchy()
+    :param init: String from init_system()
+    :return: String `systemd` or `cgroupfs`
+    """
+    if setting not in CGROUP_DRIVERS:
+        raise ValueError(
+            "Invalid cgroup-driver {}, expected one of {}.".format(
+                setting, ", ".join(CGROUP_DRIVERS)
+            )
+        )
+    if setting == "systemd" and init != "systemd":
+        raise ValueError("cgroup-driver systemd needs systemd as init system.")
+    if setting == "auto":
+        if init == "systemd" and hierarchy == "unified":
+            return "systemd"
+        return "cgroupfs"
+    return setting
+
+
+def kernel_cmdline(root="/"):
+    """
+    :param root: String root of the /proc tree to read
+    :return: List String kernel command line arguments
+    """
+    with open(os.path.join(root, "proc/cmdline")) as f:
+        return f.read().split()
+
+
+def required_cmdline(root="/"):
+    """
+    Find the kernel command line arguments memory and swap accounting still
+    need. Nothing is needed when the running kernel provides them already,
+    which recent kernels do by default.
+
+    :param root: String root of the /proc and /sys trees to read
+    :return: List String arguments to add, empty if no reboot is needed
+    """
+    hierarchy = cgroup_hierarchy(root)
+    arguments = []
+    if "memory" not in controllers(hierarchy, root):
+        arguments.append("cgroup_enable=memory")
+        # Swap accounting comes with the memory controller.
+        arguments.append("swapaccount=1")
+    elif not swap_accounting(hierarchy, root):
+        arguments.append("swapaccount=1")
+    cmdline = kernel_cmdline(root)
+    return [argument for argument in arguments if argument not in cmdline]
+
+
+def set_accounting():
+    """
+    Turn on memory and tasks accounting for the container runtime units,
+    which takes effect without restarting them.
+
+    :return: List String units it could not be set on
+    """
+    failed = []
+    for unit in ACCOUNTING_UNITS:
+        try:
+            check_call(
+                ["systemctl", "set-property", unit] + list(ACCOUNTING_PROPERTIES)
+            )
+        except CalledProcessError:
+            failed.append(unit)
+    return failed
+
+
+def write_grub_cmdline(arguments):
+    """
+    Add arguments to the kernel command line with a GRUB drop-in, which
+    leaves /etc/default/grub and whatever it sets alone.
+
+    :param arguments: List String kernel command line arguments
+    :return: Boolean True if the drop-in changed
+    """
+    content = (
+        "# Managed by the docker charm, enable-cgroups.\n"
+        'GRUB_CMDLINE_LINUX="$GRUB_CMDLINE_LINUX {}"\n'.format(" ".join(arguments))
+    )
+    os.makedirs(os.path.dirname(GRUB_DROPIN), exist_ok=True)
+    changed = write_file(GRUB_DROPIN, content, perms=0o644)
+    if changed:
+        check_call(["update-grub"])
+    return changed
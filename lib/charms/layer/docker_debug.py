@@ -0,0 +1,134 @@
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from charms.layer import docker_engine
+
+
+class _Budget:
+    """A byte budget shared by the log collection workers."""
+
+    def __init__(self, limit):
+        self.remaining = limit
+        self.lock = threading.Lock()
+
+    def take(self, wanted):
+        """:return: Integer bytes granted, at most `wanted`"""
+        with self.lock:
+            granted = max(min(wanted, self.remaining), 0)
+            self.remaining -= granted
+            return granted
+
+
+def _iter_log_chunks(response, tty):
+    """
+    Yield the payloads of a container log stream. Unless the container has
+    a TTY, the engine multiplexes stdout and stderr into frames prefixed
+    with an 8 byte header holding the payload size.
+    """
+    if tty:
+        yield from iter(lambda: response.read(64 * 1024), b"")
+        return
+
+    for header in iter(lambda: response.read(8), b""):
+        if len(header) < 8:
+            return
+        size = struct.unpack(">xxxxL", header)[0]
+        while size:
+            chunk = response.read(min(size, 64 * 1024))
+            if not chunk:
+                return
+            size -= len(chunk)
+            yield chunk
+
+
+def _collect(container, output_dir, params, budget, socket_path):
+    name = (
+        container["Names"][0].lstrip("/") if container.get("Names") else container["Id"]
+    )
+    record = {"name": name, "id": container["Id"], "bytes": 0, "truncated": False}
+    start = time.monotonic()
+    try:
+        info = docker_engine.request(
+            "GET",
+            "/containers/{}/json".format(container["Id"]),
+            socket_path=socket_path,
+        )
+        tty = info.get("Config", {}).get("Tty", False)
+        path = os.path.join(output_dir, f"{name}.log.gz")
+        with docker_engine.stream(
+            "GET",
+            "/containers/{}/logs".format(container["Id"]),
+            params=params,
+            socket_path=socket_path,
+            timeout=60,
+        ) as response, gzip.open(path, "wb") as f:
+            for chunk in _iter_log_chunks(response, tty):
+                granted = budget.take(len(chunk))
+                f.write(chunk[:granted])
+                record["bytes"] += granted
+                if granted < len(chunk):
+                    record["truncated"] = True
+                    break
+    except (docker_engine.EngineError, OSError) as e:
+        record["error"] = str(e)
+    record["seconds"] = round(time.monotonic() - start, 3)
+    return record
+
+
+def collect_container_logs(
+    output_dir,
+    tail=None,
+    since=None,
+    max_bytes=None,
+    workers=8,
+    socket_path=docker_engine.DOCKER_SOCKET,
+):
+    """
+    Fetch the logs of every container from a pool of workers, streaming
+    each into a gzip file in `output_dir`, and write per container timings
+    to timings.json.
+
+    :param output_dir: String directory to write the logs to
+    :param tail: Integer number of lines to keep per container, or None
+    :param since: Integer only keep logs from the last `since` seconds
+    :param max_bytes: Integer total uncompressed bytes to collect; logs
+      are truncated once it is spent
+    :param workers: Integer number of containers fetched concurrently
+    :param socket_path: String path of the engine socket
+    :return: List of Dict with the name, id, bytes, seconds and whether the
+      log was truncated, or the error, for every container. Empty if the
+      containers could not be listed, with the error written to `error`
+      in `output_dir`
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    params = {"stdout": "1", "stderr": "1", "tail": str(tail) if tail else "all"}
+    if since:
+        params["since"] = str(int(time.time()) - since)
+    budget = _Budget(max_bytes if max_bytes is not None else float("inf"))
+
+    try:
+        containers = docker_engine.request(
+            "GET", "/containers/json", params={"all": "1"}, socket_path=socket_path
+        )
+    except docker_engine.EngineError as e:
+        # The engine being down is when the rest of the debug output is
+        # needed most, so record why there are no logs rather than fail.
+        with open(os.path.join(output_dir, "error"), "w") as f:
+            f.write(f"Listing the containers failed: {e}\n")
+        return []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        records = list(
+            pool.map(
+                lambda c: _collect(c, output_dir, params, budget, socket_path),
+                containers,
+            )
+        )
+
+    with open(os.path.join(output_dir, "timings.json"), "w") as f:
+        json.dump(records, f, indent=2)
+    return records
@@ -0,0 +1,163 @@
+import contextlib
+import http.client
+import json
+import socket
+import time
+from urllib.parse import urlencode
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+
+class EngineError(Exception):
+    """
+    Raised when the docker engine API can not be reached or returns an
+    error status.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+def _request_path(path, params):
+    if not params:
+        return path
+    query = []
+    for key, value in params.items():
+        if isinstance(value, list):
+            # Repeated parameters, e.g. names for /images/get.
+            query += [(key, v) for v in value]
+        else:
+            query.append((key, value if isinstance(value, str) else json.dumps(value)))
+    return f"{path}?{urlencode(query)}"
+
+
+@contextlib.contextmanager
+def stream(method, path, params=None, body=None, socket_path=DOCKER_SOCKET, timeout=5):
+    """
+    Make a request to the docker engine API and yield the response before
+    its body is read, so large or streamed bodies such as container logs
+    can be consumed incrementally.
+
+    :param method: String HTTP method
+    :param path: String API path, e.g. /_ping
+    :param params: Dict of query parameters, lists are repeated and other
+      values that are not strings are json encoded as the engine expects
+      for filters
+    :param body: json-serializable request body, or a binary file object
+      streamed as a tar archive
+    :param socket_path: String path of the engine socket
+    :param timeout: Number of seconds to wait for the engine
+    :return: Context manager of http.client.HTTPResponse
+    """
+    path = _request_path(path, params)
+    headers = {}
+    if hasattr(body, "read"):
+        # http.client sends file objects in chunks as they are read.
+        headers["Content-Type"] = "application/x-tar"
+    elif body is not None:
+        body = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+
+    conn = _UnixHTTPConnection(socket_path, timeout)
+    try:
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            if response.status >= 400:
+                data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise EngineError(f"{method} {path} failed: {e}") from e
+
+        if response.status >= 400:
+            raise EngineError(
+                "{} {} returned {}: {}".format(
+                    method, path, response.status, data.decode("utf-8", "replace")
+                ),
+                status=response.status,
+            )
+        yield response
+    finally:
+        conn.close()
+
+
+def request(method, path, params=None, body=None, socket_path=DOCKER_SOCKET, timeout=5):
+    """
+    Make a request to the docker engine API on its unix socket.
+
+    :param method: String HTTP method
+    :param path: String API path, e.g. /_ping
+    :param params: Dict of query parameters, lists are repeated and other
+      values that are not strings are json encoded as the engine expects
+      for filters
+    :param body: json-serializable request body, or a binary file object
+      streamed as a tar archive
+    :param socket_path: String path of the engine socket
+    :param timeout: Number of seconds to wait for the engine
+    :return: The decoded json response, or the raw bytes if it is not json
+    """
+    with stream(method, path, params, body, socket_path, timeout) as response:
+        try:
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise EngineError(f"{method} {path} failed: {e}") from e
+
+    if response.getheader("Content-Type", "").startswith("application/json"):
+        return json.loads(data)
+    return data
+
+
+def ping(socket_path=DOCKER_SOCKET, timeout=1):
+    """
+    Check if the engine answers on its socket.
+
+    :param socket_path: String path of the engine socket
+    :param timeout: Number of seconds to wait for the answer
+    :return: Boolean
+    """
+    try:
+        return request("GET", "/_ping", socket_path=socket_path, timeout=timeout) == (
+            b"OK"
+        )
+    except EngineError:
+        return False
+
+
+def wait_for_engine(deadline=30, socket_path=DOCKER_SOCKET, initial=0.1, maximum=2):
+    """
+    Ping the engine until it answers, backing off exponentially between
+    attempts, or until `deadline` seconds have passed.
+
+    :param deadline: Number of seconds to keep trying
+    :param socket_path: String path of the engine socket
+    :param initial: Number of seconds to wait after the first failure
+    :param maximum: Number of seconds the wait between attempts grows to
+    :return: Number of seconds it took the engine to answer, or None
+    """
+    start = time.monotonic()
+    delay = initial
+    while True:
+        remaining = deadline - (time.monotonic() - start)
+        if ping(socket_path, timeout=max(min(remaining, 1), 0.01)):
+            return time.monotonic() - start
+        remaining = deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, maximum)
@@ -0,0 +1,285 @@
+import fnmatch
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.templating import render
+from charms.layer import docker_engine
+from charms.layer.docker import write_file
+
+
+def _container_name(container):
+    names = container.get("Names") or ["/" + container["Id"][:12]]
+    return names[0].lstrip("/")
+
+
+def list_removable_containers(
+    min_age=None,
+    labels=None,
+    name_pattern=None,
+    socket_path=docker_engine.DOCKER_SOCKET,
+):
+    """
+    List the exited and dead containers, never running ones.
+
+    :param min_age: Integer only containers created at least this many
+      seconds ago
+    :param labels: List String label filters, `key` or `key=value`
+    :param name_pattern: String shell pattern the container name must match
+    :param socket_path: String path of the engine socket
+    :return: List of engine API container summaries, including SizeRw
+    """
+    filters = {"status": ["exited", "dead"]}
+    if labels:
+        filters["label"] = labels
+    containers = docker_engine.request(
+        "GET",
+        "/containers/json",
+        params={"all": "1", "size": "1", "filters": filters},
+        socket_path=socket_path,
+        timeout=60,
+    )
+
+    now = time.time()
+    return [
+        c
+        for c in containers
+        if (min_age is None or now - c.get("Created", now) >= min_age)
+        and (name_pattern is None or fnmatch.fnmatch(_container_name(c), name_pattern))
+    ]
+
+
+def remove_containers(
+    containers, workers=8, dry_run=False, socket_path=docker_engine.DOCKER_SOCKET
+):
+    """
+    Remove containers from a bounded pool of workers.
+
+    :param containers: List of container summaries from
+      list_removable_containers()
+    :param workers: Integer number of concurrent removals
+    :param dry_run: Boolean only report what would be removed
+    :param socket_path: String path of the engine socket
+    :return: Dict with the `removed` names, `failed` names mapped to their
+      error, the `bytes` reclaimed and the `seconds` it took
+    """
+    start = time.monotonic()
+
+    def remove(container):
+        if not dry_run:
+            docker_engine.request(
+                "DELETE",
+                "/containers/{}".format(container["Id"]),
+                socket_path=socket_path,
+                timeout=60,
+            )
+        return container
+
+    result = {"removed": [], "failed": {}, "bytes": 0}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = [(c, pool.submit(remove, c)) for c in containers]
+        for container, future in futures:
+            try:
+                future.result()
+            except docker_engine.EngineError as e:
+                result["failed"][_container_name(container)] = str(e)
+                continue
+            result["removed"].append(_container_name(container))
+            result["bytes"] += container.get("SizeRw", 0)
+
+    result["seconds"] = round(time.monotonic() - start, 3)
+    return result
+
+
+IMAGE_GC_CONFIG = "/etc/docker/image-gc.json"
+IMAGE_GC_STATE = "/var/lib/docker-image-gc/state.json"
+IMAGE_GC_SERVICE = "/etc/systemd/system/docker-image-gc.service"
+IMAGE_GC_TIMER = "/etc/systemd/system/docker-image-gc.timer"
+
+
+def disk_usage(path):
+    """
+    :param path: String a path on the filesystem
+    :return: Tuple of Integer (used, total) bytes of the filesystem
+    """
+    st = os.statvfs(path)
+    total = st.f_blocks * st.f_frsize
+    return total - st.f_bavail * st.f_frsize, total
+
+
+def data_root(socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    :param socket_path: String path of the engine socket
+    :return: String the engine's data-root, e.g. /var/lib/docker
+    """
+    info = docker_engine.request("GET", "/info", socket_path=socket_path)
+    return info.get("DockerRootDir", "/var/lib/docker")
+
+
+def list_unused_images(dangling_only=False, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    List the images no container, running or not, is created from.
+
+    :param dangling_only: Boolean only untagged images
+    :param socket_path: String path of the engine socket
+    :return: Tuple of (List of engine API image summaries, Set String ids of
+      the images in use)
+    """
+    params = {"filters": {"dangling": ["true"]}} if dangling_only else None
+    images = docker_engine.request(
+        "GET", "/images/json", params=params, socket_path=socket_path, timeout=60
+    )
+    containers = docker_engine.request(
+        "GET", "/containers/json", params={"all": "1"}, socket_path=socket_path
+    )
+    in_use = {c["ImageID"] for c in containers}
+    return [i for i in images if i["Id"] not in in_use], in_use
+
+
+def _image_tags(image):
+    return [t for t in image.get("RepoTags") or [] if t != "<none>:<none>"]
+
+
+def is_protected(image, protected):
+    """
+    :param image: Dict engine API image summary
+    :param protected: List String image references or shell patterns, e.g.
+      registry.k8s.io/pause:*
+    :return: Boolean True if any tag or the id of `image` matches
+    """
+    names = _image_tags(image) + [image["Id"], image["Id"].split(":")[-1]]
+    return any(fnmatch.fnmatch(n, p) for n in names for p in protected)
+
+
+def remove_image(image, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Remove an image by untagging each of its tags, so that an image
+    referenced by several repositories is removed without forcing.
+
+    :param image: Dict engine API image summary
+    :param socket_path: String path of the engine socket
+    :return: None
+    """
+    for reference in _image_tags(image) or [image["Id"]]:
+        docker_engine.request(
+            "DELETE",
+            f"/images/{reference}",
+            socket_path=socket_path,
+            timeout=60,
+        )
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def run_image_gc(
+    high=85,
+    low=80,
+    protected=(),
+    force=False,
+    state_path=IMAGE_GC_STATE,
+    socket_path=docker_engine.DOCKER_SOCKET,
+):
+    """
+    Remove unused images, least recently used first, once the disk holding
+    the docker data-root is more than `high` percent used, until it is
+    back under `low` percent.
+
+    Docker does not record when an image was last used, so every run
+    records the time it saw each image in use by a container in
+    `state_path`. Images never seen in use are ordered by creation time.
+
+    :param high: Number disk usage percentage that triggers a collection
+    :param low: Number disk usage percentage to collect down to
+    :param protected: List String image references or patterns never removed
+    :param force: Boolean collect down to `low` even under `high`
+    :param state_path: String file recording when images were last used
+    :param socket_path: String path of the engine socket
+    :return: Dict with the `usage-before` and `usage-after` percentages,
+      the `removed` references, `failed` references mapped to their error,
+      the `bytes` reclaimed and the `seconds` it took
+    """
+    start = time.monotonic()
+    root = data_root(socket_path)
+    used, total = disk_usage(root)
+    result = {
+        "usage-before": round(100.0 * used / total, 1),
+        "removed": [],
+        "failed": {},
+        "bytes": 0,
+    }
+
+    state = _load_state(state_path)
+    last_used = state.get("last-used", {})
+    images, in_use = list_unused_images(socket_path=socket_path)
+    now = time.time()
+    for image_id in in_use:
+        last_used[image_id] = now
+
+    if force or used * 100.0 >= high * total:
+        to_free = used - total * low / 100.0
+        candidates = sorted(
+            (i for i in images if not is_protected(i, protected)),
+            key=lambda i: last_used.get(i["Id"], i.get("Created", 0)),
+        )
+        freed = 0
+        for image in candidates:
+            if freed >= to_free:
+                break
+            reference = (_image_tags(image) or [image["Id"]])[0]
+            try:
+                remove_image(image, socket_path)
+            except docker_engine.EngineError as e:
+                result["failed"][reference] = str(e)
+                continue
+            result["removed"].append(reference)
+            last_used.pop(image["Id"], None)
+            freed += image.get("Size", 0)
+
+    after, _ = disk_usage(root)
+    result["usage-after"] = round(100.0 * after / total, 1)
+    result["bytes"] = max(used - after, 0)
+    result["seconds"] = round(time.monotonic() - start, 3)
+
+    known = {i["Id"] for i in images} | in_use
+    state["last-used"] = {k: v for k, v in last_used.items() if k in known}
+    state["last-run"] = dict(result, time=now)
+    write_file(state_path, json.dumps(state), perms=0o600)
+    return result
+
+
+def render_image_gc(high, low, protected, interval):
+    """
+    Write the settings the image GC timer runs with, and its systemd
+    service and timer units.
+
+    :param high: Number disk usage percentage that triggers a collection
+    :param low: Number disk usage percentage to collect down to
+    :param protected: List String image references or patterns never removed
+    :param interval: String systemd time span between runs, e.g. 5m
+    :return: Boolean True if a systemd unit changed
+    """
+    if not 0 <= low < high:
+        raise ValueError(
+            f"Image GC low threshold {low} must be under the high threshold {high}."
+        )
+    settings = {"high": high, "low": low, "protected": protected}
+    write_file(IMAGE_GC_CONFIG, json.dumps(settings, sort_keys=True), perms=0o644)
+
+    context = {"charm_dir": hookenv.charm_dir(), "interval": interval}
+    changed = write_file(
+        IMAGE_GC_SERVICE,
+        render("docker-image-gc.service", None, context),
+        perms=0o644,
+    )
+    changed |= write_file(
+        IMAGE_GC_TIMER, render("docker-image-gc.timer", None, context), perms=0o644
+    )
+    return changed
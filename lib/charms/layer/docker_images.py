@@ -0,0 +1,381 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import PIPE
+from subprocess import Popen
+
+from charms.layer import docker_engine
+from charms.layer.docker import DAEMON_JSON
+from charms.layer.docker import write_file
+
+# dockerd's own default for max-concurrent-downloads.
+DEFAULT_CONCURRENT_DOWNLOADS = 3
+
+
+def max_concurrent_downloads(daemon_json=DAEMON_JSON):
+    """
+    :param daemon_json: String path of the daemon configuration
+    :return: Integer number of layers the daemon downloads at once
+    """
+    try:
+        with open(daemon_json) as f:
+            value = json.load(f).get("max-concurrent-downloads")
+    except (OSError, ValueError):
+        value = None
+    return int(value or DEFAULT_CONCURRENT_DOWNLOADS)
+
+
+def image_present(reference, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Check whether the image `reference` points at is present already.
+
+    A reference pinned by digest is present as soon as the engine knows it.
+    For a tag, the digest the registry currently serves for it is compared
+    with those of the local image, so a moved tag is pulled again. When the
+    registry does not answer, the local image is used as it is.
+
+    :param reference: String image reference, e.g. nginx:1.25
+    :param socket_path: String path of the engine socket
+    :return: Boolean
+    """
+    try:
+        image = docker_engine.request(
+            "GET", f"/images/{reference}/json", socket_path=socket_path
+        )
+    except docker_engine.EngineError as e:
+        if e.status != 404:
+            raise
+        return False
+    if "@" in reference:
+        return True
+
+    try:
+        remote = docker_engine.request(
+            "GET",
+            f"/distribution/{reference}/json",
+            socket_path=socket_path,
+            timeout=30,
+        )
+    except docker_engine.EngineError:
+        return True
+    digest = (remote.get("Descriptor") or {}).get("digest")
+    return any(local.endswith(f"@{digest}") for local in image.get("RepoDigests") or [])
+
+
+def pull_image(reference, socket_path=docker_engine.DOCKER_SOCKET, timeout=600):
+    """
+    Pull an image through the engine API, following its progress stream.
+
+    :param reference: String image reference, pulled at the latest tag if
+      it has neither a tag nor a digest
+    :param socket_path: String path of the engine socket
+    :param timeout: Number of seconds to wait for each progress update
+    :return: Dict with the `bytes` downloaded, the number of `layers`,
+      how many of them were `cached` already, and the `seconds` it took
+    """
+    start = time.monotonic()
+    sizes = {}
+    cached = set()
+    if "@" in reference:
+        params = {"fromImage": reference}
+    else:
+        # Without a tag, the engine pulls every tag of the repository.
+        repo, tag = _split_reference(reference)
+        params = {"fromImage": repo, "tag": tag}
+    with docker_engine.stream(
+        "POST",
+        "/images/create",
+        params=params,
+        socket_path=socket_path,
+        timeout=timeout,
+    ) as response:
+        # The engine streams one json object per progress update, and
+        # reports failures in it after answering 200.
+        for line in response:
+            if not line.strip():
+                continue
+            progress = json.loads(line)
+            if "error" in progress:
+                raise docker_engine.EngineError(
+                    "Pulling {} failed: {}".format(reference, progress["error"])
+                )
+            layer = progress.get("id")
+            status = progress.get("status", "")
+            if layer is None:
+                continue
+            if status == "Already exists":
+                cached.add(layer)
+            elif status == "Downloading":
+                total = (progress.get("progressDetail") or {}).get("total")
+                if total:
+                    sizes[layer] = total
+            elif status == "Pulling fs layer":
+                sizes.setdefault(layer, 0)
+    return {
+        "bytes": sum(sizes.values()),
+        "layers": len(sizes) + len(cached),
+        "cached": len(cached),
+        "seconds": round(time.monotonic() - start, 3),
+    }
+
+
+def prefetch_images(references, workers=None, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Pull images concurrently, skipping those present already.
+
+    The daemon downloads at most max-concurrent-downloads layers at once
+    across all pulls, so by default as many images are pulled at once;
+    more would only queue up in the daemon.
+
+    :param references: List String image references
+    :param workers: Integer number of images to pull at once, defaults to
+      max-concurrent-downloads
+    :param socket_path: String path of the engine socket
+    :return: Dict image reference to a Dict with whether it was a cache
+      `hit`, the `bytes` downloaded and the `seconds` it took, or with the
+      `error` its pull failed with
+    """
+    if workers is None:
+        workers = max_concurrent_downloads()
+
+    def prefetch(reference):
+        start = time.monotonic()
+        if image_present(reference, socket_path):
+            return {
+                "hit": True,
+                "bytes": 0,
+                "seconds": round(time.monotonic() - start, 3),
+            }
+        result = pull_image(reference, socket_path)
+        result["hit"] = False
+        result["seconds"] = round(time.monotonic() - start, 3)
+        return result
+
+    results = {}
+    references = list(dict.fromkeys(references))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = [(r, pool.submit(prefetch, r)) for r in references]
+        for reference, future in futures:
+            try:
+                results[reference] = future.result()
+            except docker_engine.EngineError as e:
+                results[reference] = {"error": str(e)}
+    return results
+
+
+IMAGE_CACHE_DIR = "/var/lib/docker-image-cache"
+IMAGE_CACHE_INDEX = "index.json"
+_CHUNK = 1024 * 1024
+
+
+class ImageCacheError(Exception):
+    pass
+
+
+def _compress(response, path):
+    """
+    Compress the archive streamed in `response` to `path` with zstd, so
+    nothing uncompressed touches the disk.
+
+    :return: Integer size of the compressed archive
+    """
+    tmp = f"{path}.partial"
+    try:
+        with open(tmp, "wb") as f:
+            process = Popen(["zstd", "-q", "-T0", "-c"], stdin=PIPE, stdout=f)
+            try:
+                for chunk in iter(lambda: response.read(_CHUNK), b""):
+                    process.stdin.write(chunk)
+            finally:
+                process.stdin.close()
+                returncode = process.wait()
+        if returncode:
+            raise ImageCacheError(f"Compressing {path} failed.")
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return os.path.getsize(path)
+
+
+def _read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, IMAGE_CACHE_INDEX)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_image_cache(
+    references, cache_dir=IMAGE_CACHE_DIR, socket_path=docker_engine.DOCKER_SOCKET
+):
+    """
+    Export images to a content addressed cache: one zstd compressed
+    `docker save` archive per image, named after the image id, and an
+    index of the references pointing at each. An image whose archive is
+    in the cache already is not exported again, whichever reference it
+    is saved under.
+
+    :param references: List String image references
+    :param cache_dir: String cache directory
+    :param socket_path: String path of the engine socket
+    :return: Dict image reference to a Dict with its `id`, whether it was
+      a cache `hit`, the archive's `bytes` and the `seconds` it took
+    """
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    index = _read_index(cache_dir)
+    results = {}
+    for reference in dict.fromkeys(references):
+        start = time.monotonic()
+        image_id = docker_engine.request(
+            "GET", f"/images/{reference}/json", socket_path=socket_path
+        )["Id"]
+        path = os.path.join(cache_dir, "{}.tar.zst".format(image_id.split(":")[-1]))
+        hit = os.path.exists(path)
+        if not hit:
+            with docker_engine.stream(
+                "GET",
+                f"/images/{image_id}/get",
+                socket_path=socket_path,
+                timeout=600,
+            ) as response:
+                _compress(response, path)
+        index[reference] = image_id
+        results[reference] = {
+            "id": image_id,
+            "hit": hit,
+            "bytes": os.path.getsize(path),
+            "seconds": round(time.monotonic() - start, 3),
+        }
+    write_file(
+        os.path.join(cache_dir, IMAGE_CACHE_INDEX),
+        json.dumps(index, indent=2, sort_keys=True),
+        perms=0o600,
+    )
+    return results
+
+
+def save_image_archive(references, path, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Export images to a single zstd compressed `docker save` archive, which
+    keeps their tags, e.g. to attach as the image-cache resource.
+
+    :param references: List String image references
+    :param path: String archive path
+    :param socket_path: String path of the engine socket
+    :return: Integer size of the archive
+    """
+    with docker_engine.stream(
+        "GET",
+        "/images/get",
+        params={"names": list(references)},
+        socket_path=socket_path,
+        timeout=600,
+    ) as response:
+        return _compress(response, path)
+
+
+def load_image_archive(path, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Load a zstd compressed `docker save` archive, decompressing it straight
+    into the engine instead of to disk first.
+
+    :param path: String archive path
+    :param socket_path: String path of the engine socket
+    :return: List String images loaded, tags or ids of untagged images
+    """
+    process = Popen(["zstd", "-q", "-d", "-c", path], stdout=PIPE)
+    loaded = []
+    try:
+        with docker_engine.stream(
+            "POST",
+            "/images/load",
+            params={"quiet": "1"},
+            body=process.stdout,
+            socket_path=socket_path,
+            timeout=600,
+        ) as response:
+            for line in response:
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if "error" in message:
+                    raise ImageCacheError(
+                        "Loading {} failed: {}".format(path, message["error"])
+                    )
+                text = message.get("stream", "").strip()
+                for prefix in ("Loaded image: ", "Loaded image ID: "):
+                    if text.startswith(prefix):
+                        loaded.append(text[len(prefix) :])
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise ImageCacheError(f"Decompressing {path} failed.")
+    return loaded
+
+
+def _split_reference(reference):
+    """:return: Tuple of String repository and tag"""
+    name, _, tag = reference.rpartition(":")
+    if not name or "/" in tag:
+        return reference, "latest"
+    return name, tag
+
+
+def load_image_cache(source=IMAGE_CACHE_DIR, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Load images from a cache written by save_image_cache(), skipping those
+    the engine has already, and tag them as they were saved. `source` may
+    also be a single archive from save_image_archive().
+
+    :param source: String cache directory or archive path
+    :param socket_path: String path of the engine socket
+    :return: Dict with the images `loaded`, the number of cache `hits`,
+      the references whose archive is `missing`, the `bytes` read and the
+      `seconds` it took
+    """
+    if not os.path.exists(source):
+        raise ImageCacheError(f"There is no image cache at {source}.")
+    start = time.monotonic()
+    result = {"loaded": [], "hits": 0, "missing": [], "bytes": 0}
+    if os.path.isfile(source):
+        result["loaded"] = load_image_archive(source, socket_path)
+        result["bytes"] = os.path.getsize(source)
+        result["seconds"] = round(time.monotonic() - start, 3)
+        return result
+
+    references = {}
+    for reference, image_id in _read_index(source).items():
+        references.setdefault(image_id, []).append(reference)
+    for image_id, names in sorted(references.items()):
+        path = os.path.join(source, "{}.tar.zst".format(image_id.split(":")[-1]))
+        try:
+            docker_engine.request(
+                "GET", f"/images/{image_id}/json", socket_path=socket_path
+            )
+            result["hits"] += 1
+        except docker_engine.EngineError as e:
+            if e.status != 404:
+                raise
+            if not os.path.exists(path):
+                result["missing"] += names
+                continue
+            load_image_archive(path, socket_path)
+            result["loaded"].append(image_id)
+            result["bytes"] += os.path.getsize(path)
+        for name in names:
+            # Images pulled by digest can not be tagged, their id is enough.
+            if "@" in name:
+                continue
+            repo, tag = _split_reference(name)
+            docker_engine.request(
+                "POST",
+                f"/images/{image_id}/tag",
+                params={"repo": repo, "tag": tag},
+                socket_path=socket_path,
+            )
+    result["seconds"] = round(time.monotonic() - start, 3)
+    return result
@@ -0,0 +1,71 @@
+import os
+import re
+
+LOG_DRIVERS = ("local", "json-file")
+MIB = 1024 * 1024
+
+# Rotated files kept per container, fewer when the budget is tight.
+_MAX_FILES = 5
+_MIN_FILES = 2
+# Smaller files rotate too often under chatty containers, larger ones
+# are not worth it: the budget is spent on fewer, older lines.
+_MIN_FILE_SIZE = MIB
+_MAX_FILE_SIZE = 100 * MIB
+_UNITS = {"": 1, "k": 1024, "m": MIB, "g": 1024 * MIB, "t": 1024 * 1024 * MIB}
+
+
+def parse_budget(value, total):
+    """
+    :param value: String size, e.g. 20G or 512M, or percentage of `total`,
+      e.g. 10%
+    :param total: Integer bytes of the filesystem holding the logs
+    :return: Integer bytes
+    """
+    value = str(value).strip().lower()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*(%|[kmgt]?)i?b?", value)
+    if not match:
+        raise ValueError(
+            f"Invalid log-disk-budget {value!r}, expected e.g. 10% or 20G."
+        )
+    number, unit = float(match.group(1)), match.group(2)
+    if unit == "%":
+        return int(total * number / 100)
+    return int(number * _UNITS[unit])
+
+
+def filesystem_size(path):
+    """
+    :param path: String a path, which need not exist yet
+    :return: Integer bytes of the filesystem it is, or will be, on
+    """
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    st = os.statvfs(path)
+    return st.f_blocks * st.f_frsize
+
+
+def log_policy(driver, budget, containers):
+    """
+    Size container log rotation so that `containers` containers together
+    keep at most `budget` bytes of logs.
+
+    :param driver: String one of LOG_DRIVERS
+    :param budget: Integer bytes of logs the node may keep
+    :param containers: Integer number of containers expected on the node
+    :return: Dict of the log-driver and log-opts daemon.json keys
+    """
+    if driver not in LOG_DRIVERS:
+        raise ValueError(
+            "Invalid log-driver {}, expected one of {}.".format(
+                driver, ", ".join(LOG_DRIVERS)
+            )
+        )
+    per_container = budget // max(containers, 1)
+    files = _MAX_FILES
+    if per_container // files < _MIN_FILE_SIZE:
+        files = max(per_container // _MIN_FILE_SIZE, _MIN_FILES)
+    size = min(max(per_container // files, _MIN_FILE_SIZE), _MAX_FILE_SIZE)
+    return {
+        "log-driver": driver,
+        "log-opts": {"max-size": f"{size // MIB}m", "max-file": str(files)},
+    }
@@ -0,0 +1,151 @@
+import hashlib
+import json
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from charms.layer import docker_engine
+from charms.layer.docker_images import image_present
+from charms.layer.docker_images import pull_image
+
+MIRROR_CONTAINER = "registry-mirror"
+MIRROR_IMAGE = "registry:2"
+MIRROR_DATA = "/var/lib/docker-registry-mirror"
+MIRROR_UPSTREAM = "https://registry-1.docker.io"
+# The registry's debug server, publishing the proxy counters, is only
+# bound on the host's loopback interface.
+MIRROR_DEBUG_PORT = 5001
+_CONFIG_LABEL = "charm.docker.registry-mirror.config"
+
+
+def mirror_spec(
+    port=5000, upstream=MIRROR_UPSTREAM, image=MIRROR_IMAGE, data_dir=MIRROR_DATA
+):
+    """
+    :return: Dict engine API body creating a registry pull-through cache of
+      `upstream` listening on `port`
+    """
+    spec = {
+        "Image": image,
+        "Env": [
+            f"REGISTRY_PROXY_REMOTEURL={upstream}",
+            "REGISTRY_HTTP_DEBUG_ADDR=0.0.0.0:5001",
+        ],
+        "ExposedPorts": {"5000/tcp": {}, "5001/tcp": {}},
+        "HostConfig": {
+            "Binds": [f"{data_dir}:/var/lib/registry"],
+            "PortBindings": {
+                "5000/tcp": [{"HostPort": str(port)}],
+                "5001/tcp": [
+                    {"HostIp": "127.0.0.1", "HostPort": str(MIRROR_DEBUG_PORT)}
+                ],
+            },
+            "RestartPolicy": {"Name": "always"},
+        },
+    }
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8"))
+    spec["Labels"] = {_CONFIG_LABEL: digest.hexdigest()}
+    return spec
+
+
+def ensure_mirror(spec, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Run the registry mirror container as described by `spec`, replacing
+    a container created from a different spec.
+
+    :param spec: Dict from mirror_spec()
+    :param socket_path: String path of the engine socket
+    :return: Boolean True if the container was (re)created or started
+    """
+    path = f"/containers/{MIRROR_CONTAINER}"
+    try:
+        current = docker_engine.request("GET", path + "/json", socket_path=socket_path)
+    except docker_engine.EngineError as e:
+        if e.status != 404:
+            raise
+        current = None
+
+    if current is not None:
+        labels = current.get("Config", {}).get("Labels") or {}
+        if labels.get(_CONFIG_LABEL) == spec["Labels"][_CONFIG_LABEL]:
+            if current.get("State", {}).get("Running"):
+                return False
+            docker_engine.request("POST", path + "/start", socket_path=socket_path)
+            return True
+        remove_mirror(socket_path)
+
+    if not image_present(spec["Image"], socket_path):
+        pull_image(spec["Image"], socket_path)
+    docker_engine.request(
+        "POST",
+        "/containers/create",
+        params={"name": MIRROR_CONTAINER},
+        body=spec,
+        socket_path=socket_path,
+        timeout=60,
+    )
+    docker_engine.request("POST", path + "/start", socket_path=socket_path)
+    return True
+
+
+def remove_mirror(socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Remove the registry mirror container, keeping its cached data.
+
+    :param socket_path: String path of the engine socket
+    :return: Boolean True if there was a container to remove
+    """
+    try:
+        docker_engine.request(
+            "DELETE",
+            f"/containers/{MIRROR_CONTAINER}",
+            params={"force": "1"},
+            socket_path=socket_path,
+            timeout=60,
+        )
+    except docker_engine.EngineError as e:
+        if e.status == 404:
+            return False
+        raise
+    return True
+
+
+def mirror_healthy(url, timeout=2):
+    """
+    :param url: String registry mirror URL, e.g. http://10.0.0.5:5000
+    :param timeout: Number of seconds to wait for the answer
+    :return: Boolean True if the registry API answers
+    """
+    try:
+        with urlopen("{}/v2/".format(url.rstrip("/")), timeout=timeout):
+            return True
+    except URLError as e:
+        # Registries requiring authentication answer 401, but answer.
+        return getattr(e, "code", None) == 401
+    except OSError:
+        return False
+
+
+def mirror_stats(url=None, timeout=2):
+    """
+    Read the pull-through cache counters the registry publishes on its
+    debug server.
+
+    :param url: String debug server URL, defaults to that of the local
+      mirror
+    :param timeout: Number of seconds to wait for the answer
+    :return: Dict of `blobs` and `manifests`, each a Dict with the
+      `requests`, `hits`, `misses` and `bytes-pulled` counters
+    """
+    if url is None:
+        url = f"http://127.0.0.1:{MIRROR_DEBUG_PORT}"
+    with urlopen("{}/debug/vars".format(url.rstrip("/")), timeout=timeout) as f:
+        proxy = json.load(f).get("registry", {}).get("proxy", {})
+    return {
+        kind: {
+            "requests": proxy.get(kind, {}).get("Requests", 0),
+            "hits": proxy.get(kind, {}).get("Hits", 0),
+            "misses": proxy.get(kind, {}).get("Misses", 0),
+            "bytes-pulled": proxy.get(kind, {}).get("BytesPulled", 0),
+        }
+        for kind in ("blobs", "manifests")
+    }
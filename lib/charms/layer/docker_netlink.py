@@ -0,0 +1,141 @@
+import errno
+import os
+import socket
+import struct
+
+# From linux/netlink.h and linux/rtnetlink.h.
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+IFLA_IFNAME = 3
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFF_UP = 0x1
+
+_NLMSGHDR = struct.Struct("=LHHLL")
+_IFINFOMSG = struct.Struct("=BxHiII")
+_RTATTR = struct.Struct("=HH")
+
+
+class NetlinkError(OSError):
+    pass
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attr(kind, payload):
+    length = _RTATTR.size + len(payload)
+    return _RTATTR.pack(length, kind) + payload + b"\0" * (_align(length) - length)
+
+
+def _parse_attrs(data):
+    """:return: Dict Integer attribute type to its bytes payload"""
+    attrs = {}
+    offset = 0
+    while offset + _RTATTR.size <= len(data):
+        length, kind = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[kind] = data[offset + _RTATTR.size : offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _request(message_type, flags, name):
+    """
+    Send an rtnetlink link request for the interface `name` and read the
+    kernel's answer.
+
+    :return: Tuple of the Integer message type and its bytes payload, or
+      (NLMSG_ERROR, errno) when the kernel answers with an error or ack
+    """
+    body = _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + _attr(
+        IFLA_IFNAME, name.encode("utf-8") + b"\0"
+    )
+    seq = 1
+    header = _NLMSGHDR.pack(
+        _NLMSGHDR.size + len(body), message_type, NLM_F_REQUEST | flags, seq, 0
+    )
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+        sock.bind((0, 0))
+        sock.sendto(header + body, (0, 0))
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, kind, _, reply_seq, _ = _NLMSGHDR.unpack_from(data, offset)
+                payload = data[offset + _NLMSGHDR.size : offset + length]
+                offset += _align(length)
+                if reply_seq != seq:
+                    continue
+                if kind == NLMSG_ERROR:
+                    return NLMSG_ERROR, -struct.unpack_from("=i", payload)[0]
+                if kind != NLMSG_DONE:
+                    return kind, payload
+
+
+def _check(error, name):
+    if error:
+        raise NetlinkError(error, f"{name}: {os.strerror(error)}")
+
+
+def get_link(name):
+    """
+    Look up a network interface with an RTM_GETLINK request.
+
+    :param name: String interface name, e.g. docker0
+    :return: Dict with the `index`, `kind`, e.g. bridge, and whether the
+      link is `up`, or None if there is no such interface
+    """
+    kind, payload = _request(RTM_GETLINK, 0, name)
+    if kind == NLMSG_ERROR:
+        if payload == errno.ENODEV:
+            return None
+        _check(payload, name)
+    _, _, index, flags, _ = _IFINFOMSG.unpack_from(payload)
+    attrs = _parse_attrs(payload[_IFINFOMSG.size :])
+    info = _parse_attrs(attrs.get(IFLA_LINKINFO, b""))
+    return {
+        "index": index,
+        "kind": info.get(IFLA_INFO_KIND, b"").rstrip(b"\0").decode("utf-8") or None,
+        "up": bool(flags & IFF_UP),
+    }
+
+
+def delete_link(name):
+    """
+    Delete a network interface with an RTM_DELLINK request.
+
+    :param name: String interface name
+    :return: Boolean True if it was deleted, False if it did not exist
+    """
+    _, error = _request(RTM_DELLINK, NLM_F_ACK, name)
+    if error == errno.ENODEV:
+        return False
+    _check(error, name)
+    return True
+
+
+def remove_bridge(name="docker0"):
+    """
+    Remove a bridge, if it exists. Deleting it takes it down too, so this
+    needs neither bridge-utils nor iproute2.
+
+    :param name: String bridge name
+    :return: Boolean True if it was removed, False if it did not exist
+    """
+    link = get_link(name)
+    if link is None:
+        return False
+    if link["kind"] != "bridge":
+        raise NetlinkError(
+            errno.EINVAL, "{} is a {} link, not a bridge.".format(name, link["kind"])
+        )
+    return delete_link(name)
@@ -0,0 +1,147 @@
+import ipaddress
+
+from charmhelpers.core import hookenv
+
+PROXY_KEYS = ["http_proxy", "https_proxy", "no_proxy"]
+
+# With systemd-unit "replace", the proxy environment is rendered into
+# docker.service as Environment="NO_PROXY=...", and systemd will not parse
+# a line longer than 2048 characters.
+NO_PROXY_MAX_LEN = 2048 - len('Environment="NO_PROXY=""')
+
+
+def parse_no_proxy(value):
+    """
+    Split a NO_PROXY string into names and networks, dropping duplicates
+    and entries already covered by a broader one.
+
+    Addresses and CIDRs are collapsed per address family, so overlapping
+    and adjacent ranges are merged. Names follow the Go proxy semantics
+    used by dockerd: `example.com` covers itself and every subdomain,
+    `.example.com` (or `*.example.com`) covers subdomains only.
+
+    :param value: String comma separated NO_PROXY entries
+    :return: Tuple of (List String names, List of ip_network)
+    """
+    entries = []
+    for entry in (value or "").split(","):
+        entry = entry.strip().lower()
+        if entry and entry not in entries:
+            entries.append(entry)
+
+    if "*" in entries:
+        return ["*"], []
+
+    names = []
+    addresses = {4: [], 6: []}
+    for entry in entries:
+        try:
+            net = ipaddress.ip_network(entry, strict=False)
+            addresses[net.version].append(net)
+        except ValueError:
+            if entry.startswith("*."):
+                entry = entry[1:]
+            names.append(entry)
+
+    bare = {name for name in names if not name.startswith(".")}
+    dotted = {name for name in names if name.startswith(".")}
+    kept = []
+    for name in names:
+        if name in kept or (name.startswith(".") and name[1:] in bare):
+            continue
+        labels = name.lstrip(".").split(".")
+        parents = [".".join(labels[i:]) for i in range(1, len(labels))]
+        if any(p in bare or "." + p in dotted for p in parents):
+            continue
+        kept.append(name)
+
+    networks = []
+    for version in (4, 6):
+        networks += ipaddress.collapse_addresses(addresses[version])
+    return kept, networks
+
+
+def _format_network(net):
+    if net.num_addresses == 1:
+        return str(net.network_address)
+    return str(net)
+
+
+def _expand_network(net, limit):
+    """
+    Expand a network into its host addresses, giving up as soon as the
+    joined result would be longer than `limit`.
+
+    :param net: ip_network
+    :param limit: Integer maximum length of the joined host list
+    :return: List String or None if it does not fit
+    """
+    hosts = []
+    size = -1
+    for ip in net.hosts():
+        host = str(ip)
+        size += len(host) + 1
+        if size > limit:
+            return None
+        hosts.append(host)
+    return hosts
+
+
+def iter_no_proxy(value, budget=NO_PROXY_MAX_LEN):
+    """
+    Yield the compact NO_PROXY entries for `value`.
+
+    Networks are only expanded into individual hosts, for clients that do
+    not understand CIDR notation, while the whole result stays within
+    `budget` characters. Larger networks are kept in CIDR form, so the
+    work done here never depends on the size of the ranges involved.
+
+    :param value: String comma separated NO_PROXY entries
+    :param budget: Integer length the expanded output may grow to
+    :return: Generator of String
+    """
+    names, networks = parse_no_proxy(value)
+    compact = [_format_network(net) for net in networks]
+    spare = budget - len(",".join(names + compact))
+
+    yield from names
+    for net, cidr in zip(networks, compact):
+        hosts = None
+        if net.num_addresses > 1 and spare > 0:
+            hosts = _expand_network(net, spare + len(cidr))
+        if hosts:
+            spare -= len(",".join(hosts)) - len(cidr)
+            yield from hosts
+        else:
+            yield cidr
+
+
+def format_no_proxy(value, budget=NO_PROXY_MAX_LEN):
+    """
+    :param value: String comma separated NO_PROXY entries
+    :param budget: Integer length the expanded output may grow to
+    :return: String compact NO_PROXY value
+    """
+    return ",".join(iter_no_proxy(value, budget))
+
+
+def proxy_settings():
+    """
+    Return the proxy settings docker should run with. Charm config takes
+    precedence over the model proxy settings, whose NO_PROXY is compacted
+    with format_no_proxy().
+
+    :return: Dict of http_proxy, https_proxy and no_proxy
+    """
+    config = hookenv.config()
+    settings = {key: config.get(key) for key in PROXY_KEYS}
+
+    environment_config = hookenv.env_proxy_settings()
+    if environment_config is not None:
+        no_proxy = format_no_proxy(environment_config.get("NO_PROXY", ""))
+        environment_config.update({"NO_PROXY": no_proxy, "no_proxy": no_proxy})
+        for key in PROXY_KEYS:
+            if not settings.get(key):
+                settings[key] = environment_config.get(key)
+
+    return settings
@@ -0,0 +1,69 @@
+import time
+
+from charms.layer import docker_engine
+
+# Swarm node states dockerd refuses to combine with live-restore.
+_SWARM_STATES = frozenset(["active", "pending", "locked"])
+
+
+def running_containers(socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    :param socket_path: String path of the engine socket
+    :return: Set String ids of the running containers, empty if the engine
+      does not answer
+    """
+    try:
+        containers = docker_engine.request(
+            "GET", "/containers/json", socket_path=socket_path
+        )
+    except docker_engine.EngineError:
+        return set()
+    return {c["Id"] for c in containers}
+
+
+def live_restore_conflicts(socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Find what prevents enabling live-restore on this daemon.
+
+    :param socket_path: String path of the engine socket
+    :return: List String reasons, empty if live-restore can be enabled
+    """
+    try:
+        info = docker_engine.request("GET", "/info", socket_path=socket_path)
+    except docker_engine.EngineError:
+        # Not running yet, so not part of a swarm either.
+        return []
+    conflicts = []
+    state = (info.get("Swarm") or {}).get("LocalNodeState", "inactive")
+    if state in _SWARM_STATES:
+        conflicts.append(f"the node is in swarm mode ({state})")
+    return conflicts
+
+
+def restart_daemon(restart, deadline=30, socket_path=docker_engine.DOCKER_SOCKET):
+    """
+    Restart the daemon with `restart` and check which of the containers
+    running beforehand are still running once the engine answers again.
+
+    :param restart: Callable that restarts, or otherwise disrupts, the daemon
+    :param deadline: Number of seconds to wait for the engine to answer
+    :param socket_path: String path of the engine socket
+    :return: Dict with the number of containers running `before` and
+      `after`, the ids of those `lost`, and the `seconds` until the engine
+      answered, None if it did not
+    """
+    before = running_containers(socket_path)
+    start = time.monotonic()
+    restart()
+    answered = docker_engine.wait_for_engine(deadline, socket_path=socket_path)
+    seconds = None
+    after = set()
+    if answered is not None:
+        seconds = round(time.monotonic() - start, 3)
+        after = running_containers(socket_path)
+    return {
+        "before": len(before),
+        "after": len(after),
+        "lost": sorted(before - after),
+        "seconds": seconds,
+    }
@@ -0,0 +1,166 @@
+import json
+import math
+import time
+
+from charmhelpers.core import hookenv
+
+PEER_RELATION = "docker-peers"
+LOCK_KEY = "rolling-restart-lock"
+
+
+def parse_max_unavailable(value, units):
+    """
+    :param value: String count, e.g. 2, or percentage of the units, e.g. 25%
+    :param units: Integer number of units
+    :return: Integer number of units that may restart at once, at least 1
+    """
+    value = str(value).strip()
+    try:
+        if value.endswith("%"):
+            limit = math.floor(units * float(value[:-1]) / 100)
+        else:
+            limit = int(value)
+    except ValueError:
+        raise ValueError(
+            f"Invalid max-unavailable {value!r}, expected e.g. 1 or 25%."
+        ) from None
+    return max(limit, 1)
+
+
+def next_grants(units, requests, done, healthy, granted, limit):
+    """
+    Work out which units hold the restart lock next.
+
+    A unit keeps its grant until it reports its restart done and its engine
+    healthy again. A unit that comes back unhealthy keeps holding its slot,
+    so the rollout stops there instead of taking more units down.
+
+    :param units: List String names of the units present
+    :param requests: Dict unit name to the String id of its latest request
+    :param done: Dict unit name to the String id of its last completed
+      request
+    :param healthy: Dict unit name to Boolean engine health after that
+    :param granted: Dict unit name to the String request id it was granted
+    :param limit: Integer number of units that may restart at once
+    :return: Dict unit name to the String request id it is granted
+    """
+    grants = {}
+    for unit, request in granted.items():
+        if unit not in units:
+            continue
+        if done.get(unit) != request:
+            grants[unit] = request
+        elif not healthy.get(unit):
+            # Back unhealthy, it keeps its slot for its next attempt too.
+            grants[unit] = requests.get(unit) or request
+    waiting = sorted(
+        (
+            unit
+            for unit in units
+            if requests.get(unit)
+            and requests[unit] != done.get(unit)
+            and unit not in grants
+        ),
+        key=lambda unit: (float(requests[unit]), unit),
+    )
+    for unit in waiting[: max(limit - len(grants), 0)]:
+        grants[unit] = requests[unit]
+    return grants
+
+
+class RollingRestart:
+    """
+    A lock over the docker-peers relation that lets at most max-unavailable
+    units restart their daemon at once.
+
+    Units post restart requests in their relation data, the leader grants
+    them in leader settings, and units report there when they are done and
+    whether their engine answers again. Each step wakes the next one up
+    with a relation-changed or leader-settings-changed hook.
+    """
+
+    def __init__(self, max_unavailable="1"):
+        self.max_unavailable = max_unavailable
+        self.unit = hookenv.local_unit()
+        ids = hookenv.relation_ids(PEER_RELATION)
+        self.relation_id = ids[0] if ids else None
+
+    def peers(self):
+        """:return: List String names of the other units"""
+        if self.relation_id is None:
+            return []
+        return hookenv.related_units(self.relation_id)
+
+    def acquire(self):
+        """
+        Request the lock for this unit, unless a request is pending already.
+
+        :return: Boolean True if this unit may restart now
+        """
+        if not self.peers():
+            return True
+        data = self._data(self.unit)
+        request = data.get("restart-request")
+        if not request or request == data.get("restart-done"):
+            request = f"{time.time():.6f}"
+            hookenv.relation_set(self.relation_id, {"restart-request": request})
+        if hookenv.is_leader():
+            grants = self.update_grants({self.unit: {"restart-request": request}})
+        else:
+            grants = self.grants()
+        return grants.get(self.unit) == request
+
+    def release(self, healthy):
+        """
+        Report this unit's restart done.
+
+        :param healthy: Boolean True if the engine answers again
+        :return: None
+        """
+        if not self.peers():
+            return
+        request = self._data(self.unit).get("restart-request")
+        settings = {"restart-done": request, "restart-healthy": str(bool(healthy))}
+        hookenv.relation_set(self.relation_id, settings)
+        if hookenv.is_leader():
+            self.update_grants({self.unit: settings})
+
+    def grants(self):
+        """:return: Dict unit name to the String request id it is granted"""
+        return json.loads(hookenv.leader_get(LOCK_KEY) or "{}")
+
+    def update_grants(self, overrides=None):
+        """
+        Grant the lock to waiting units as slots free up. Leader only.
+
+        :param overrides: Dict unit name to relation data set during this
+          hook, which relation-get does not return yet
+        :return: Dict unit name to the String request id it is granted
+        """
+        units = [self.unit] + self.peers()
+        data = {unit: dict(self._data(unit)) for unit in units}
+        for unit, settings in (overrides or {}).items():
+            data[unit].update(settings)
+
+        granted = self.grants()
+        grants = next_grants(
+            units,
+            {u: d.get("restart-request") for u, d in data.items()},
+            {u: d.get("restart-done") for u, d in data.items()},
+            {u: d.get("restart-healthy") == "True" for u, d in data.items()},
+            granted,
+            parse_max_unavailable(self.max_unavailable, len(units)),
+        )
+        if grants != granted:
+            hookenv.log(
+                "Rolling restart lock held by: {}.".format(
+                    ", ".join(sorted(grants)) or "nobody"
+                )
+            )
+            hookenv.leader_set({LOCK_KEY: json.dumps(grants, sort_keys=True)})
+        return grants
+
+    def _data(self, unit):
+        if self.relation_id is None:
+            return {}
+        return hookenv.relation_get(unit=unit, rid=self.relation_id) or {}
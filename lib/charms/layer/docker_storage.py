@@ -0,0 +1,201 @@
+import os
+import re
+from collections import deque
+from subprocess import PIPE
+from subprocess import STDOUT
+from subprocess import CalledProcessError
+from subprocess import Popen
+from subprocess import check_output
+
+DOCKER_DATA_ROOT = "/var/lib/docker"
+
+# Packages each storage driver needs on the host, beyond docker itself.
+# `{kernel}` is replaced by the running kernel release.
+STORAGE_DRIVER_PACKAGES = {
+    "overlay2": [],
+    "aufs": ["aufs-tools", "linux-image-extra-{kernel}"],
+    "btrfs": ["btrfs-progs"],
+    "zfs": ["zfsutils-linux"],
+    "devicemapper": ["thin-provisioning-tools", "lvm2"],
+    "vfs": [],
+}
+
+# Backing filesystems each driver can, or can not, store its data on.
+_REQUIRED_FILESYSTEM = {"btrfs": "btrfs", "zfs": "zfs"}
+_OVERLAY_UNSUPPORTED = frozenset(["overlay", "aufs", "ecryptfs", "zfs", "nfs"])
+
+
+class StorageDriverError(Exception):
+    pass
+
+
+def _kernel_supports(filesystem, kernel_release, root):
+    """
+    :return: Boolean True if `filesystem` is registered with the kernel, or
+      available as a module it can load on demand
+    """
+    try:
+        with open(os.path.join(root, "proc/filesystems")) as f:
+            if filesystem in (line.split()[-1] for line in f if line.strip()):
+                return True
+    except OSError:
+        pass
+    module_dir = os.path.join(root, "lib/modules", kernel_release, "kernel/fs")
+    module = {"overlay": "overlayfs"}.get(filesystem, filesystem)
+    return os.path.isdir(os.path.join(module_dir, module))
+
+
+def detect_storage_driver(kernel_release, root="/"):
+    """
+    Pick the storage driver for this host: overlay2 when the kernel
+    supports overlay, aufs on the older kernels that only support that.
+
+    :param kernel_release: String e.g. 5.4.0-42-generic
+    :param root: String root of the /proc and /lib/modules trees to read
+    :return: String
+    """
+    if _kernel_supports("overlay", kernel_release, root):
+        return "overlay2"
+    if _kernel_supports("aufs", kernel_release, root):
+        return "aufs"
+    raise StorageDriverError(
+        "The kernel supports neither overlay nor aufs, set storage-driver."
+    )
+
+
+def storage_driver_packages(driver, kernel_release):
+    """
+    :param driver: String one of STORAGE_DRIVER_PACKAGES
+    :param kernel_release: String e.g. 5.4.0-42-generic
+    :return: List String packages the driver needs
+    """
+    if driver not in STORAGE_DRIVER_PACKAGES:
+        raise StorageDriverError(f"Unknown storage driver {driver}.")
+    return [p.format(kernel=kernel_release) for p in STORAGE_DRIVER_PACKAGES[driver]]
+
+
+def _unescape_mount_path(path):
+    # /proc/self/mountinfo octal escapes spaces, tabs, newlines and \.
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), path)
+
+
+def backing_filesystem(path, mountinfo="/proc/self/mountinfo"):
+    """
+    Find the mount holding `path`, or the closest parent of it that exists.
+
+    :param path: String
+    :param mountinfo: String path of the mountinfo table to read
+    :return: Tuple of String (filesystem type, mount point, source device)
+    """
+    path = os.path.realpath(path)
+    best = None
+    with open(mountinfo) as f:
+        for line in f:
+            fields = line.split()
+            separator = fields.index("-")
+            mount_point = _unescape_mount_path(fields[4])
+            inside = path == mount_point or path.startswith(
+                mount_point.rstrip("/") + "/"
+            )
+            # Later entries shadow earlier ones on the same mount point.
+            if inside and (best is None or len(mount_point) >= len(best[1])):
+                best = (fields[separator + 1], mount_point, fields[separator + 2])
+    if best is None:
+        raise StorageDriverError(f"No filesystem is mounted at {path}.")
+    return best
+
+
+def _xfs_ftype(mount_point):
+    """
+    :return: Boolean if the xfs filesystem records file types in directory
+      entries (d_type), or None if xfs_info is not available
+    """
+    try:
+        info = check_output(["xfs_info", mount_point]).decode("utf-8")
+    except (OSError, CalledProcessError):
+        return None
+    return "ftype=1" in info
+
+
+def validate_backing_filesystem(
+    driver, data_root=DOCKER_DATA_ROOT, mountinfo="/proc/self/mountinfo"
+):
+    """
+    Check that the filesystem holding the docker data-root can back the
+    storage driver, before the daemon is started with it. dockerd refuses
+    to start overlay2 on xfs formatted without d_type support, for
+    example, and the error only shows up in its journal.
+
+    :param driver: String storage driver
+    :param data_root: String docker data-root
+    :param mountinfo: String path of the mountinfo table to read
+    :return: String the backing filesystem type
+    """
+    fs_type, mount_point, _ = backing_filesystem(data_root, mountinfo)
+
+    required = _REQUIRED_FILESYSTEM.get(driver)
+    if required and fs_type != required:
+        raise StorageDriverError(
+            f"The {driver} storage driver needs {required} at {data_root}, "
+            f"found {fs_type}."
+        )
+    if driver == "overlay2":
+        if fs_type in _OVERLAY_UNSUPPORTED:
+            raise StorageDriverError(
+                f"overlay2 is not supported on {fs_type} at {data_root}."
+            )
+        if fs_type == "xfs" and _xfs_ftype(mount_point) is False:
+            raise StorageDriverError(
+                "overlay2 needs d_type support, but the xfs filesystem at "
+                f"{mount_point} was formatted with ftype=0."
+            )
+    return fs_type
+
+
+_PROGRESS = re.compile(rb"\s(\d{1,3})%\s")
+
+
+def migrate_data_root(source, target, progress=None, delete=False):
+    """
+    Copy the docker data-root from `source` to `target` with rsync,
+    preserving hard links, ACLs, xattrs and the device files overlay2 uses
+    as whiteouts.
+
+    Run it once while the daemon is up to copy the bulk of the data, then
+    with `delete` once it is stopped, to copy what changed in between and
+    drop what was removed.
+
+    :param source: String current data-root
+    :param target: String new data-root
+    :param progress: Callable receiving the Integer percentage copied
+    :param delete: Boolean remove files from `target` missing in `source`
+    :return: None
+    """
+    if not os.path.isdir(source):
+        return
+    os.makedirs(target, mode=0o711, exist_ok=True)
+    command = ["rsync", "-aHAX", "--numeric-ids", "--info=progress2"]
+    if delete:
+        command.append("--delete")
+    command += [source.rstrip("/") + "/", target]
+
+    process = Popen(command, stdout=PIPE, stderr=STDOUT)
+    # rsync redraws its progress line with carriage returns.
+    tail = deque(maxlen=5)
+    buffered = b""
+    last = None
+    for chunk in iter(lambda: process.stdout.read1(64 * 1024), b""):
+        *lines, buffered = re.split(rb"[\r\n]", buffered + chunk)
+        for line in lines:
+            match = _PROGRESS.search(line + b" ")
+            if match:
+                percent = int(match.group(1))
+                if progress and percent != last:
+                    progress(percent)
+                last = percent
+            elif line.strip():
+                tail.append(line.decode("utf-8", "replace").strip())
+    if process.wait():
+        raise StorageDriverError(
+            "Copying {} to {} failed: {}".format(source, target, "; ".join(tail))
+        )
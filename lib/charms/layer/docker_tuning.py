@@ -0,0 +1,176 @@
+import os
+from subprocess import check_call
+
+from charms.layer.docker import write_file
+
+PROFILES = ("default", "dense", "throughput")
+# daemon.json keys the profiles set.
+DAEMON_KEYS = ("max-concurrent-downloads", "max-concurrent-uploads", "userland-proxy")
+SYSCTL_CONF = "/etc/sysctl.d/60-charm-docker.conf"
+# nf_conntrack is only loaded once dockerd sets up iptables, after
+# systemd-sysctl ran at boot, so have it loaded before instead.
+MODULES_CONF = "/etc/modules-load.d/charm-docker.conf"
+
+GIB = 1024 * 1024 * 1024
+
+
+def host_resources(root="/"):
+    """
+    :param root: String root of the /proc and /sys trees to read
+    :return: Dict with the number of `cpus`, bytes of `memory` and the
+      `nic-speed` in Mbit/s of the fastest physical interface that is up,
+      0 if unknown
+    """
+    with open(os.path.join(root, "proc/cpuinfo")) as f:
+        cpus = sum(1 for line in f if line.startswith("processor"))
+    memory = 0
+    with open(os.path.join(root, "proc/meminfo")) as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                memory = int(line.split()[1]) * 1024
+                break
+    speed = 0
+    net = os.path.join(root, "sys/class/net")
+    for name in sorted(os.listdir(net)):
+        # Virtual interfaces, bridges and veths among them, have no device.
+        if not os.path.exists(os.path.join(net, name, "device")):
+            continue
+        try:
+            with open(os.path.join(net, name, "speed")) as f:
+                speed = max(speed, int(f.read().strip()))
+        except (OSError, ValueError):
+            # Reading the speed of an interface that is down fails.
+            continue
+    return {"cpus": cpus or os.cpu_count() or 1, "memory": memory, "nic-speed": speed}
+
+
+def _clamp(value, low, high):
+    return int(min(max(value, low), high))
+
+
+def tuning(profile, cpus, memory, nic_speed):
+    """
+    Work out the daemon options and kernel settings for a profile.
+
+    `dense` is for nodes running many small containers: more connections
+    tracked, more inotify instances and a deeper accept queue. `throughput`
+    is for nodes moving a lot of data: more parallel layer transfers,
+    scaled with the CPUs and NIC speed, and a deeper accept queue still.
+    Both turn off the userland proxy, which copies every connection to a
+    published port through a docker-proxy process, in favour of iptables
+    NAT. `default` leaves everything as it is.
+
+    :param profile: String one of PROFILES
+    :param cpus: Integer number of CPUs
+    :param memory: Integer bytes of memory
+    :param nic_speed: Integer Mbit/s of the fastest interface, 0 if unknown
+    :return: Tuple of Dicts (daemon.json keys, sysctl settings)
+    """
+    if profile not in PROFILES:
+        raise ValueError(
+            "Invalid performance-profile {}, expected one of {}.".format(
+                profile, ", ".join(PROFILES)
+            )
+        )
+    if profile == "default":
+        return {}, {}
+
+    gbps = (nic_speed or 1000) / 1000
+    gib = memory / GIB
+    if profile == "dense":
+        daemon = {
+            "max-concurrent-downloads": _clamp(cpus // 2, 3, 8),
+            "max-concurrent-uploads": _clamp(cpus // 2, 5, 8),
+            "userland-proxy": False,
+        }
+        sysctl = {
+            # Each tracked connection takes about 320 bytes.
+            "net.netfilter.nf_conntrack_max": _clamp(gib * 32768, 131072, 4194304),
+            "fs.inotify.max_user_instances": 8192,
+            "fs.inotify.max_user_watches": _clamp(gib * 65536, 524288, 4194304),
+            "net.core.somaxconn": 4096,
+        }
+    else:
+        daemon = {
+            "max-concurrent-downloads": _clamp(min(cpus, 3 + 2 * gbps), 3, 32),
+            "max-concurrent-uploads": _clamp(min(cpus, 5 + gbps), 5, 32),
+            "userland-proxy": False,
+        }
+        sysctl = {
+            "net.netfilter.nf_conntrack_max": _clamp(gib * 16384, 131072, 2097152),
+            "fs.inotify.max_user_instances": 1024,
+            "net.core.somaxconn": 65535,
+        }
+    return daemon, sysctl
+
+
+def current_sysctl(name, root="/"):
+    """
+    :param name: String sysctl, e.g. net.core.somaxconn
+    :param root: String root of the /proc tree to read
+    :return: Integer value, or None if the kernel does not have it
+    """
+    path = os.path.join(root, "proc/sys", *name.split("."))
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _written_sysctl():
+    """:return: Set String sysctl names in the managed drop-in"""
+    try:
+        with open(SYSCTL_CONF) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return set()
+    return {
+        line.split("=")[0].strip()
+        for line in lines
+        if "=" in line and not line.startswith("#")
+    }
+
+
+def apply_sysctl(settings, baseline):
+    """
+    Write the settings to a managed sysctl drop-in and apply them. Values
+    the host had higher before the charm tuned it are kept rather than
+    lowered, and settings no longer in the drop-in are put back to what
+    the host had, rather than waiting for a reboot.
+
+    :param settings: Dict sysctl name to Integer value, empty removes the
+      drop-in
+    :param baseline: Dict sysctl name to the Integer value the host had
+      before, see current_sysctl()
+    :return: Dict sysctl name to the Integer value written
+    """
+    effective = {
+        name: max(value, baseline.get(name) or 0)
+        for name, value in sorted(settings.items())
+    }
+    dropped = _written_sysctl() - set(effective)
+
+    if effective:
+        lines = ["# Managed by the docker charm, performance-profile."]
+        lines += [f"{name} = {value}" for name, value in effective.items()]
+        changed = write_file(SYSCTL_CONF, "\n".join(lines) + "\n", perms=0o644)
+    elif os.path.exists(SYSCTL_CONF):
+        os.unlink(SYSCTL_CONF)
+        changed = False
+    else:
+        changed = False
+
+    for name in sorted(dropped):
+        if baseline.get(name) is not None:
+            check_call(["sysctl", "-e", "-q", "-w", f"{name}={baseline[name]}"])
+
+    if any(name.startswith("net.netfilter.") for name in effective):
+        write_file(MODULES_CONF, "nf_conntrack\n", perms=0o644)
+        check_call(["modprobe", "nf_conntrack"])
+    elif os.path.exists(MODULES_CONF):
+        os.unlink(MODULES_CONF)
+    if changed:
+        # -e: skip settings this kernel does not know, rather than fail.
+        check_call(["sysctl", "-e", "-q", "-p", SYSCTL_CONF])
+    return effective
@@ -0,0 +1,169 @@
+import time
+from subprocess import CalledProcessError
+from subprocess import check_call
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import host
+from charms.layer import docker_engine
+from charms.layer.docker import clear_pending_changes
+from charms.layer.docker import determine_apt_source
+from charms.layer.docker import docker_packages
+from charms.layer.docker import render_configuration_template
+from charms.layer.docker_apt import AptPlan
+from charms.layer.docker_apt import installed_versions
+from charms.layer.docker_restart import restart_daemon
+
+
+class UpgradeError(Exception):
+    """
+    Raised when an upgrade failed, after the packages were rolled back to
+    the versions held before it.
+    """
+
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+def upgrade_packages():
+    """
+    :return: List String the packages of the configured runtime
+    """
+    return docker_packages[determine_apt_source()]
+
+
+def download_upgrade(packages):
+    """
+    Download the latest version of `packages` to the apt cache, without
+    installing them, so the upgrade itself does not wait on the network.
+
+    :param packages: List String
+    :return: Number of seconds it took
+    """
+    start = time.monotonic()
+    plan = AptPlan()
+    plan.update()
+    plan.download(packages)
+    plan.execute()
+    return round(time.monotonic() - start, 3)
+
+
+def _install(packages, versions=None):
+    """
+    Install `packages`, pinned to `versions` if given, and hold them.
+
+    :param packages: List String
+    :param versions: Dict String package to String version to downgrade to
+    :return: None
+    """
+    plan = AptPlan()
+    plan.unhold(packages)
+    if versions:
+        plan.install([f"{p}={versions[p]}" for p in packages])
+        plan.allow_downgrades()
+    else:
+        plan.install(packages)
+    plan.hold(packages)
+    plan.execute()
+
+
+def _restart_service():
+    host.service_restart("docker")
+
+
+def _restart(deadline, socket_path, restart=_restart_service):
+    render_configuration_template(service=True)
+    # The packages may have replaced docker.service, drop-ins or not.
+    check_call(["systemctl", "daemon-reload"])
+    report = restart_daemon(restart, deadline, socket_path)
+    if report["seconds"] is None:
+        return report, None
+    # The daemon runs with the configuration on disk, so the next hook
+    # does not restart it again for the same changes.
+    clear_pending_changes()
+    try:
+        version = docker_engine.request("GET", "/version", socket_path=socket_path)
+    except docker_engine.EngineError:
+        return report, None
+    return report, version.get("Version")
+
+
+def upgrade_docker(
+    downloaded=False,
+    deadline=30,
+    socket_path=docker_engine.DOCKER_SOCKET,
+    restart=_restart_service,
+):
+    """
+    Upgrade the packages of the configured runtime in stages: download
+    them while the daemon keeps running, install them, and restart the
+    daemon on the new engine, which keeps the containers running with
+    live-restore. If the install fails or the engine does not answer
+    after the restart, the packages are rolled back to the versions held
+    before.
+
+    :param downloaded: Boolean the packages were already downloaded with
+      download_upgrade()
+    :param deadline: Number of seconds to wait for the engine to answer
+    :param socket_path: String path of the engine socket
+    :param restart: Callable restarting the daemon, to do work that needs
+      it stopped along with the upgrade
+    :return: Dict with the `packages`, their `previous` versions, the
+      `download`, `install` and `restart` seconds, the restart report of
+      the `containers`, and the `engine-version` that answered
+    """
+    packages = upgrade_packages()
+    result = {
+        "packages": packages,
+        "previous": installed_versions(packages),
+        "download": 0 if downloaded else download_upgrade(packages),
+    }
+
+    start = time.monotonic()
+    try:
+        _install(packages)
+    except (CalledProcessError, OSError) as e:
+        error = "Installing {} failed: {}".format(", ".join(packages), e)
+    else:
+        error = None
+    result["install"] = round(time.monotonic() - start, 3)
+
+    if not error:
+        report, version = _restart(deadline, socket_path, restart)
+        result["restart"] = report["seconds"]
+        result["containers"] = report
+        result["engine-version"] = version
+        if version is not None:
+            return result
+        error = "The upgraded engine did not answer after restarting."
+
+    _rollback(packages, result["previous"], deadline, socket_path, restart)
+    raise UpgradeError(error, result)
+
+
+def _rollback(packages, previous, deadline, socket_path, restart=_restart_service):
+    """
+    Reinstall the versions of the packages held before the upgrade, and
+    purge those it installed for the first time.
+
+    :param packages: List String the upgraded packages
+    :param previous: Dict String package to String version
+    :return: None
+    """
+    added = [p for p in packages if p not in previous]
+    if added:
+        hookenv.log("Purging {}.".format(", ".join(added)), hookenv.WARNING)
+        plan = AptPlan()
+        plan.unhold(added)
+        plan.purge(added)
+        plan.execute()
+    if not previous:
+        return
+    hookenv.log(
+        "Rolling docker back to {}.".format(
+            ", ".join(f"{p}={v}" for p, v in previous.items())
+        ),
+        hookenv.WARNING,
+    )
+    _install(list(previous), previous)
+    _restart(deadline, socket_path, restart)
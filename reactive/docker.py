@@ -1,25 +1,16 @@
-import contextlib
+import json
 import os
 from shlex import split
 from subprocess import check_call
-from subprocess import check_output
-from subprocess import CalledProcessError
-from subprocess import Popen, PIPE
-from urllib.request import urlopen
 
 from charmhelpers.core import host
 from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
 from charmhelpers.core.hookenv import status_set
 from charmhelpers.core.hookenv import config
-from charmhelpers.fetch import apt_install
-from charmhelpers.fetch import apt_purge
-from charmhelpers.fetch import apt_update
-from charmhelpers.fetch import apt_hold
-from charmhelpers.fetch import apt_unhold
-from charmhelpers.fetch import filter_installed_packages
-from charmhelpers.contrib.charmsupport import nrpe
 
 from charms.reactive import hook
+from charms.reactive import is_state
 from charms.reactive import remove_state
 from charms.reactive import set_state
 from charms.reactive import when
@@ -28,16 +19,36 @@ from charms.reactive import when_not
 from charms.reactive.helpers import data_changed
 
 from charms.layer import docker
+from charms.layer import docker_cgroups
+from charms.layer import docker_engine
+from charms.layer import docker_tuning
 from charms.layer.docker import arch
 from charms.layer.docker import docker_packages
 from charms.layer.docker import determine_apt_source
 from charms.layer.docker import render_configuration_template
-
-from charms.docker import Docker
-from charms.docker import DockerOpts
+from charms.layer.docker_proxy import NO_PROXY_MAX_LEN
+from charms.layer.docker_proxy import proxy_settings
+from charms.layer.docker_logging import filesystem_size
+from charms.layer.docker_logging import log_policy
+from charms.layer.docker_logging import parse_budget
+from charms.layer.docker_netlink import remove_bridge
+from charms.layer.docker_restart import live_restore_conflicts
+from charms.layer.docker_restart import restart_daemon
+from charms.layer.docker_rolling import RollingRestart
+from charms.layer.docker_storage import DOCKER_DATA_ROOT
+from charms.layer.docker_storage import StorageDriverError
+from charms.layer.docker_storage import detect_storage_driver
+from charms.layer.docker_storage import migrate_data_root
+from charms.layer.docker_storage import storage_driver_packages
+from charms.layer.docker_storage import validate_backing_filesystem
 
 from charms import layer
 
+# Every hook imports this module, while most of them only run a handler or
+# two. Modules pulling in charmhelpers.fetch, urllib, concurrent.futures,
+# charms.docker or the nrpe helpers are imported by the handlers using them
+# instead, see tests/test_import_time.py.
+
 NRPE_PRIMARY = "nrpe-external-master"  # wokeignore:rule=master
 
 # 2 Major events are emitted from this layer.
@@ -54,6 +65,20 @@ NRPE_PRIMARY = "nrpe-external-master"  # wokeignore:rule=master
 # Be sure you bind to it appropriately in your workload layer and
 # react to the proper event.
 
+# Reasons for the daemon recycles requested during the current hook, mapped
+# to whether each one needs a full restart, see recycle_daemon().
+_recycle_requests = {}
+
+
+def all_docker_packages():
+    """
+    :return: List String the packages of every docker runtime
+    """
+    packages = []
+    for k in docker_packages:
+        packages += [p for p in docker_packages[k] if p not in packages]
+    return packages
+
 
 def hold_all():
     """
@@ -61,8 +86,11 @@ def hold_all():
 
     :return: None
     """
-    for k in docker_packages.keys():
-        apt_hold(docker_packages[k])
+    from charms.layer.docker_apt import AptPlan
+
+    plan = AptPlan()
+    plan.hold(all_docker_packages())
+    plan.execute()
 
 
 def unhold_all():
@@ -71,8 +99,11 @@ def unhold_all():
 
     :return: None
     """
-    for k in docker_packages.keys():
-        apt_unhold(docker_packages[k])
+    from charms.layer.docker_apt import AptPlan
+
+    plan = AptPlan()
+    plan.unhold(all_docker_packages())
+    plan.execute()
 
 
 @hook("upgrade-charm")
@@ -83,6 +114,9 @@ def upgrade():
     hold_all()
     hookenv.log("Holding docker packages at current revision.")
 
+    # The machine may have been upgraded along with the charm.
+    docker.invalidate_host_facts()
+
 
 def set_custom_docker_package():
     """
@@ -108,8 +142,14 @@ def install():
 
     :return: None or False
     """
+    from charms.layer.docker_apt import AptPlan
+
+    # All package operations are collected in one plan, so apt only runs
+    # one update, one install and one hold for the whole install.
+    plan = AptPlan()
+
     # Switching runtimes causes a reinstall so remove any holds that exist.
-    unhold_all()
+    plan.unhold(all_docker_packages())
 
     # Often when building layer-docker based subordinates, you dont need to
     # incur the overhead of installing docker. This tuneable layer option
@@ -117,19 +157,24 @@ def install():
     # circuit immediately to docker.available, so you can charm away!
     layer_opts = layer.options("docker")
     if layer_opts["skip-install"]:
+        plan.execute()
         set_state("docker.available")
         set_state("docker.ready")
         return
 
-    status_set("maintenance", "Installing AUFS and other tools.")
-    kernel_release = check_output(["uname", "-r"]).rstrip()
-    packages = [
-        "aufs-tools",
-        "git",
-        "linux-image-extra-{}".format(kernel_release.decode("utf-8")),
-    ]
-    apt_update()
-    apt_install(packages)
+    # Only install what the storage driver needs, aufs-tools and
+    # linux-image-extra are not needed with overlay2 and do not exist for
+    # recent kernels.
+    kernel_release = docker.host_fact("kernel-release")
+    try:
+        driver = storage_driver()
+    except StorageDriverError as e:
+        status_set("blocked", str(e))
+        return False
+    status_set("maintenance", f"Installing {driver} storage driver tools.")
+    packages = ["git", "zstd"] + storage_driver_packages(driver, kernel_release)
+    plan.update()
+    plan.install(packages, optional=True)
 
     # Install docker-engine from apt.
     runtime = determine_apt_source()
@@ -137,30 +182,51 @@ def install():
     remove_state("nvidia-docker.installed")
     if runtime == "nvidia":
         set_state("nvidia-docker.supported")
-        install_from_nvidia_apt()
+        install_from_nvidia_apt(plan)
+    elif runtime == "upstream":
+        install_from_upstream_apt(plan)
+    elif runtime == "apt":
+        install_from_archive_apt(plan)
+    elif runtime == "custom":
+        if not install_from_custom_apt(plan):
+            return False  # If install fails, stop.
+    else:
+        hookenv.log(f"Unknown runtime {runtime}")
+        return False
+
+    plan.hold(all_docker_packages())
+    plan.execute()
+    hookenv.log("Holding docker-engine and docker.io packages at current revision.")
+
+    if runtime == "nvidia":
         set_state("nvidia-docker.installed")
         docker.set_daemon_json("default-runtime", "nvidia")
     else:
         docker.delete_daemon_json("default-runtime")
-        if runtime == "upstream":
-            install_from_upstream_apt()
-        elif runtime == "apt":
-            install_from_archive_apt()
-        elif runtime == "custom":
-            if not install_from_custom_apt():
-                return False  # If install fails, stop.
-        else:
-            hookenv.log("Unknown runtime {}".format(runtime))
-            return False
+
+    root = data_root()
+    try:
+        validate_backing_filesystem(driver, root)
+    except StorageDriverError as e:
+        status_set("blocked", str(e))
+        return False
+    os.makedirs(root, mode=0o711, exist_ok=True)
+    docker.set_daemon_json("storage-driver", driver)
+    docker.set_daemon_json("data-root", root)
+    unitdata.kv().set("docker.data-root", root)
+    configure_live_restore()
+    configure_log_policy()
+    configure_performance_profile()
+    configure_cgroup_driver()
 
     validate_config()
     render_configuration_template(service=True)
     reload_system_daemons()
 
-    hold_all()
-    hookenv.log("Holding docker-engine and docker.io packages at current revision.")
-
     host.service_restart("docker")
+    docker.clear_pending_changes()
+    if config("image-cache-preload"):
+        preload_image_cache()
     hookenv.log('Docker installed, setting "docker.ready" state.')
     set_state("docker.ready")
 
@@ -168,6 +234,376 @@ def install():
     check_call(["usermod", "-aG", "docker", "ubuntu"])
 
 
+def preload_image_cache():
+    """
+    Load the images of the image-cache resource and of the image-cache-path
+    cache before workloads start, so a rebuilt unit gets them at local disk
+    speed instead of pulling them again.
+
+    :return: None
+    """
+    from charms.layer import docker_images
+
+    sources = []
+    resource = hookenv.resource_get("image-cache")
+    # An empty file stands in for a resource that was not attached.
+    if resource and os.path.getsize(resource):
+        sources.append(resource)
+    if os.path.isdir(config("image-cache-path")):
+        sources.append(config("image-cache-path"))
+    if not sources:
+        return
+    if docker_engine.wait_for_engine(config("engine-probe-timeout")) is None:
+        hookenv.log("Docker does not answer, not preloading images.", hookenv.WARNING)
+        return
+
+    status_set("maintenance", "Loading cached images.")
+    for source in sources:
+        try:
+            result = docker_images.load_image_cache(source)
+        except (docker_engine.EngineError, docker_images.ImageCacheError) as e:
+            hookenv.log(str(e), hookenv.WARNING)
+            continue
+        hookenv.log(
+            "Loaded {} images ({} bytes) from {} in {}s, {} present already.".format(
+                len(result["loaded"]),
+                result["bytes"],
+                source,
+                result["seconds"],
+                result["hits"],
+            )
+        )
+
+
+def data_root():
+    """
+    The docker data-root from daemon-opts if the operator set one there,
+    else from the data-root config, else the docker-data storage when it
+    is attached.
+
+    :return: String
+    """
+    root = json.loads(config("daemon-opts")).get("data-root") or config("data-root")
+    if root:
+        return root
+    for storage_id in hookenv.storage_list("docker-data") or []:
+        return hookenv.storage_get("location", storage_id)
+    return DOCKER_DATA_ROOT
+
+
+def storage_driver():
+    """
+    The storage driver from daemon-opts if the operator set one there,
+    else from the storage-driver config.
+
+    Switching drivers hides every image and container stored by the
+    previous one, so auto keeps the driver docker runs with, and only
+    detects one before docker is installed.
+
+    :return: String, or None if docker is installed but the driver it
+      runs with can not be told
+    """
+    driver = json.loads(config("daemon-opts")).get("storage-driver")
+    if driver:
+        return driver
+    driver = config("storage-driver")
+    if driver != "auto":
+        return driver
+    try:
+        return docker_engine.request("GET", "/info", timeout=10)["Driver"]
+    except (docker_engine.EngineError, KeyError):
+        pass
+    if is_state("docker.ready"):
+        # The engine does not answer, go by what it was started with.
+        try:
+            with open(docker.DAEMON_JSON) as f:
+                return json.load(f).get("storage-driver")
+        except (OSError, ValueError):
+            return None
+    return detect_storage_driver(docker.host_fact("kernel-release"))
+
+
+def running_data_root():
+    """
+    The data-root docker runs with, from the engine, else from what it was
+    started with.
+
+    :return: String
+    """
+    try:
+        return docker_engine.request("GET", "/info", timeout=10)["DockerRootDir"]
+    except (docker_engine.EngineError, KeyError):
+        pass
+    try:
+        with open(docker.DAEMON_JSON) as f:
+            return json.load(f).get("data-root") or DOCKER_DATA_ROOT
+    except (OSError, ValueError):
+        return DOCKER_DATA_ROOT
+
+
+@when("config.changed.storage-driver", "docker.ready")
+def storage_driver_changed():
+    """
+    Install what the new storage driver needs and restart the daemon with
+    it. Images and containers stored by the previous driver are left on
+    disk, but are not visible until it is switched back.
+
+    :return: None
+    """
+    from charms.layer.docker_apt import AptPlan
+
+    try:
+        driver = storage_driver()
+        if driver is None:
+            hookenv.log("Docker does not answer, keeping its storage driver.")
+            return
+        packages = storage_driver_packages(driver, docker.host_fact("kernel-release"))
+        validate_backing_filesystem(driver, data_root())
+    except StorageDriverError as e:
+        status_set("blocked", str(e))
+        return
+
+    if packages:
+        plan = AptPlan()
+        plan.update()
+        plan.install(packages, optional=True)
+        plan.execute()
+    if docker.set_daemon_json("storage-driver", driver):
+        recycle_daemon(f"storage driver changed to {driver}", restart=False)
+
+
+@hook("docker-data-storage-attached")
+def docker_data_storage_attached():
+    """
+    :return: None
+    """
+    set_state("docker.data-root.check")
+
+
+@when("docker.ready")
+@when_any(
+    "config.changed.data-root",
+    "config.changed.daemon-opts",
+    "docker.data-root.check",
+)
+def move_data_root():
+    """
+    Move the docker data-root when it changed. The data is copied while
+    the daemon still runs, and what changed since is copied again once it
+    is stopped for the restart that switches it over, so the downtime is
+    that of the final copy.
+
+    :return: None
+    """
+    from charms.layer.docker_apt import AptPlan
+    from charms.layer.docker_apt import installed_packages
+
+    remove_state("docker.data-root.check")
+    kv = unitdata.kv()
+    current = kv.get("docker.data-root")
+    if current is None:
+        # Deployed before the data-root was recorded, go by the one docker
+        # runs with, which daemon-opts may already have moved.
+        current = running_data_root()
+        kv.set("docker.data-root", current)
+    target = data_root()
+    if target == current:
+        return
+    try:
+        validate_backing_filesystem(storage_driver(), target)
+    except StorageDriverError as e:
+        status_set("blocked", str(e))
+        return
+
+    if not installed_packages(["rsync"]):
+        plan = AptPlan()
+        plan.install(["rsync"])
+        plan.execute()
+    try:
+        migrate_data_root(current, target, progress=_data_root_progress(target))
+    except StorageDriverError as e:
+        status_set("blocked", str(e))
+        return
+
+    # daemon.json points at the target once the final copy is done, until
+    # then anything starting the daemon must find it on the current root.
+    kv.set("docker.data-root-migration", {"source": current, "target": target})
+    recycle_daemon(f"data-root moved to {target}")
+
+
+def _data_root_progress(target):
+    def progress(percent):
+        status_set("maintenance", f"Copying docker data-root to {target}: {percent}%")
+
+    return progress
+
+
+def _finish_data_root_migration(migration):
+    """
+    Copy what changed in the data-root since it was first copied, and
+    point daemon.json at the target, while the daemon is stopped.
+
+    :param migration: Dict with the `source` and `target` data-roots
+    :return: None
+    """
+    source, target = migration["source"], migration["target"]
+    hookenv.log(f"Switching docker data-root from {source} to {target}.")
+    migrate_data_root(source, target, _data_root_progress(target), delete=True)
+
+    kv = unitdata.kv()
+    kv.set("docker.data-root", target)
+    kv.unset("docker.data-root-migration")
+    docker.set_daemon_json("data-root", target)
+    hookenv.log(f"Docker data-root moved to {target}, {source} can be removed.")
+
+
+def configure_live_restore():
+    """
+    Set live-restore in daemon.json, so containers keep running while the
+    daemon restarts, unless it is disabled or conflicts with how the
+    daemon is used.
+
+    :return: None
+    """
+    if not config("live-restore"):
+        docker.delete_daemon_json("live-restore")
+        return
+    conflicts = live_restore_conflicts()
+    if conflicts:
+        hookenv.log(
+            "Not enabling live-restore: {}.".format(", ".join(conflicts)),
+            hookenv.WARNING,
+        )
+        docker.delete_daemon_json("live-restore")
+        return
+    docker.set_daemon_json("live-restore", True)
+
+
+def configure_log_policy():
+    """
+    Size container log rotation to the log-disk-budget share of the
+    filesystem holding the data-root, split between the containers the
+    node is expected to run. log-driver and log-opts set in daemon-opts
+    take precedence.
+
+    :return: Boolean True if the policy changed
+    """
+    budget = config("log-disk-budget")
+    try:
+        if budget:
+            policy = log_policy(
+                config("log-driver"),
+                parse_budget(budget, filesystem_size(data_root())),
+                config("log-expected-containers"),
+            )
+        else:
+            policy = {}
+    except ValueError as e:
+        status_set("blocked", str(e))
+        return False
+    if not data_changed("docker.log-policy", policy):
+        return False
+
+    for key in ("log-driver", "log-opts"):
+        if key in policy:
+            docker.set_daemon_json(key, policy[key])
+        else:
+            docker.delete_daemon_json(key)
+    if policy:
+        hookenv.log(
+            "Container logs: {}, {} files of {}.".format(
+                policy["log-driver"],
+                policy["log-opts"]["max-file"],
+                policy["log-opts"]["max-size"],
+            )
+        )
+    return True
+
+
+@when("docker.ready")
+def log_policy_changed():
+    """
+    Recompute the log policy when its options change, or when the data-root
+    moves to a filesystem of a different size. Only containers created
+    afterwards pick it up.
+
+    :return: None
+    """
+    if configure_log_policy():
+        recycle_daemon("log policy changed", restart=False)
+
+
+def configure_performance_profile():
+    """
+    Tune the daemon and the kernel for the performance-profile, sized to
+    this host's CPUs, memory and NIC speed.
+
+    :return: Boolean True if the tuning changed
+    """
+    try:
+        resources = docker_tuning.host_resources()
+        daemon, sysctl = docker_tuning.tuning(
+            config("performance-profile"),
+            resources["cpus"],
+            resources["memory"],
+            resources["nic-speed"],
+        )
+    except ValueError as e:
+        status_set("blocked", str(e))
+        return False
+    if not data_changed("docker.performance-profile", [daemon, sysctl]):
+        return False
+
+    # Remember what the host had before it was first tuned, to not lower it.
+    kv = unitdata.kv()
+    baseline = kv.get("docker.sysctl-baseline", default={})
+    for name in sysctl:
+        if name not in baseline:
+            baseline[name] = docker_tuning.current_sysctl(name)
+    kv.set("docker.sysctl-baseline", baseline)
+    docker_tuning.apply_sysctl(sysctl, baseline)
+
+    for key in docker_tuning.DAEMON_KEYS:
+        if key in daemon:
+            docker.set_daemon_json(key, daemon[key])
+        else:
+            docker.delete_daemon_json(key)
+    hookenv.log(
+        "Performance profile {}: {}".format(
+            config("performance-profile"),
+            json.dumps(dict(daemon, **sysctl), sort_keys=True),
+        )
+    )
+    return True
+
+
+@when("docker.ready")
+def performance_profile_changed():
+    """
+    :return: None
+    """
+    if configure_performance_profile():
+        recycle_daemon("performance profile changed", restart=False)
+
+
+@when("docker.ready", "config.changed.systemd-unit")
+def systemd_unit_changed():
+    """
+    :return: None
+    """
+    recycle_daemon("systemd-unit changed", restart=False)
+
+
+@when("docker.ready")
+@when_any("config.changed.live-restore", "config.changed.daemon-opts")
+def live_restore_changed():
+    """
+    :return: None
+    """
+    configure_live_restore()
+    recycle_daemon("live-restore changed", restart=False)
+
+
 @when("config.changed.install_from_upstream", "docker.ready")
 def toggle_install_from_upstream():
     """
@@ -193,14 +629,16 @@ def toggle_docker_daemon_source():
 
     :return: None or False
     """
+    from charms.layer.docker_apt import AptPlan
+    from charms.layer.docker_apt import installed_packages
 
-    # This returns a list of packages not currently installed on the system
-    # based on the parameters input. Use this to check if we have taken
-    # prior action against a docker deb package.
+    # Look up which of the docker packages are installed, with a single
+    # query. Use this to check if we have taken prior action against a
+    # docker deb package.
+    present = installed_packages(all_docker_packages())
     installed = []
     for k in docker_packages.keys():
-        packages = filter_installed_packages(docker_packages[k])
-        if packages == []:
+        if all(p in present for p in docker_packages[k]):
             installed.append(k)
 
     # None of the docker packages are installed.
@@ -229,13 +667,13 @@ def toggle_docker_daemon_source():
     # and reset the state to forcea reinstall.
     if runtime not in installed:
         host.service_stop("docker")
-        for k in docker_packages.keys():
-            package_list = " ".join(docker_packages[k])
-            hookenv.log("Removing package(s): {}.".format(package_list))
-            apt_unhold(docker_packages[k])
-            apt_purge(docker_packages[k])
-            remove_state("docker.ready")
-            remove_state("docker.available")
+        hookenv.log("Removing package(s): {}.".format(" ".join(present)))
+        plan = AptPlan()
+        plan.unhold(present)
+        plan.purge(present)
+        plan.execute()
+        remove_state("docker.ready")
+        remove_state("docker.available")
     else:
         hookenv.log("Not touching packages.")
 
@@ -250,33 +688,36 @@ def toggle_docker_daemon_source():
 def proxy_or_daemon_opts_changed():
     """
     The proxy or daemon configuration have changed, render templates and
-    restart the docker daemon.
+    restart the docker daemon if they changed, or only reload it when just
+    daemon.json changed in ways dockerd can reload.
 
     :return: None
     """
-    recycle_daemon()
+    recycle_daemon("proxy or daemon-opts changed", restart=False)
 
 
-def install_from_archive_apt():
+def install_from_archive_apt(plan):
     """
     Install Docker from Ubuntu universe.
 
+    :param plan: AptPlan to add the install to
     :return: None
     """
     status_set("maintenance", "Installing docker.io from universe.")
-    apt_install(["docker.io"], fatal=True)
+    plan.install(["docker.io"])
 
 
-def install_from_upstream_apt():
+def install_from_upstream_apt(plan):
     """
     Install docker from the apt repository. This is a pyton adaptation of
     the shell script found at https://get.docker.com/.
 
+    :param plan: AptPlan to add the install to
     :return: None
     """
     status_set("maintenance", "Installing docker-ce from upstream PPA.")
     key_url = "https://download.docker.com/linux/ubuntu/gpg"
-    add_apt_key_url(key_url)
+    plan.add_key_url(key_url)
 
     # The url to the server that contains the docker apt packages.
     apt_url = "https://download.docker.com/linux/ubuntu"
@@ -285,7 +726,7 @@ def install_from_upstream_apt():
     architecture = arch()
 
     # Get the lsb information as a dictionary.
-    lsb = host.lsb_release()
+    lsb = docker.host_fact("lsb-release")
 
     # The codename for the release.
     code = lsb["DISTRIB_CODENAME"]
@@ -295,36 +736,34 @@ def install_from_upstream_apt():
 
     # E.g.
     # deb [arch=amd64] https://download.docker.com/linux/ubuntu bionic stable
-    debs = list()
-    debs.append("deb [arch={}] {} {} {}".format(architecture, apt_url, code, repo))
-    write_docker_sources(debs)
-    apt_update(fatal=True)
+    plan.add_source(f"deb [arch={architecture}] {apt_url} {code} {repo}")
 
     # Install Docker via apt.
-    apt_install(docker_packages["upstream"], fatal=True)
+    plan.install(docker_packages["upstream"])
 
 
-def install_from_nvidia_apt():
+def install_from_nvidia_apt(plan):
     """
     Install cuda docker from the nvidia apt repository.
 
+    :param plan: AptPlan to add the install to
     :return: None
     """
     status_set("maintenance", "Installing docker-engine from Nvidia PPA.")
 
     # Get the server and key in the apt-key management tool.
-    add_apt_key("9DC858229FC7DD38854AE2D88D81803C0EBFCD88")
+    plan.add_key("9DC858229FC7DD38854AE2D88D81803C0EBFCD88")
 
     # Install key for nvidia-docker. This key changes frequently
     # ([expires: 2019-09-20]) so we should do what the official docs say and
     # not try to get it through its fingerprint.
-    add_apt_key_url("https://nvidia.github.io/nvidia-container-runtime/gpgkey")
+    plan.add_key_url("https://nvidia.github.io/nvidia-container-runtime/gpgkey")
 
     # Get the package architecture (amd64), not the machine hardware (x86_64)
     architecture = arch()
 
     # Get the lsb information as a dictionary.
-    lsb = host.lsb_release()
+    lsb = docker.host_fact("lsb-release")
     code = lsb["DISTRIB_CODENAME"]
     release = lsb["DISTRIB_RELEASE"]
     ubuntu = str(lsb["DISTRIB_ID"]).lower()
@@ -332,36 +771,30 @@ def install_from_nvidia_apt():
     nvidia_url = "https://nvidia.github.io"
     repo = "stable"
 
-    debs = list()
-    debs.append("deb [arch={}] {} {} {}".format(architecture, docker_url, code, repo))
+    plan.add_source(f"deb [arch={architecture}] {docker_url} {code} {repo}")
 
     packages = ["libnvidia-container", "nvidia-container-runtime", "nvidia-docker"]
 
     for package in packages:
-        debs.append(
+        plan.add_source(
             "deb {}/{}/ubuntu{}/{} /".format(nvidia_url, package, release, architecture)
         )
 
-    write_docker_sources(debs)
-
-    install_cuda_drivers_repo(architecture, release, ubuntu)
-
-    apt_update(fatal=True)
+    install_cuda_drivers_repo(plan, architecture, release, ubuntu)
 
     # Actually install the required packages docker-ce nvidia-docker2.
     docker_ce = hookenv.config("docker-ce-package")
     nvidia_docker2 = hookenv.config("nvidia-docker-package")
     nv_container_runtime = hookenv.config("nvidia-container-runtime-package")
-    apt_install(
-        ["cuda-drivers", docker_ce, nvidia_docker2, nv_container_runtime], fatal=True
-    )
+    plan.install(["cuda-drivers", docker_ce, nvidia_docker2, nv_container_runtime])
 
 
-def install_from_custom_apt():
+def install_from_custom_apt(plan):
     """
     Install docker from custom repository.
 
-    :return: None or False
+    :param plan: AptPlan to add the install to
+    :return: True or False
     """
     status_set("maintenance", "Installing Docker from custom repository.")
 
@@ -387,22 +820,23 @@ def install_from_custom_apt():
         hookenv.status_set("blocked", message)
         return False
 
-    lsb = host.lsb_release()
+    lsb = docker.host_fact("lsb-release")
 
     format_dictionary = {"ARCH": arch(), "CODE": lsb["DISTRIB_CODENAME"]}
 
-    add_apt_key_url(key_url)
-    write_docker_sources([repo_string.format(**format_dictionary)])
-    apt_update()
-    apt_install([package_name])
+    plan.add_key_url(key_url)
+    plan.add_source(repo_string.format(**format_dictionary))
+    plan.install([package_name])
+    return True
 
 
-def install_cuda_drivers_repo(architecture, release, ubuntu):
+def install_cuda_drivers_repo(plan, architecture, release, ubuntu):
     """
     Install cuda drivers this is xenial only.
     We want to install cuda-drivers only this means that the
     cuda version plays no role. Any repo will do.
 
+    :param plan: AptPlan to add the repository to
     :param architecture: String
     :param release: String
     :param ubuntu: String
@@ -417,84 +851,175 @@ def install_cuda_drivers_repo(architecture, release, ubuntu):
             distribution
         )
     )
-    command = "apt-key adv --fetch-keys http://{}/{}".format(repository_path, key_file)
-    check_call(split(command))
+    plan.add_key_url(f"http://{repository_path}/{key_file}")
 
     cuda_repository_version = config("cuda_repo")
     cuda_repository_package = "cuda-repo-{}_{}_{}.deb".format(
         distribution, cuda_repository_version, architecture
     )
-    repository_url = "https://{}/{}".format(repository_path, cuda_repository_package)
-
-    with contextlib.closing(urlopen(repository_url)) as r:
-        with open(cuda_repository_package, "wb") as f:
-            while chunk := r.read(1024 * 1024):  # 1M chunks
-                f.write(chunk)
-
-    command = "dpkg -i {}".format(cuda_repository_package)
-    check_call(split(command))
+    plan.add_deb_url(
+        f"https://{repository_path}/{cuda_repository_package}",
+        sha256=config("cuda_repo_sha256").strip().lower() or None,
+    )
 
 
-def write_docker_sources(debs):
+@when("docker.ready")
+def configure_image_gc():
     """
-    Write docker.list under etc/apt/sources.list.d.
+    Install, update or disable the timer that removes unused images once
+    the disk holding the docker data-root fills up.
 
-    :param debs: List String
     :return: None
     """
-    # Run mkdir -p /etc/apt/sources.list.d.
-    if not os.path.isdir("/etc/apt/sources.list.d"):
-        os.makedirs("/etc/apt/sources.list.d")
+    cfg = config()
+    interval = cfg.get("image-gc-interval")
+    high = cfg.get("image-gc-high-threshold")
+    settings = [
+        high,
+        cfg.get("image-gc-low-threshold"),
+        cfg.get("image-gc-protected-images").split(),
+        interval,
+        hookenv.charm_dir(),
+    ]
+    if not data_changed("docker.image-gc", settings):
+        return
 
-    # Write the docker source file to the apt sources.list.d directory.
-    with open("/etc/apt/sources.list.d/docker.list", "w+") as stream:
-        stream.write("\n".join(debs))
+    # Imported past the check, this handler runs in every hook.
+    from charms.layer import docker_gc
+
+    timer = os.path.basename(docker_gc.IMAGE_GC_TIMER)
+    if not interval or high >= 100:
+        if os.path.exists(docker_gc.IMAGE_GC_TIMER):
+            hookenv.log("Disabling image garbage collection.")
+            check_call(["systemctl", "disable", "--now", timer])
+        return
+
+    try:
+        changed = docker_gc.render_image_gc(*settings[:4])
+    except ValueError as e:
+        hookenv.log(str(e), hookenv.ERROR)
+        status_set("blocked", str(e))
+        return
+    if changed:
+        check_call(["systemctl", "daemon-reload"])
+    check_call(["systemctl", "enable", "--now", timer])
 
 
-def add_apt_key_url(url):
+@when("docker.ready")
+@when_not("docker.images.prefetched")
+def prefetch_images():
     """
-    Add a key from a URL.
+    Pull the images listed in prefetch-images before the unit takes work,
+    so the first containers started on it do not wait for their pulls.
 
-    :param url: String
     :return: None
     """
-    curl_command = "curl -s -L {}".format(url).split()
-    curl = Popen(curl_command, stdout=PIPE)
-    apt_command = "apt-key add -".split()
-    check_call(apt_command, stdin=curl.stdout)
-    curl.wait()
+    from charms.layer import docker_images
+
+    images = config("prefetch-images").split()
+    if images:
+        if docker_engine.wait_for_engine(config("engine-probe-timeout")) is None:
+            return
+        status_set("maintenance", f"Prefetching {len(images)} images.")
+        results = docker_images.prefetch_images(images)
+        for image, result in results.items():
+            if "error" in result:
+                hookenv.log(result["error"], hookenv.WARNING)
+            else:
+                hookenv.log(
+                    "Prefetched {}: {} bytes in {}s{}.".format(
+                        image,
+                        result["bytes"],
+                        result["seconds"],
+                        " (present already)" if result["hit"] else "",
+                    )
+                )
+    set_state("docker.images.prefetched")
+
+
+@when("config.changed.prefetch-images")
+def prefetch_images_changed():
+    """
+    :return: None
+    """
+    remove_state("docker.images.prefetched")
 
 
-def add_apt_key(key):
+@when("docker.ready")
+def configure_cgroups():
     """
-    Enter the server and key in the apt-key management tool.
+    Make memory and swap accounting available to containers. Where the
+    running kernel supports them, systemd unit properties turn them on;
+    only when the kernel command line lacks them is it changed and the
+    machine rebooted.
 
-    :param key: String
     :return: None
     """
-    keyserver = config("apt-key-server")
-    http_proxy = config("http_proxy")
-    cmd = "apt-key adv --keyserver {0}".format(keyserver)
-    if http_proxy:
-        cmd = "{0} --keyserver-options http-proxy={1}".format(cmd, http_proxy)
-    cmd = "{0} --recv-keys {1}".format(cmd, key)
+    # Compared to what was last applied rather than gated on the
+    # config.changed flags, which are gone by the hook docker is ready in.
+    if not data_changed(
+        "docker.cgroups", [config("enable-cgroups"), config("cgroup-driver")]
+    ):
+        return
+    if configure_cgroup_driver():
+        recycle_daemon("cgroup driver changed")
+    if not config("enable-cgroups"):
+        return
 
-    # "apt-key adv --keyserver hkp://p80.pool.sks-keyservers.net:80
-    # --recv-keys 58118E89F3A912897C070ADBF76221572C52609D"
-    check_call(split(cmd))
+    failed = docker_cgroups.set_accounting()
+    if failed:
+        hookenv.log(
+            "Could not turn on accounting for {}.".format(", ".join(failed)),
+            hookenv.WARNING,
+        )
 
+    arguments = docker_cgroups.required_cmdline()
+    if not arguments:
+        return
+    kv = unitdata.kv()
+    if host.is_container():
+        hookenv.log(
+            "Memory or swap accounting needs {} on the host kernel command "
+            "line.".format(" ".join(arguments)),
+            hookenv.WARNING,
+        )
+        return
+    if kv.get("docker.cgroups.rebooted-for") == arguments:
+        # The boot loader did not pick up the drop-in, do not reboot again.
+        status_set(
+            "blocked",
+            "Kernel command line lacks {} after reboot.".format(" ".join(arguments)),
+        )
+        return
+    hookenv.log("Adding {} to the kernel command line.".format(" ".join(arguments)))
+    status_set("maintenance", "Rebooting to enable cgroup accounting.")
+    docker_cgroups.write_grub_cmdline(arguments)
+    kv.set("docker.cgroups.rebooted-for", arguments)
+    kv.flush()
+    check_call(["juju-reboot"])
 
-@when("docker.ready")
-@when_not("cgroups.modified")
-def enable_grub_cgroups():
+
+def configure_cgroup_driver():
     """
-    :return: None
+    :return: Boolean True if the cgroup driver changed
     """
-    cfg = config()
-    if cfg.get("enable-cgroups"):
-        hookenv.log("Calling enable_grub_cgroups.sh and rebooting machine.")
-        check_call(["scripts/enable_grub_cgroups.sh"])
-        set_state("cgroups.modified")
+    hierarchy = docker_cgroups.cgroup_hierarchy()
+    try:
+        driver = docker_cgroups.cgroup_driver(
+            config("cgroup-driver"), hierarchy, docker_cgroups.init_system()
+        )
+    except ValueError as e:
+        status_set("blocked", str(e))
+        return False
+    if not data_changed("docker.cgroup-driver", driver):
+        return False
+
+    hookenv.log(f"cgroup {hierarchy} hierarchy, {driver} cgroup driver.")
+    if driver == "systemd":
+        docker.set_daemon_json("exec-opts", ["native.cgroupdriver=systemd"])
+    else:
+        docker.delete_daemon_json("exec-opts")
+    return True
 
 
 @when("docker.ready")
@@ -514,6 +1039,10 @@ def signal_workloads_start():
         status_set("waiting", "Container runtime not available.")
         return
 
+    # Optionally hold back workloads until their images are warm.
+    if config("prefetch-images-gate") and not is_state("docker.images.prefetched"):
+        return
+
     status_set("active", "Container runtime available.")
     set_state("docker.available")
 
@@ -527,6 +1056,8 @@ def container_sdn_setup(sdn):
     :param sdn: SDNPluginProvider
     :return: None
     """
+    from charms.docker import DockerOpts
+
     sdn_config = sdn.get_sdn_config()
     bind_ip = sdn_config["subnet"]
     mtu = sdn_config["mtu"]
@@ -556,6 +1087,8 @@ def scrub_sdn_config():
 
     :return: None
     """
+    from charms.docker import DockerOpts
+
     opts = DockerOpts()
     try:
         opts.pop("bip")
@@ -573,10 +1106,49 @@ def scrub_sdn_config():
     # has been removed. restarting the daemon restores docker with its default
     # networking mode.
     _remove_docker_network_bridge()
-    recycle_daemon()
+    recycle_daemon("SDN configuration removed")
     remove_state("docker.sdn.configured")
 
 
+@when("docker.ready", "docker.restart.queued")
+def retry_queued_restart():
+    """
+    Try a restart that waits for the rolling restart lock again, in the
+    leader-settings-changed hook that may have granted it.
+
+    :return: None
+    """
+    recycle_daemon("queued restart")
+
+
+@when("docker.ready", "docker.upgrade.queued")
+def queued_upgrade():
+    """
+    Run the upgrade queued by the upgrade-docker action once this unit
+    holds the rolling restart lock.
+
+    :return: None
+    """
+    recycle_daemon("upgrade-docker")
+
+
+@hook(
+    "docker-peers-relation-changed",
+    "docker-peers-relation-departed",
+    "leader-elected",
+    "config-changed",
+)
+def update_rolling_restart_lock():
+    """
+    Grant the rolling restart lock to the units waiting for it, as units
+    holding it report their engine healthy again.
+
+    :return: None
+    """
+    if hookenv.is_leader():
+        RollingRestart(config("max-unavailable")).update_grants()
+
+
 @when("docker.restart")
 def docker_restart():
     """
@@ -585,7 +1157,7 @@ def docker_restart():
 
     :return: None
     """
-    recycle_daemon()
+    recycle_daemon("docker.restart requested")
     remove_state("docker.restart")
 
 
@@ -598,7 +1170,123 @@ def docker_template_update():
 
     :return: None
     """
-    recycle_daemon()
+    recycle_daemon("docker-opts changed", restart=False)
+
+
+@hook(
+    "leader-elected",
+    "leader-settings-changed",
+    "update-status",
+    "registry-mirror-relation-joined",
+    "use-registry-mirror-relation-changed",
+    "use-registry-mirror-relation-departed",
+)
+def registry_mirror_check():
+    """
+    Check the registry mirrors again, as they may have come or gone.
+    update-status only does when there are mirrors to check.
+
+    :return: None
+    """
+    if hookenv.hook_name() == "update-status" and not (
+        config("registry-mirror") or registry_mirrors()
+    ):
+        return
+    set_state("docker.registry-mirror.check")
+
+
+@when("docker.available")
+@when_any(
+    "config.changed.registry-mirror",
+    "config.changed.registry-mirror-port",
+    "config.changed.registry-mirror-upstream",
+    "config.changed.registry-mirror-image",
+    "docker.registry-mirror.check",
+)
+def configure_registry_mirror():
+    """
+    Run the local registry mirror on the leader when registry-mirror is
+    "local", publish it to the peers and related applications, and point
+    the daemon at the mirrors that answer. Mirrors that do not are left
+    out until they do again, so pulls go straight upstream meanwhile
+    instead of waiting on them.
+
+    :return: None
+    """
+    from charms.layer import docker_mirror
+
+    remove_state("docker.registry-mirror.check")
+    mode = config("registry-mirror")
+    kv = unitdata.kv()
+
+    local = None
+    if mode == "local":
+        local = hookenv.leader_get("registry-mirror-url")
+    if mode == "local" and hookenv.is_leader():
+        spec = docker_mirror.mirror_spec(
+            port=config("registry-mirror-port"),
+            upstream=config("registry-mirror-upstream"),
+            image=config("registry-mirror-image"),
+        )
+        try:
+            if docker_mirror.ensure_mirror(spec):
+                hookenv.log("Started the local registry mirror.")
+        except docker_engine.EngineError as e:
+            hookenv.log(f"Running the registry mirror failed: {e}", hookenv.ERROR)
+        else:
+            kv.set("docker.registry-mirror.running", True)
+            url = "http://{}:{}".format(
+                hookenv.unit_private_ip(), config("registry-mirror-port")
+            )
+            if local != url:
+                hookenv.leader_set({"registry-mirror-url": url})
+                local = url
+    elif kv.get("docker.registry-mirror.running"):
+        hookenv.log("Removing the local registry mirror.")
+        docker_mirror.remove_mirror()
+        kv.unset("docker.registry-mirror.running")
+    if (
+        mode != "local"
+        and hookenv.is_leader()
+        and hookenv.leader_get("registry-mirror-url")
+    ):
+        hookenv.leader_set({"registry-mirror-url": None})
+
+    # Offer the application's mirror to related docker applications.
+    for rid in hookenv.relation_ids("registry-mirror"):
+        hookenv.relation_set(rid, {"url": local})
+
+    mirrors = registry_mirrors(local)
+    healthy = [url for url in mirrors if docker_mirror.mirror_healthy(url)]
+    for url in mirrors:
+        if url not in healthy:
+            hookenv.log(
+                f"Registry mirror {url} does not answer, pulling without it.",
+                hookenv.WARNING,
+            )
+    if healthy:
+        docker.set_daemon_json("registry-mirrors", healthy)
+    else:
+        docker.delete_daemon_json("registry-mirrors")
+    if "registry-mirrors" in docker.pending_daemon_json_changes():
+        recycle_daemon("registry mirrors changed", restart=False)
+
+
+def registry_mirrors(local=None):
+    """
+    The registry mirrors this unit should pull through: the application's
+    local mirror or those in registry-mirror, and those of related
+    applications.
+
+    :param local: String URL of the application's local mirror
+    :return: List String mirror URLs
+    """
+    mode = config("registry-mirror")
+    mirrors = [local] if mode == "local" else mode.split()
+    for rid in hookenv.relation_ids("use-registry-mirror"):
+        for unit in hookenv.related_units(rid):
+            mirrors.append(hookenv.relation_get("url", unit, rid))
+    return [url for url in dict.fromkeys(mirrors) if url]
 
 
 @when("docker.ready", "dockerhost.connected")
@@ -609,6 +1297,8 @@ def dockerhost_connected(dockerhost):
 
     :return: None
     """
+    from charms.docker import Docker
+
     dockerhost.configure(Docker().socket)
 
 
@@ -629,6 +1319,8 @@ def update_nrpe_config():
     """
     :return: None
     """
+    from charmhelpers.contrib.charmsupport import nrpe
+
     # List of systemd services that will be checked.
     services = ["docker"]
 
@@ -647,6 +1339,8 @@ def remove_nrpe_config():
     """
     :return: None
     """
+    from charmhelpers.contrib.charmsupport import nrpe
+
     remove_state(f"{NRPE_PRIMARY}.docker.initial-config")
 
     # List of systemd services for which the checks will be removed.
@@ -671,34 +1365,191 @@ def validate_config():
 
     :return: None
     """
-    max_line = 2048
-    line_prefix_len = len('Environment="NO_PROXY=""')
-    remain_len = max_line - line_prefix_len
-    if len(config("no_proxy")) > remain_len:
-        raise ConfigError("no_proxy longer than {} chars.".format(remain_len))
+    # Check the value that will be rendered, which may come from the model
+    # proxy settings rather than the charm config. Drop-ins keep it in an
+    # environment file instead, which has no such limit.
+    no_proxy = proxy_settings()["no_proxy"] or ""
+    if config("systemd-unit") == "drop-in":
+        return
+    if len(no_proxy) > NO_PROXY_MAX_LEN:
+        raise ConfigError(f"no_proxy longer than {NO_PROXY_MAX_LEN} chars.")
 
 
-def recycle_daemon():
+def recycle_daemon(reason="configuration changed", restart=True):
     """
-    Render the docker template files and restart the docker daemon on this
-    system.
+    Request a render of the docker template files and a restart of the
+    docker daemon on this system.
+
+    Requests are queued and flushed once when the hook exits, so however
+    many handlers ask for a recycle during a hook the daemon only restarts
+    once.
 
+    :param reason: String logged when the queue is flushed
+    :param restart: Boolean False if the request only affects the rendered
+      configuration. The daemon is then left alone when nothing changed on
+      disk, and only reloaded when the changes are limited to daemon.json
+      keys that dockerd applies on SIGHUP.
     :return: None
     """
     validate_config()
-    hookenv.log("Restarting docker service.")
+    if not _recycle_requests:
+        hookenv.atexit(_flush_recycle_daemon)
+    _recycle_requests[reason] = _recycle_requests.get(reason, False) or restart
+
+
+def _flush_recycle_daemon():
+    """
+    Recycle the docker daemon once for every request queued by
+    recycle_daemon() during this hook.
+
+    :return: None
+    """
+    reasons = ", ".join(_recycle_requests)
+    restart = any(_recycle_requests.values())
+    _recycle_requests.clear()
 
     # Re-render our docker daemon template at this time... because we're
     # restarting. And its nice to play nice with others. Isn't that nice?
     render_configuration_template(service=True)
-    reload_system_daemons()
-    host.service_restart("docker")
+    files = docker.pending_file_changes()
+    keys = docker.pending_daemon_json_changes()
+    properties = docker.pending_unit_changes()
+    if docker.DOCKER_SERVICE in files or properties:
+        reload_system_daemons()
+
+    if not restart:
+        if not files and not keys and not properties:
+            hookenv.log(f"Docker configuration unchanged: {reasons}.")
+            return
+        restart = (
+            bool(files)
+            or docker.restart_required(keys)
+            or docker.unit_restart_required(properties)
+        )
+    if not restart:
+        hookenv.log(f"Reloading docker service: {reasons}.")
+        if properties:
+            hookenv.log("Changed unit properties: {}.".format(", ".join(properties)))
+        if keys:
+            hookenv.log("Changed daemon.json keys: {}.".format(", ".join(keys)))
+            restart = not host.service_reload("docker")
+    if restart:
+        # Roll restarts through the application, a few units at a time.
+        lock = RollingRestart(config("max-unavailable"))
+        if not lock.acquire():
+            hookenv.log(f"Waiting for the rolling restart lock: {reasons}.")
+            status_set("waiting", "Waiting for peers to restart the container runtime.")
+            set_state("docker.restart.queued")
+            return
+
+        if is_state("docker.upgrade.queued"):
+            # The upgrade restarts the daemon itself.
+            healthy = _upgrade_docker()
+        else:
+            hookenv.log(f"Restarting docker service: {reasons}.")
+            report = restart_daemon(
+                _restart_docker, deadline=config("engine-probe-timeout")
+            )
+            _log_restart_report(report)
+            healthy = report["seconds"] is not None
+        # A failed upgrade keeps the lock, stopping the rollout.
+        lock.release(healthy=healthy)
+        if is_state("docker.restart.queued") and healthy:
+            status_set("active", "Container runtime available.")
+        remove_state("docker.restart.queued")
+        remove_state("docker.upgrade.queued")
+    docker.clear_pending_changes()
 
     if not _probe_runtime_availability():
         status_set("waiting", "Container runtime not available.")
         return
 
 
+def _restart_docker():
+    """
+    Restart the daemon. Work that needs the daemon down, like moving the
+    data-root or removing the docker0 bridge, is done while it is stopped.
+
+    :return: None
+    """
+    kv = unitdata.kv()
+    migration = kv.get("docker.data-root-migration")
+    remove_bridge = kv.get("docker.remove-docker0")
+    if not migration and not remove_bridge:
+        host.service_restart("docker")
+        return
+
+    # Stop the socket too, or a client could start the daemon again
+    # before the work is done.
+    host.service_stop("docker.socket")
+    host.service_stop("docker")
+    try:
+        if remove_bridge:
+            _delete_docker0()
+            kv.unset("docker.remove-docker0")
+        if migration:
+            _finish_data_root_migration(migration)
+    finally:
+        host.service_start("docker")
+
+
+def _upgrade_docker():
+    """
+    Run the upgrade queued by the upgrade-docker action, whose packages
+    it already downloaded.
+
+    :return: Boolean True if the upgraded engine answers
+    """
+    from charms.layer.docker_upgrade import UpgradeError
+    from charms.layer.docker_upgrade import upgrade_docker
+
+    hookenv.log("Upgrading docker packages.")
+    try:
+        # Restart the same way as without an upgrade, so a data-root
+        # migration or bridge removal waiting for the daemon to stop is
+        # done while it is.
+        result = upgrade_docker(
+            downloaded=True,
+            deadline=config("engine-probe-timeout"),
+            restart=_restart_docker,
+        )
+    except UpgradeError as e:
+        hookenv.log(str(e), hookenv.ERROR)
+        status_set("blocked", "Docker upgrade failed and was rolled back.")
+        return False
+    hookenv.log(
+        "Docker upgraded to {} in {}s, the engine answered {}s after "
+        "restarting.".format(
+            result["engine-version"], result["install"], result["restart"]
+        )
+    )
+    _log_restart_report(result["containers"])
+    return True
+
+
+def _log_restart_report(report):
+    """
+    :param report: Dict from restart_daemon()
+    :return: None
+    """
+    if report["seconds"] is None:
+        hookenv.log("Docker did not answer after restarting.", hookenv.WARNING)
+    else:
+        hookenv.log("Docker answered {}s after restarting.".format(report["seconds"]))
+    hookenv.log(
+        "Containers running before restart: {}, after: {}.".format(
+            report["before"], report["after"]
+        )
+    )
+    if report["lost"]:
+        hookenv.log(
+            "Containers no longer running after restart: {}.".format(
+                ", ".join(c[:12] for c in report["lost"])
+            ),
+            hookenv.WARNING,
+        )
+
+
 def reload_system_daemons():
     """
     Reload the system daemons from on-disk configuration changes.
@@ -706,7 +1557,7 @@ def reload_system_daemons():
     :return: None
     """
     hookenv.log("Reloading system daemons.")
-    lsb = host.lsb_release()
+    lsb = docker.host_fact("lsb-release")
     code = lsb["DISTRIB_CODENAME"]
     if code != "trusty":
         command = ["systemctl", "daemon-reload"]
@@ -717,19 +1568,20 @@ def reload_system_daemons():
 
 def _probe_runtime_availability():
     """
-    Determine if the workload daemon is active and responding.
+    Determine if the workload daemon is active and responding, pinging the
+    engine API until it answers or `engine-probe-timeout` expires.
 
     :return: Boolean
     """
-    try:
-        command = ["docker", "info"]
-        check_call(command)
-        return True
-    except CalledProcessError:
+    elapsed = docker_engine.wait_for_engine(deadline=config("engine-probe-timeout"))
+    if elapsed is None:
         # Remove the availability state if we fail reachability.
         remove_state("docker.available")
         return False
 
+    hookenv.log(f"Container runtime answered after {elapsed:.2f}s.")
+    return True
+
 
 def _remove_docker_network_bridge():
     """
@@ -740,14 +1592,18 @@ def _remove_docker_network_bridge():
     :return: None
     """
     status_set("maintenance", "Reconfiguring container runtime network bridge.")
-    host.service_stop("docker")
-    apt_install(["bridge-utils"], fatal=True)
 
-    # cmd = "ifconfig docker0 down"
-    # ifconfig doesn't always work. use native linux networking commands to
-    # mark the bridge as inactive.
-    check_call(["ip", "link", "set", "docker0", "down"])
-    check_call(["brctl", "delbr", "docker0"])
+    # The bridge is deleted while the daemon is stopped for the restart
+    # that renders the config, so it is only down once.
+    unitdata.kv().set("docker.remove-docker0", True)
+    recycle_daemon("docker0 bridge removed")
+
 
-    # Render the config and restart docker.
-    recycle_daemon()
+def _delete_docker0():
+    """
+    Remove the docker0 bridge over netlink, if it is still there.
+
+    :return: None
+    """
+    if remove_bridge("docker0"):
+        hookenv.log("Removed the docker0 bridge.")
@@ -1,6 +1,134 @@
+import importlib.util
+import json
+import os
+import shutil
+import socketserver
 import sys
+import tempfile
+import threading
+import types
+from http.server import BaseHTTPRequestHandler
 from unittest.mock import MagicMock
 
+import pytest
+from charmhelpers.core import unitdata
+
 # mock dependencies which we don't care about covering in our tests
 sys.modules["charms.docker"] = MagicMock()
 sys.modules["charms.reactive"] = MagicMock()
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    """Answers engine API requests from the `routes` of its server."""
+
+    def address_string(self):
+        return "fake-engine"
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        self.server.requests.append((self.command, self.path))
+        # Read the body, or closing the connection fails the client's send.
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = self._read_chunked()
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if body and self.headers.get("Content-Type") == "application/json":
+            body = json.loads(body)
+        if body:
+            self.server.bodies[(self.command, self.path)] = body
+        route = self.server.routes.get((self.command, self.path.split("?")[0]))
+        if route is None:
+            status, body = 404, {"message": "page not found"}
+        else:
+            status, body = route
+        if isinstance(body, bytes):
+            content_type = "text/plain"
+        else:
+            content_type = "application/json"
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_chunked(self):
+        body = b""
+        while True:
+            size = int(self.rfile.readline().split(b";")[0], 16)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+            if not size:
+                return body
+
+    do_GET = do_POST = do_DELETE = _respond
+
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, FakeEngineHandler)
+        self.routes = {("GET", "/_ping"): (200, b"OK")}
+        self.requests = []
+        self.bodies = {}
+
+
+@pytest.fixture
+def socket_path():
+    # AF_UNIX paths are limited to 108 bytes, keep clear of tmp_path.
+    directory = tempfile.mkdtemp()
+    yield os.path.join(directory, "docker.sock")
+    shutil.rmtree(directory)
+
+
+@pytest.fixture
+def engine(socket_path):
+    server = FakeEngine(socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def reactive(monkeypatch):
+    """
+    Load reactive/docker.py with its handlers left undecorated, flags kept
+    in the `flags` set of the module and an in-memory unit kv store.
+    """
+    flags = set()
+    kv = unitdata.Storage(":memory:")
+
+    def decorator(*args, **kwargs):
+        return lambda f: f
+
+    def data_changed(key, value):
+        key = f"reactive.data_changed.{key}"
+        value = json.dumps(value, sort_keys=True)
+        changed = kv.get(key) != value
+        kv.set(key, value)
+        return changed
+
+    framework = types.ModuleType("charms.reactive")
+    for name in ("hook", "when", "when_any", "when_not"):
+        setattr(framework, name, decorator)
+    framework.set_state = flags.add
+    framework.remove_state = flags.discard
+    framework.is_state = flags.__contains__
+    helpers = types.ModuleType("charms.reactive.helpers")
+    helpers.data_changed = data_changed
+
+    monkeypatch.setitem(sys.modules, "charms.reactive", framework)
+    monkeypatch.setitem(sys.modules, "charms.reactive.helpers", helpers)
+    monkeypatch.setattr(unitdata, "kv", lambda: kv)
+
+    path = os.path.join(os.path.dirname(__file__), "..", "reactive", "docker.py")
+    spec = importlib.util.spec_from_file_location("reactive_docker", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.flags = flags
+    return module
@@ -0,0 +1,162 @@
+from unittest.mock import call
+from unittest.mock import patch
+
+from charms.layer.docker_apt import AptPlan
+from charms.layer.docker_apt import _install_debs
+from charms.layer.docker_apt import installable_packages
+
+
+def nvidia_plan():
+    plan = AptPlan()
+    plan.unhold(["docker.io", "docker-ce"])
+    plan.update()
+    plan.install(["aufs-tools", "linux-image-extra-5.4.0"], optional=True)
+    plan.add_key("9DC858229FC7DD38854AE2D88D81803C0EBFCD88")
+    plan.add_key_url("https://nvidia.github.io/nvidia-container-runtime/gpgkey")
+    plan.add_key_url("http://developer.download.nvidia.com/7fa2af80.pub")
+    plan.add_source("deb [arch=amd64] https://download.docker.com/linux/ubuntu")
+    plan.add_source("deb https://nvidia.github.io/nvidia-docker/ubuntu18.04/amd64 /")
+    plan.add_deb_url(
+        "https://developer.download.nvidia.com/cuda-repo.deb", sha256="ab" * 32
+    )
+    plan.install(["cuda-drivers", "docker-ce=5:18.09.1~3-0~ubuntu-bionic"])
+    plan.hold(["docker.io", "docker-ce", "docker-ce"])
+    return plan
+
+
+def test_dump():
+    assert nvidia_plan().dump() == [
+        "apt-mark unhold docker.io docker-ce",
+        "apt-key add https://nvidia.github.io/nvidia-container-runtime/gpgkey",
+        "apt-key add http://developer.download.nvidia.com/7fa2af80.pub",
+        "apt-key adv --recv-keys 9DC858229FC7DD38854AE2D88D81803C0EBFCD88",
+        "write /etc/apt/sources.list.d/docker.list",
+        "dpkg -i https://developer.download.nvidia.com/cuda-repo.deb",
+        "apt-get update",
+        "apt-get install cuda-drivers docker-ce=5:18.09.1~3-0~ubuntu-bionic "
+        "aufs-tools linux-image-extra-5.4.0",
+        "apt-mark hold docker.io docker-ce",
+    ]
+    assert AptPlan().dump() == []
+
+    plan = AptPlan()
+    plan.unhold(["docker.io"])
+    plan.purge(["docker.io"])
+    assert plan.dump() == ["apt-mark unhold docker.io", "apt-get purge docker.io"]
+
+
+@patch("charms.layer.docker_apt.hookenv")
+@patch("charms.layer.docker_apt.installed_packages")
+@patch("charms.layer.docker_apt.installable_packages")
+@patch("charms.layer.docker_apt._install_debs")
+@patch("charms.layer.docker_apt._add_keys")
+@patch("charms.layer.docker_apt._add_key_url")
+@patch("charms.layer.docker_apt.write_docker_sources")
+@patch("charms.layer.docker_apt.apt_hold")
+@patch("charms.layer.docker_apt.apt_install")
+@patch("charms.layer.docker_apt.apt_update")
+@patch("charms.layer.docker_apt.apt_unhold")
+def test_execute(
+    apt_unhold,
+    apt_update,
+    apt_install,
+    apt_hold,
+    write_docker_sources,
+    add_key_url,
+    add_keys,
+    install_debs,
+    installable,
+    installed,
+    hookenv,
+):
+    installed.side_effect = lambda packages: [p for p in packages if p != "docker.io"]
+    installable.return_value = ["aufs-tools"]
+
+    plan = nvidia_plan()
+    assert plan.execute(dry_run=True) == plan.dump()
+    apt_update.assert_not_called()
+
+    plan.execute()
+    apt_unhold.assert_called_once_with(["docker-ce"])
+    assert add_key_url.call_count == 2
+    add_keys.assert_called_once_with(["9DC858229FC7DD38854AE2D88D81803C0EBFCD88"])
+    write_docker_sources.assert_called_once_with(plan.sources)
+    install_debs.assert_called_once_with(plan.deb_urls, plan.deb_sha256)
+    apt_update.assert_called_once_with(fatal=True)
+    apt_install.assert_called_once_with(
+        ["cuda-drivers", "docker-ce=5:18.09.1~3-0~ubuntu-bionic", "aufs-tools"],
+        options=["--option=Dpkg::Options::=--force-confold"],
+        fatal=True,
+    )
+    apt_hold.assert_called_once_with(["docker-ce"])
+
+
+@patch("charms.layer.docker_apt.check_call")
+@patch("charms.layer.docker_apt.artifact_cache")
+def test_install_debs_verifies_sha256(artifact_cache, check_call):
+    plan = nvidia_plan()
+    plan.add_deb_url("https://example.com/other.deb")
+    artifact_cache.return_value.fetch.side_effect = (
+        lambda url, sha256: "/blobs/" + url[-9:]
+    )
+    _install_debs(plan.deb_urls, plan.deb_sha256)
+    assert artifact_cache.return_value.fetch.call_args_list == [
+        call("https://developer.download.nvidia.com/cuda-repo.deb", sha256="ab" * 32),
+        call("https://example.com/other.deb", sha256=None),
+    ]
+    check_call.assert_called_once_with(
+        ["dpkg", "-i", "/blobs/-repo.deb", "/blobs/other.deb"]
+    )
+
+
+@patch("charms.layer.docker_apt.installed_packages")
+@patch("charms.layer.docker_apt.apt_install")
+@patch("charms.layer.docker_apt.apt_update")
+def test_download_and_downgrade(apt_update, apt_install, installed):
+    plan = AptPlan()
+    plan.update()
+    plan.download(["docker.io"])
+    assert plan.dump() == [
+        "apt-get update",
+        "apt-get install --download-only docker.io",
+    ]
+    plan.execute()
+    assert apt_install.call_args == call(
+        ["docker.io"],
+        options=[
+            "--option=Dpkg::Options::=--force-confold",
+            "--download-only",
+            "--allow-change-held-packages",
+        ],
+        fatal=True,
+    )
+
+    plan = AptPlan()
+    plan.install(["docker.io=20.10.7-0ubuntu1"])
+    plan.allow_downgrades()
+    plan.execute()
+    assert apt_install.call_args == call(
+        ["docker.io=20.10.7-0ubuntu1"],
+        options=["--option=Dpkg::Options::=--force-confold", "--allow-downgrades"],
+        fatal=True,
+    )
+
+
+@patch("charms.layer.docker_apt.check_output")
+def test_installable_packages(check_output):
+    check_output.return_value = b"""aufs-tools:
+  Installed: (none)
+  Candidate: 1:4.9+20170918-1ubuntu1
+  Version table:
+     1:4.9+20170918-1ubuntu1 500
+        500 http://archive.ubuntu.com/ubuntu bionic/universe amd64 Packages
+linux-image-extra-5.4.0:
+  Installed: (none)
+  Candidate: (none)
+  Version table:
+"""
+    packages = ["aufs-tools", "linux-image-extra-5.4.0", "git=1:2.17.1"]
+    assert installable_packages(packages) == ["aufs-tools"]
+    assert check_output.call_args == call(
+        ["apt-cache", "policy", "aufs-tools", "linux-image-extra-5.4.0", "git"]
+    )
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import pytest
+from charms.layer.docker_cache import ArtifactCache
+from charms.layer.docker_cache import ArtifactCacheError
+
+DEB = bytes(range(256)) * 64
+
+
+class ArtifactHandler(BaseHTTPRequestHandler):
+    """
+    Serves `files` of its server, honouring Range requests unless the
+    If-Range validator no longer matches.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("Range")))
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        status, start = 200, 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            status = 206
+        data = body[start:]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        if server.etags:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if server.cut:
+            # Drop the connection half way through the transfer.
+            self.wfile.write(data[: len(data) // 2])
+            server.cut = False
+            return
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), ArtifactHandler)
+    httpd.files = {"/cuda-repo.deb": DEB, "/gpgkey": b"key"}
+    httpd.requests = []
+    httpd.cut = False
+    httpd.etags = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_caches(server, tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size=1024 * 1024)
+    url = server.url + "/cuda-repo.deb"
+    digest = hashlib.sha256(DEB).hexdigest()
+
+    path = cache.fetch(url, sha256=digest)
+    assert path == str(tmp_path / "blobs" / "sha256" / digest)
+    with open(path, "rb") as f:
+        assert f.read() == DEB
+    assert cache.fetch(url) == path
+    assert len(server.requests) == 1
+
+    # Serve from the cache only, even for stale entries.
+    offline = ArtifactCache(str(tmp_path), max_size=1024 * 1024, offline=True)
+    assert offline.fetch(url, max_age=0) == path
+    with pytest.raises(ArtifactCacheError):
+        offline.fetch(server.url + "/gpgkey")
+    assert len(server.requests) == 1
+
+    # A corrupted blob is downloaded again.
+    with open(path, "wb") as f:
+        f.write(b"corrupt")
+    assert cache.fetch(url) == path
+    assert len(server.requests) == 2
+
+
+def test_fetch_resumes(server, tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size=1024 * 1024)
+    url = server.url + "/cuda-repo.deb"
+    server.cut = True
+    with pytest.raises(ArtifactCacheError):
+        cache.fetch(url)
+
+    path = cache.fetch(url, sha256=hashlib.sha256(DEB).hexdigest())
+    with open(path, "rb") as f:
+        assert f.read() == DEB
+    assert server.requests[-1] == ("/cuda-repo.deb", "bytes=8192-")
+
+
+def test_fetch_restarts_changed_download(server, tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size=1024 * 1024)
+    url = server.url + "/cuda-repo.deb"
+    server.cut = True
+    with pytest.raises(ArtifactCacheError):
+        cache.fetch(url)
+
+    # Resuming would append the new version to the start of the old one.
+    server.files["/cuda-repo.deb"] = DEB[::-1]
+    path = cache.fetch(url)
+    with open(path, "rb") as f:
+        assert f.read() == DEB[::-1]
+    assert server.requests[-1] == ("/cuda-repo.deb", "bytes=8192-")
+    assert not list((tmp_path / "partial").iterdir())
+
+
+def test_fetch_without_validator_starts_over(server, tmp_path):
+    server.etags = False
+    cache = ArtifactCache(str(tmp_path), max_size=1024 * 1024)
+    url = server.url + "/cuda-repo.deb"
+    server.cut = True
+    with pytest.raises(ArtifactCacheError):
+        cache.fetch(url)
+
+    path = cache.fetch(url)
+    with open(path, "rb") as f:
+        assert f.read() == DEB
+    assert server.requests[-1] == ("/cuda-repo.deb", None)
+
+
+def test_fetch_serves_stale_copy_when_refresh_fails(server, tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size=1024 * 1024)
+    url = server.url + "/gpgkey"
+    path = cache.fetch(url)
+
+    # The key is older than max_age, but the server can not be reached.
+    del server.files["/gpgkey"]
+    assert cache.fetch(url, max_age=0) == path
+    assert len(server.requests) == 2
+
+    server.files["/gpgkey"] = b"new key"
+    with open(cache.fetch(url, max_age=0), "rb") as f:
+        assert f.read() == b"new key"
+
+
+def test_fetch_verifies_sha256(server, tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_size=1024 * 1024)
+    with pytest.raises(ArtifactCacheError):
+        cache.fetch(server.url + "/gpgkey", sha256="0" * 64)
+    assert not (tmp_path / "blobs").exists()
+
+
+def test_fetch_evicts_least_recently_used(server, tmp_path):
+    server.files["/other.deb"] = DEB[::-1]
+    cache = ArtifactCache(str(tmp_path), max_size=len(DEB) + 10)
+    first = cache.fetch(server.url + "/cuda-repo.deb")
+    key = cache.fetch(server.url + "/gpgkey")
+    cache.fetch(server.url + "/gpgkey")
+    other = cache.fetch(server.url + "/other.deb")
+
+    with open(tmp_path / "index.json") as f:
+        assert sorted(json.load(f)) == [
+            server.url + "/gpgkey",
+            server.url + "/other.deb",
+        ]
+    assert not (tmp_path / "blobs" / "sha256" / first.split("/")[-1]).exists()
+    assert (tmp_path / "blobs" / "sha256" / key.split("/")[-1]).exists()
+    assert (tmp_path / "blobs" / "sha256" / other.split("/")[-1]).exists()
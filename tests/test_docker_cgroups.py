@@ -0,0 +1,127 @@
+import pytest
+from charms.layer import docker_cgroups
+
+PROC_CGROUPS = """\
+#subsys_name\thierarchy\tnum_cgroups\tenabled
+cpuset\t2\t1\t1
+cpu\t3\t80\t1
+memory\t{memory}\t1\t{enabled}
+pids\t4\t90\t1
+"""
+
+
+def _tree(
+    root,
+    hierarchy,
+    memory=True,
+    swap=True,
+    cmdline="BOOT_IMAGE=/vmlinuz ro quiet",
+    init="systemd",
+):
+    """Build the /proc and /sys files the cgroup detection reads."""
+    proc = root / "proc"
+    (proc / "1").mkdir(parents=True)
+    (proc / "1" / "comm").write_text(init + "\n")
+    (proc / "cmdline").write_text(cmdline + "\n")
+    (proc / "cgroups").write_text(
+        PROC_CGROUPS.format(memory=5 if memory else 0, enabled=int(memory))
+    )
+
+    cgroup = root / "sys" / "fs" / "cgroup"
+    cgroup.mkdir(parents=True)
+    if hierarchy == "unified":
+        controllers = "cpuset cpu io pids" + (" memory" if memory else "")
+        (cgroup / "cgroup.controllers").write_text(controllers + "\n")
+        (cgroup / "system.slice").mkdir()
+        if swap:
+            (cgroup / "system.slice" / "memory.swap.max").write_text("max\n")
+        return root
+
+    if hierarchy == "hybrid":
+        (cgroup / "unified").mkdir()
+        (cgroup / "unified" / "cgroup.controllers").write_text("\n")
+    if memory:
+        (cgroup / "memory").mkdir()
+        (cgroup / "memory" / "memory.limit_in_bytes").write_text("0\n")
+        if swap:
+            (cgroup / "memory" / "memory.memsw.limit_in_bytes").write_text("0\n")
+    return root
+
+
+@pytest.mark.parametrize("hierarchy", ["v1", "hybrid", "unified"])
+def test_cgroup_hierarchy(tmp_path, hierarchy):
+    root = str(_tree(tmp_path, hierarchy))
+    assert docker_cgroups.cgroup_hierarchy(root) == hierarchy
+    assert "memory" in docker_cgroups.controllers(hierarchy, root)
+    assert docker_cgroups.swap_accounting(hierarchy, root)
+
+
+@pytest.mark.parametrize("hierarchy", ["v1", "unified"])
+def test_controllers_memory_disabled(tmp_path, hierarchy):
+    root = str(_tree(tmp_path, hierarchy, memory=False))
+    assert "memory" not in docker_cgroups.controllers(hierarchy, root)
+    assert "cpu" in docker_cgroups.controllers(hierarchy, root)
+
+
+def test_init_system(tmp_path):
+    assert docker_cgroups.init_system(str(_tree(tmp_path, "v1"))) == "systemd"
+    assert docker_cgroups.init_system(str(tmp_path / "missing")) == ""
+
+
+def test_cgroup_driver():
+    assert docker_cgroups.cgroup_driver("auto", "unified", "systemd") == "systemd"
+    assert docker_cgroups.cgroup_driver("auto", "hybrid", "systemd") == "cgroupfs"
+    assert docker_cgroups.cgroup_driver("auto", "unified", "init") == "cgroupfs"
+    assert docker_cgroups.cgroup_driver("systemd", "v1", "systemd") == "systemd"
+    assert docker_cgroups.cgroup_driver("cgroupfs", "unified", "systemd") == (
+        "cgroupfs"
+    )
+    with pytest.raises(ValueError):
+        docker_cgroups.cgroup_driver("systemd", "unified", "init")
+    with pytest.raises(ValueError):
+        docker_cgroups.cgroup_driver("lxc", "unified", "systemd")
+
+
+@pytest.mark.parametrize("hierarchy", ["v1", "hybrid", "unified"])
+def test_required_cmdline_none(tmp_path, hierarchy):
+    # Accounting the kernel provides already never needs a reboot.
+    assert docker_cgroups.required_cmdline(str(_tree(tmp_path, hierarchy))) == []
+
+
+@pytest.mark.parametrize("hierarchy", ["v1", "unified"])
+def test_required_cmdline_swap(tmp_path, hierarchy):
+    root = str(_tree(tmp_path, hierarchy, swap=False))
+    assert docker_cgroups.required_cmdline(root) == ["swapaccount=1"]
+
+
+def test_required_cmdline_memory(tmp_path):
+    root = str(_tree(tmp_path, "v1", memory=False, cmdline="ro cgroup_disable=memory"))
+    assert docker_cgroups.required_cmdline(root) == [
+        "cgroup_enable=memory",
+        "swapaccount=1",
+    ]
+
+
+def test_required_cmdline_present(tmp_path):
+    # The kernel ignores swapaccount=1 when built without swap accounting,
+    # rebooting again would not help.
+    root = str(_tree(tmp_path, "v1", swap=False, cmdline="ro swapaccount=1"))
+    assert docker_cgroups.required_cmdline(root) == []
+
+
+def test_write_grub_cmdline(tmp_path, monkeypatch):
+    calls = []
+    dropin = tmp_path / "grub.d" / "60-charm-docker-cgroups.cfg"
+    monkeypatch.setattr(docker_cgroups, "GRUB_DROPIN", str(dropin))
+    monkeypatch.setattr(docker_cgroups, "check_call", calls.append)
+
+    assert docker_cgroups.write_grub_cmdline(["cgroup_enable=memory", "swapaccount=1"])
+    assert dropin.read_text().splitlines()[1] == (
+        'GRUB_CMDLINE_LINUX="$GRUB_CMDLINE_LINUX cgroup_enable=memory swapaccount=1"'
+    )
+    assert calls == [["update-grub"]]
+
+    assert not docker_cgroups.write_grub_cmdline(
+        ["cgroup_enable=memory", "swapaccount=1"]
+    )
+    assert calls == [["update-grub"]]
@@ -0,0 +1,78 @@
+import gzip
+import json
+import struct
+
+from charms.layer.docker_debug import collect_container_logs
+
+
+def frame(stream, payload):
+    return struct.pack(">BxxxL", stream, len(payload)) + payload
+
+
+def test_collect_container_logs(engine, socket_path, tmp_path):
+    engine.routes.update(
+        {
+            ("GET", "/containers/json"): (
+                200,
+                [
+                    {"Id": "aaa", "Names": ["/web"]},
+                    {"Id": "bbb", "Names": ["/shell"]},
+                    {"Id": "ccc", "Names": ["/gone"]},
+                ],
+            ),
+            ("GET", "/containers/aaa/json"): (200, {"Config": {"Tty": False}}),
+            ("GET", "/containers/aaa/logs"): (
+                200,
+                frame(1, b"out line\n") + frame(2, b"err line\n"),
+            ),
+            ("GET", "/containers/bbb/json"): (200, {"Config": {"Tty": True}}),
+            ("GET", "/containers/bbb/logs"): (200, b"$ ls\r\n"),
+        }
+    )
+
+    records = collect_container_logs(
+        str(tmp_path), tail=100, since=3600, socket_path=socket_path
+    )
+
+    assert [(r["name"], r["bytes"], r["truncated"]) for r in records] == [
+        ("web", 18, False),
+        ("shell", 6, False),
+        ("gone", 0, False),
+    ]
+    assert "404" in records[2]["error"]
+    with gzip.open(tmp_path / "web.log.gz") as f:
+        assert f.read() == b"out line\nerr line\n"
+    with gzip.open(tmp_path / "shell.log.gz") as f:
+        assert f.read() == b"$ ls\r\n"
+    with open(tmp_path / "timings.json") as f:
+        assert json.load(f) == records
+
+    logs = [
+        path for _, path in engine.requests if path.startswith("/containers/aaa/logs")
+    ]
+    assert "tail=100" in logs[0] and "since=" in logs[0]
+
+
+def test_collect_container_logs_budget(engine, socket_path, tmp_path):
+    containers = [{"Id": f"c{i}", "Names": [f"/c{i}"]} for i in range(4)]
+    engine.routes[("GET", "/containers/json")] = (200, containers)
+    for c in containers:
+        engine.routes[("GET", "/containers/{}/json".format(c["Id"]))] = (200, {})
+        engine.routes[("GET", "/containers/{}/logs".format(c["Id"]))] = (
+            200,
+            frame(1, b"x" * 1000),
+        )
+
+    records = collect_container_logs(
+        str(tmp_path), max_bytes=2500, socket_path=socket_path
+    )
+
+    assert sum(r["bytes"] for r in records) == 2500
+    assert sum(r["truncated"] for r in records) == 2
+
+
+def test_collect_container_logs_engine_down(socket_path, tmp_path):
+    output_dir = tmp_path / "container-logs"
+    assert collect_container_logs(str(output_dir), socket_path=socket_path) == []
+    with open(output_dir / "error") as f:
+        assert f.read().startswith("Listing the containers failed: ")
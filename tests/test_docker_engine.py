@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+from charms.layer import docker_engine
+from conftest import FakeEngine
+
+
+def test_request(engine, socket_path):
+    engine.routes[("GET", "/containers/json")] = (200, [{"Id": "abc"}])
+    result = docker_engine.request(
+        "GET",
+        "/containers/json",
+        params={"all": "1", "filters": {"status": ["exited"]}},
+        socket_path=socket_path,
+    )
+    assert result == [{"Id": "abc"}]
+    assert engine.requests[-1] == (
+        "GET",
+        "/containers/json?all=1&filters=%7B%22status%22%3A+%5B%22exited%22%5D%7D",
+    )
+
+    with pytest.raises(docker_engine.EngineError) as e:
+        docker_engine.request("GET", "/nope", socket_path=socket_path)
+    assert e.value.status == 404
+
+
+def test_ping(engine, socket_path):
+    assert docker_engine.ping(socket_path) is True
+    engine.routes[("GET", "/_ping")] = (500, b"down")
+    assert docker_engine.ping(socket_path) is False
+    assert docker_engine.ping(socket_path + ".missing") is False
+
+
+def test_wait_for_engine_backs_off_until_engine_starts(socket_path):
+    servers = []
+
+    def start():
+        server = FakeEngine(socket_path)
+        servers.append(server)
+        server.serve_forever()
+
+    timer = threading.Timer(0.3, start)
+    timer.start()
+    try:
+        elapsed = docker_engine.wait_for_engine(
+            deadline=5, socket_path=socket_path, initial=0.05, maximum=0.2
+        )
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        timer.join(1)
+    assert elapsed is not None
+    assert 0.3 <= elapsed < 2
+
+
+def test_wait_for_engine_deadline(socket_path):
+    start = time.monotonic()
+    assert docker_engine.wait_for_engine(deadline=0.3, socket_path=socket_path) is None
+    assert time.monotonic() - start < 1
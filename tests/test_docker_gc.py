@@ -0,0 +1,140 @@
+import json
+import time
+from unittest.mock import patch
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from charms.layer.docker_gc import is_protected
+from charms.layer.docker_gc import list_removable_containers
+from charms.layer.docker_gc import remove_containers
+from charms.layer.docker_gc import run_image_gc
+
+NOW = int(time.time())
+CONTAINERS = [
+    {"Id": "a1", "Names": ["/build-1"], "Created": NOW - 7200, "SizeRw": 100},
+    {"Id": "b2", "Names": ["/build-2"], "Created": NOW - 60, "SizeRw": 200},
+    {"Id": "c3", "Names": ["/web"], "Created": NOW - 7200, "SizeRw": 300},
+]
+
+
+def test_list_removable_containers(engine, socket_path):
+    engine.routes[("GET", "/containers/json")] = (200, CONTAINERS)
+
+    found = list_removable_containers(socket_path=socket_path)
+    assert [c["Id"] for c in found] == ["a1", "b2", "c3"]
+    query = parse_qs(urlparse(engine.requests[-1][1]).query)
+    assert json.loads(query["filters"][0]) == {"status": ["exited", "dead"]}
+    assert query["size"] == ["1"]
+
+    found = list_removable_containers(
+        min_age=3600,
+        labels=["ci=true"],
+        name_pattern="build-*",
+        socket_path=socket_path,
+    )
+    assert [c["Id"] for c in found] == ["a1"]
+    query = parse_qs(urlparse(engine.requests[-1][1]).query)
+    assert json.loads(query["filters"][0])["label"] == ["ci=true"]
+
+
+def test_remove_containers(engine, socket_path):
+    engine.routes[("DELETE", "/containers/a1")] = (204, b"")
+    engine.routes[("DELETE", "/containers/c3")] = (204, b"")
+
+    result = remove_containers(CONTAINERS, workers=2, socket_path=socket_path)
+    assert result["removed"] == ["build-1", "web"]
+    assert list(result["failed"]) == ["build-2"]
+    assert result["bytes"] == 400
+    assert result["seconds"] >= 0
+
+
+def test_remove_containers_dry_run(engine, socket_path):
+    result = remove_containers(CONTAINERS, dry_run=True, socket_path=socket_path)
+    assert result["removed"] == ["build-1", "build-2", "web"]
+    assert result["bytes"] == 600
+    assert engine.requests == []
+
+
+GIB = 1024**3
+IMAGES = [
+    {
+        "Id": "sha256:old",
+        "RepoTags": ["old:1", "mirror/old:1"],
+        "Created": 1,
+        "Size": 5 * GIB,
+    },
+    {"Id": "sha256:new", "RepoTags": ["new:1"], "Created": 3, "Size": 5 * GIB},
+    {"Id": "sha256:mid", "RepoTags": ["<none>:<none>"], "Created": 2, "Size": 5 * GIB},
+    {"Id": "sha256:pause", "RepoTags": ["pause:3.1"], "Created": 0, "Size": GIB},
+    {"Id": "sha256:web", "RepoTags": ["web:1"], "Created": 0, "Size": GIB},
+]
+
+
+def test_is_protected():
+    assert is_protected(IMAGES[3], ["pause:*"])
+    assert is_protected(IMAGES[1], ["new:2", "old:*"]) is False
+    assert is_protected(IMAGES[2], ["mid"])
+
+
+def image_gc_engine(engine):
+    engine.routes[("GET", "/info")] = (200, {"DockerRootDir": "/srv/docker"})
+    engine.routes[("GET", "/images/json")] = (200, IMAGES)
+    engine.routes[("GET", "/containers/json")] = (200, [{"ImageID": "sha256:web"}])
+    for reference in ["old:1", "mirror/old:1", "sha256:mid", "new:1"]:
+        engine.routes[("DELETE", "/images/" + reference)] = (200, [])
+
+
+def test_run_image_gc(engine, socket_path, tmp_path):
+    image_gc_engine(engine)
+    state = str(tmp_path / "state.json")
+
+    # Under the high watermark nothing is removed, but usage is recorded.
+    with patch("charms.layer.docker_gc.disk_usage") as disk_usage:
+        disk_usage.return_value = (80 * GIB, 100 * GIB)
+        result = run_image_gc(
+            high=85, low=70, state_path=state, socket_path=socket_path
+        )
+    disk_usage.assert_called_with("/srv/docker")
+    assert result["removed"] == []
+    assert result["usage-before"] == 80
+    with open(state) as f:
+        assert list(json.load(f)["last-used"]) == ["sha256:web"]
+
+    # Over it, the oldest unused and unprotected images go first, until
+    # enough was removed to get under the low watermark.
+    engine.requests.clear()
+    with patch("charms.layer.docker_gc.disk_usage") as disk_usage:
+        disk_usage.side_effect = [(90 * GIB, 100 * GIB), (80 * GIB, 100 * GIB)]
+        result = run_image_gc(
+            high=85,
+            low=82,
+            protected=["pause:*"],
+            state_path=state,
+            socket_path=socket_path,
+        )
+    assert result["removed"] == ["old:1", "sha256:mid"]
+    assert result["bytes"] == 10 * GIB
+    assert result["usage-after"] == 80
+    deletes = [path for method, path in engine.requests if method == "DELETE"]
+    assert deletes == ["/images/old:1", "/images/mirror/old:1", "/images/sha256:mid"]
+    with open(state) as f:
+        assert json.load(f)["last-run"]["bytes"] == 10 * GIB
+
+
+def test_run_image_gc_least_recently_used(engine, socket_path, tmp_path):
+    image_gc_engine(engine)
+    state = tmp_path / "state.json"
+    # old:1 was in use more recently than the others were created.
+    state.write_text(json.dumps({"last-used": {"sha256:old": 10}}))
+
+    with patch("charms.layer.docker_gc.disk_usage") as disk_usage:
+        disk_usage.return_value = (50 * GIB, 100 * GIB)
+        result = run_image_gc(
+            low=46,
+            protected=["pause:*"],
+            force=True,
+            state_path=str(state),
+            socket_path=socket_path,
+        )
+    assert result["removed"] == ["sha256:mid"]
+    assert result["failed"] == {}
@@ -0,0 +1,280 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+from charms.layer import docker_images
+
+DIGEST = "sha256:" + "d" * 64
+
+
+def _progress(*updates):
+    return b"".join(json.dumps(u).encode("utf-8") + b"\r\n" for u in updates)
+
+
+PULL = _progress(
+    {"status": "Pulling from library/nginx", "id": "1.25"},
+    {"status": "Already exists", "id": "aaa"},
+    {"status": "Pulling fs layer", "id": "bbb"},
+    {"status": "Pulling fs layer", "id": "ccc"},
+    {"status": "Downloading", "progressDetail": {"current": 10, "total": 100}},
+    {
+        "status": "Downloading",
+        "progressDetail": {"current": 50, "total": 100},
+        "id": "bbb",
+    },
+    {
+        "status": "Downloading",
+        "progressDetail": {"current": 20, "total": 300},
+        "id": "ccc",
+    },
+    {"status": "Pull complete", "id": "bbb"},
+    {"status": "Pull complete", "id": "ccc"},
+    {"status": "Digest: " + DIGEST},
+    {"status": "Status: Downloaded newer image for nginx:1.25"},
+)
+
+
+def test_max_concurrent_downloads(tmp_path):
+    daemon_json = tmp_path / "daemon.json"
+    assert docker_images.max_concurrent_downloads(str(daemon_json)) == 3
+    daemon_json.write_text(json.dumps({"max-concurrent-downloads": 8}))
+    assert docker_images.max_concurrent_downloads(str(daemon_json)) == 8
+
+
+def test_image_present(engine, socket_path):
+    assert not docker_images.image_present("nginx:1.25", socket_path)
+
+    engine.routes[("GET", "/images/nginx:1.25/json")] = (
+        200,
+        {"RepoDigests": ["nginx@" + DIGEST]},
+    )
+    engine.routes[("GET", "/distribution/nginx:1.25/json")] = (
+        200,
+        {"Descriptor": {"digest": DIGEST}},
+    )
+    assert docker_images.image_present("nginx:1.25", socket_path)
+
+    # The tag moved on in the registry.
+    engine.routes[("GET", "/distribution/nginx:1.25/json")] = (
+        200,
+        {"Descriptor": {"digest": "sha256:" + "e" * 64}},
+    )
+    assert not docker_images.image_present("nginx:1.25", socket_path)
+
+    # The registry does not answer, keep what is there.
+    del engine.routes[("GET", "/distribution/nginx:1.25/json")]
+    assert docker_images.image_present("nginx:1.25", socket_path)
+
+
+def test_image_present_digest(engine, socket_path):
+    reference = "nginx@" + DIGEST
+    engine.routes[("GET", f"/images/{reference}/json")] = (200, {})
+    assert docker_images.image_present(reference, socket_path)
+    assert ("GET", f"/distribution/{reference}/json") not in engine.requests
+
+
+def test_pull_image(engine, socket_path):
+    engine.routes[("POST", "/images/create")] = (200, PULL)
+    result = docker_images.pull_image("nginx:1.25", socket_path)
+    assert result["bytes"] == 400
+    assert result["layers"] == 3
+    assert result["cached"] == 1
+    assert result["seconds"] >= 0
+    assert ("POST", "/images/create?fromImage=nginx&tag=1.25") in engine.requests
+
+
+@pytest.mark.parametrize(
+    "reference, query",
+    [
+        ("nginx", "fromImage=nginx&tag=latest"),
+        ("localhost:5000/app", "fromImage=localhost%3A5000%2Fapp&tag=latest"),
+        ("nginx@sha256:" + "a" * 64, "fromImage=nginx%40sha256%3A" + "a" * 64),
+    ],
+)
+def test_pull_image_single_tag(engine, socket_path, reference, query):
+    # Without a tag, the engine would pull every tag of the repository.
+    engine.routes[("POST", "/images/create")] = (200, PULL)
+    docker_images.pull_image(reference, socket_path)
+    assert engine.requests[-1] == ("POST", "/images/create?" + query)
+
+
+def test_prefetch_images(engine, socket_path):
+    engine.routes[("GET", "/images/redis:7/json")] = (200, {"RepoDigests": []})
+    engine.routes[("POST", "/images/create")] = (200, PULL)
+
+    results = docker_images.prefetch_images(
+        ["nginx:1.25", "redis:7", "nginx:1.25"], workers=2, socket_path=socket_path
+    )
+    assert list(results) == ["nginx:1.25", "redis:7"]
+    assert results["nginx:1.25"]["hit"] is False
+    assert results["nginx:1.25"]["bytes"] == 400
+    assert results["redis:7"] == {
+        "hit": True,
+        "bytes": 0,
+        "seconds": results["redis:7"]["seconds"],
+    }
+    pulls = [r for r in engine.requests if r[1].startswith("/images/create")]
+    assert len(pulls) == 1
+
+
+def test_prefetch_images_failure(engine, socket_path):
+    engine.routes[("POST", "/images/create")] = (
+        200,
+        _progress({"error": "manifest unknown"}),
+    )
+    results = docker_images.prefetch_images(["nope:1"], socket_path=socket_path)
+    assert "manifest unknown" in results["nope:1"]["error"]
+
+
+def _tiny_image(tag):
+    """:return: bytes `docker save` archive of a one layer image"""
+    layer = io.BytesIO()
+    with tarfile.open(fileobj=layer, mode="w") as tar:
+        data = b"hello\n"
+        info = tarfile.TarInfo("hello.txt")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    layer = layer.getvalue()
+    config = json.dumps(
+        {
+            "architecture": "amd64",
+            "os": "linux",
+            "rootfs": {
+                "type": "layers",
+                "diff_ids": ["sha256:" + hashlib.sha256(layer).hexdigest()],
+            },
+        }
+    ).encode("utf-8")
+    config_name = hashlib.sha256(config).hexdigest() + ".json"
+    manifest = json.dumps(
+        [{"Config": config_name, "RepoTags": [tag], "Layers": ["layer/layer.tar"]}]
+    ).encode("utf-8")
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for name, data in [
+            ("layer/layer.tar", layer),
+            (config_name, config),
+            ("manifest.json", manifest),
+        ]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return archive.getvalue()
+
+
+needs_zstd = pytest.mark.skipif(not shutil.which("zstd"), reason="needs zstd")
+IMAGE_ID = "sha256:" + "1" * 64
+
+
+@needs_zstd
+def test_save_image_cache(engine, socket_path, tmp_path):
+    tiny = _tiny_image("tiny:1")
+    engine.routes[("GET", "/images/tiny:1/json")] = (200, {"Id": IMAGE_ID})
+    engine.routes[("GET", "/images/tiny:latest/json")] = (200, {"Id": IMAGE_ID})
+    engine.routes[("GET", f"/images/{IMAGE_ID}/get")] = (200, tiny)
+
+    cache = str(tmp_path / "cache")
+    results = docker_images.save_image_cache(
+        ["tiny:1", "tiny:latest"], cache, socket_path
+    )
+    assert results["tiny:1"]["hit"] is False
+    # Both tags point at the same image, it is saved once.
+    assert results["tiny:latest"]["hit"] is True
+    assert results["tiny:latest"]["bytes"] == results["tiny:1"]["bytes"]
+    saves = [r for r in engine.requests if r[1].endswith("/get")]
+    assert len(saves) == 1
+
+    archive = os.path.join(cache, "1" * 64 + ".tar.zst")
+    assert subprocess.check_output(["zstd", "-dc", archive]) == tiny
+    with open(os.path.join(cache, "index.json")) as f:
+        assert json.load(f) == {"tiny:1": IMAGE_ID, "tiny:latest": IMAGE_ID}
+    assert sorted(os.listdir(cache)) == ["1" * 64 + ".tar.zst", "index.json"]
+
+
+@needs_zstd
+def test_load_image_cache(engine, socket_path, tmp_path):
+    tiny = _tiny_image("tiny:1")
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    (cache / ("1" * 64 + ".tar.zst")).write_bytes(
+        subprocess.run(
+            ["zstd", "-c"], input=tiny, stdout=subprocess.PIPE, check=True
+        ).stdout
+    )
+    present = "sha256:" + "2" * 64
+    (cache / "index.json").write_text(
+        json.dumps(
+            {
+                "tiny:1": IMAGE_ID,
+                "localhost:5000/tiny": IMAGE_ID,
+                "other:2": present,
+                "gone:3": "sha256:" + "3" * 64,
+            }
+        )
+    )
+    engine.routes[("GET", f"/images/{present}/json")] = (200, {})
+    engine.routes[("POST", "/images/load")] = (
+        200,
+        json.dumps({"stream": "Loaded image: tiny:1\n"}).encode("utf-8"),
+    )
+    for image_id in (IMAGE_ID, present):
+        engine.routes[("POST", f"/images/{image_id}/tag")] = (201, b"")
+
+    result = docker_images.load_image_cache(str(cache), socket_path)
+    assert result["loaded"] == [IMAGE_ID]
+    assert result["hits"] == 1
+    assert result["missing"] == ["gone:3"]
+    # The archive reached the engine decompressed, without a copy on disk.
+    assert engine.bodies[("POST", "/images/load?quiet=1")] == tiny
+    assert sorted(os.listdir(cache)) == ["1" * 64 + ".tar.zst", "index.json"]
+    tags = sorted(path for _, path in engine.requests if "/tag?" in path)
+    assert tags == [
+        f"/images/{IMAGE_ID}/tag?repo=localhost%3A5000%2Ftiny&tag=latest",
+        f"/images/{IMAGE_ID}/tag?repo=tiny&tag=1",
+        f"/images/{present}/tag?repo=other&tag=2",
+    ]
+
+
+@needs_zstd
+def test_image_archive(engine, socket_path, tmp_path):
+    tiny = _tiny_image("tiny:1")
+    engine.routes[("GET", "/images/get")] = (200, tiny)
+    engine.routes[("POST", "/images/load")] = (
+        200,
+        json.dumps({"stream": "Loaded image: tiny:1\n"}).encode("utf-8"),
+    )
+    archive = str(tmp_path / "image-cache.tar.zst")
+
+    assert docker_images.save_image_archive(["tiny:1", "tiny:2"], archive, socket_path)
+    assert ("GET", "/images/get?names=tiny%3A1&names=tiny%3A2") in engine.requests
+
+    result = docker_images.load_image_cache(archive, socket_path)
+    assert result["loaded"] == ["tiny:1"]
+    assert engine.bodies[("POST", "/images/load?quiet=1")] == tiny
+
+
+@needs_zstd
+def test_load_image_archive_error(engine, socket_path, tmp_path):
+    archive = tmp_path / "broken.tar.zst"
+    archive.write_bytes(
+        subprocess.run(
+            ["zstd", "-c"], input=b"x", stdout=subprocess.PIPE, check=True
+        ).stdout
+    )
+    engine.routes[("POST", "/images/load")] = (
+        200,
+        json.dumps({"error": "unexpected EOF"}).encode("utf-8"),
+    )
+    with pytest.raises(docker_images.ImageCacheError, match="unexpected EOF"):
+        docker_images.load_image_archive(str(archive), socket_path)
+
+
+def test_load_image_cache_missing(tmp_path):
+    with pytest.raises(docker_images.ImageCacheError):
+        docker_images.load_image_cache(str(tmp_path / "nope"))
@@ -0,0 +1,53 @@
+import pytest
+from charms.layer.docker_logging import MIB
+from charms.layer.docker_logging import filesystem_size
+from charms.layer.docker_logging import log_policy
+from charms.layer.docker_logging import parse_budget
+
+GIB = 1024 * MIB
+
+
+def test_parse_budget():
+    assert parse_budget("10%", 200 * GIB) == 20 * GIB
+    assert parse_budget("20G", 0) == 20 * GIB
+    assert parse_budget("512M", 0) == 512 * MIB
+    assert parse_budget("1.5GiB", 0) == int(1.5 * GIB)
+    assert parse_budget(" 2g ", 0) == 2 * GIB
+    with pytest.raises(ValueError):
+        parse_budget("lots", 0)
+
+
+def test_filesystem_size(tmp_path):
+    assert filesystem_size(str(tmp_path / "not" / "yet")) == filesystem_size(
+        str(tmp_path)
+    )
+    assert filesystem_size(str(tmp_path)) > 0
+
+
+def test_log_policy():
+    # 10% of 200G across 100 containers: 5 files of 40m each.
+    policy = log_policy("local", 20 * GIB, 100)
+    assert policy == {
+        "log-driver": "local",
+        "log-opts": {"max-size": "40m", "max-file": "5"},
+    }
+
+
+def test_log_policy_dense():
+    # 1G across 200 containers leaves 5m each.
+    policy = log_policy("json-file", GIB, 200)
+    assert policy["log-opts"] == {"max-size": "1m", "max-file": "5"}
+
+    # With less, fewer files are kept rather than rotating tiny ones.
+    policy = log_policy("json-file", GIB, 400)
+    assert policy["log-opts"] == {"max-size": "1m", "max-file": "2"}
+
+
+def test_log_policy_large_budget():
+    policy = log_policy("local", 1024 * GIB, 10)
+    assert policy["log-opts"] == {"max-size": "100m", "max-file": "5"}
+
+
+def test_log_policy_invalid_driver():
+    with pytest.raises(ValueError):
+        log_policy("syslog", GIB, 10)
@@ -0,0 +1,141 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import pytest
+from charms.layer import docker_engine
+from charms.layer import docker_mirror
+
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    """A registry:2 pull-through cache stand-in, serving its API root and
+    the debug server's counters."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/v2/":
+            status, body = self.server.status, b"{}"
+        elif self.path == "/debug/vars":
+            status, body = 200, json.dumps(self.server.vars).encode("utf-8")
+        else:
+            status, body = 404, b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def registry():
+    server = HTTPServer(("127.0.0.1", 0), FakeRegistryHandler)
+    server.status = 200
+    server.vars = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_mirror_spec():
+    spec = docker_mirror.mirror_spec(port=5050, upstream="https://quay.io")
+    assert "REGISTRY_PROXY_REMOTEURL=https://quay.io" in spec["Env"]
+    ports = spec["HostConfig"]["PortBindings"]
+    assert ports["5000/tcp"] == [{"HostPort": "5050"}]
+    assert ports["5001/tcp"][0]["HostIp"] == "127.0.0.1"
+
+    # The label tells a container created from another spec apart.
+    label = docker_mirror._CONFIG_LABEL
+    same = docker_mirror.mirror_spec(port=5050, upstream="https://quay.io")
+    other = docker_mirror.mirror_spec(port=5000, upstream="https://quay.io")
+    assert spec["Labels"][label] == same["Labels"][label]
+    assert spec["Labels"][label] != other["Labels"][label]
+
+
+def test_ensure_mirror_creates(engine, socket_path):
+    engine.routes[("GET", "/images/registry:2/json")] = (200, {"Id": "sha256:r"})
+    engine.routes[("POST", "/containers/create")] = (201, {"Id": "c"})
+    engine.routes[("POST", "/containers/registry-mirror/start")] = (204, b"")
+
+    spec = docker_mirror.mirror_spec()
+    assert docker_mirror.ensure_mirror(spec, socket_path) is True
+    assert engine.bodies[("POST", "/containers/create?name=registry-mirror")] == spec
+    assert ("POST", "/containers/registry-mirror/start") in engine.requests
+
+
+def test_ensure_mirror_pull_fails(engine, socket_path):
+    engine.routes[("POST", "/images/create")] = (200, {"error": "no route to host"})
+
+    with pytest.raises(docker_engine.EngineError, match="no route to host"):
+        docker_mirror.ensure_mirror(docker_mirror.mirror_spec(), socket_path)
+    assert not any(path.startswith("/containers/create") for _, path in engine.requests)
+
+
+def test_ensure_mirror_current(engine, socket_path):
+    spec = docker_mirror.mirror_spec()
+    engine.routes[("GET", "/containers/registry-mirror/json")] = (
+        200,
+        {"Config": {"Labels": spec["Labels"]}, "State": {"Running": True}},
+    )
+    assert docker_mirror.ensure_mirror(spec, socket_path) is False
+    assert engine.requests == [("GET", "/containers/registry-mirror/json")]
+
+
+def test_ensure_mirror_replaces(engine, socket_path):
+    engine.routes[("GET", "/containers/registry-mirror/json")] = (
+        200,
+        {"Config": {"Labels": {}}, "State": {"Running": True}},
+    )
+    engine.routes[("DELETE", "/containers/registry-mirror")] = (204, b"")
+    engine.routes[("GET", "/images/registry:2/json")] = (200, {"Id": "sha256:r"})
+    engine.routes[("POST", "/containers/create")] = (201, {"Id": "c"})
+    engine.routes[("POST", "/containers/registry-mirror/start")] = (204, b"")
+
+    assert docker_mirror.ensure_mirror(docker_mirror.mirror_spec(), socket_path)
+    assert ("DELETE", "/containers/registry-mirror?force=1") in engine.requests
+
+
+def test_remove_mirror(engine, socket_path):
+    assert docker_mirror.remove_mirror(socket_path) is False
+    engine.routes[("DELETE", "/containers/registry-mirror")] = (204, b"")
+    assert docker_mirror.remove_mirror(socket_path) is True
+
+
+def test_mirror_healthy(registry):
+    assert docker_mirror.mirror_healthy(registry.url)
+    registry.status = 401
+    assert docker_mirror.mirror_healthy(registry.url)
+    registry.status = 503
+    assert not docker_mirror.mirror_healthy(registry.url)
+
+
+def test_mirror_healthy_down(registry):
+    url = registry.url
+    registry.shutdown()
+    registry.server_close()
+    assert not docker_mirror.mirror_healthy(url, timeout=0.5)
+
+
+def test_mirror_stats(registry):
+    registry.vars = {
+        "registry": {
+            "proxy": {
+                "blobs": {
+                    "Requests": 10,
+                    "Hits": 7,
+                    "Misses": 3,
+                    "BytesPulled": 1024,
+                    "BytesPushed": 4096,
+                },
+                "manifests": {"Requests": 4, "Hits": 4},
+            }
+        }
+    }
+    assert docker_mirror.mirror_stats(registry.url) == {
+        "blobs": {"requests": 10, "hits": 7, "misses": 3, "bytes-pulled": 1024},
+        "manifests": {"requests": 4, "hits": 4, "misses": 0, "bytes-pulled": 0},
+    }
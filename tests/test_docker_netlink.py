@@ -0,0 +1,67 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+from charms.layer import docker_netlink
+from charms.layer.docker_netlink import get_link
+from charms.layer.docker_netlink import remove_bridge
+
+LIB = os.path.dirname(os.path.dirname(os.path.dirname(docker_netlink.__file__)))
+
+NAMESPACE_SCRIPT = """
+import subprocess
+import sys
+
+sys.path.insert(0, {lib!r})
+from charms.layer.docker_netlink import NetlinkError
+from charms.layer.docker_netlink import get_link
+from charms.layer.docker_netlink import remove_bridge
+
+assert get_link("docker0") is None
+assert remove_bridge("docker0") is False
+
+subprocess.check_call(["ip", "link", "add", "docker0", "type", "bridge"])
+subprocess.check_call(["ip", "link", "set", "docker0", "up"])
+link = get_link("docker0")
+assert link["kind"] == "bridge" and link["up"], link
+
+assert remove_bridge("docker0") is True
+assert get_link("docker0") is None
+assert remove_bridge("docker0") is False
+
+try:
+    remove_bridge("lo")
+except NetlinkError as e:
+    assert "not a bridge" in str(e)
+else:
+    raise AssertionError("removed lo")
+"""
+
+
+def test_attrs_round_trip():
+    data = docker_netlink._attr(3, b"docker0\0") + docker_netlink._attr(1, b"xy")
+    assert docker_netlink._parse_attrs(data) == {3: b"docker0\0", 1: b"xy"}
+    assert len(data) % 4 == 0
+
+
+def test_get_link():
+    assert get_link("lo")["index"] >= 1
+    assert get_link("nosuchlink0") is None
+
+
+@pytest.mark.skipif(
+    os.geteuid() != 0 or not shutil.which("unshare") or not shutil.which("ip"),
+    reason="needs root, unshare and ip",
+)
+def test_remove_bridge_in_network_namespace():
+    if subprocess.call(["unshare", "--net", "true"]):
+        pytest.skip("network namespaces are not available")
+    subprocess.check_call(
+        ["unshare", "--net", sys.executable, "-c", NAMESPACE_SCRIPT.format(lib=LIB)]
+    )
+
+
+def test_remove_missing_bridge():
+    assert remove_bridge("nosuchbridge0") is False
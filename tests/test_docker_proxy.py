@@ -0,0 +1,87 @@
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+from charms.layer.docker_proxy import NO_PROXY_MAX_LEN
+from charms.layer.docker_proxy import format_no_proxy
+from charms.layer.docker_proxy import parse_no_proxy
+from charms.layer.docker_proxy import proxy_settings
+
+
+def test_parse_no_proxy_merges_networks():
+    names, networks = parse_no_proxy(
+        "10.0.0.0/24, 10.0.0.5,10.0.1.0/24,10.0.0.0/16,fd00::/64,fd00::1"
+    )
+    assert names == []
+    assert [str(net) for net in networks] == ["10.0.0.0/16", "fd00::/64"]
+
+
+def test_parse_no_proxy_dedupes_names():
+    names, networks = parse_no_proxy(
+        "Example.com,api.example.com,.example.com,*.svc.local,a.svc.local,"
+        ".other.org,host.other.org,localhost,localhost,,host:8080"
+    )
+    assert names == [
+        "example.com",
+        ".svc.local",
+        ".other.org",
+        "localhost",
+        "host:8080",
+    ]
+    assert networks == []
+
+
+def test_parse_no_proxy_wildcard():
+    assert parse_no_proxy("10.0.0.0/8,*,example.com") == (["*"], [])
+
+
+def test_format_no_proxy_expands_within_budget():
+    assert format_no_proxy("localhost,192.168.0.0/30") == (
+        "localhost,192.168.0.1,192.168.0.2"
+    )
+    assert format_no_proxy("192.168.0.0/30", budget=10) == "192.168.0.0/30"
+    assert format_no_proxy("10.1.2.3/32") == "10.1.2.3"
+
+
+def test_format_no_proxy_respects_budget():
+    value = ",".join(f"10.{i}.0.0/30" for i in range(0, 256, 2))
+    result = format_no_proxy(value)
+    assert len(result) <= NO_PROXY_MAX_LEN
+    assert result.startswith("10.0.0.1,10.0.0.2,")
+    assert result.endswith("10.254.0.0/30")
+
+
+@pytest.mark.parametrize("prefix", [32, 24, 16, 12, 8])
+def test_format_no_proxy_benchmark(prefix):
+    """Memory and time must not grow with the size of the network."""
+    value = f"localhost,10.0.0.0/{prefix}"
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = format_no_proxy(value)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(result) <= NO_PROXY_MAX_LEN
+    assert peak < 256 * 1024
+    assert elapsed < 0.5
+
+
+@patch("charmhelpers.core.hookenv.env_proxy_settings")
+@patch("charmhelpers.core.hookenv.config")
+def test_proxy_settings(config, env_proxy_settings):
+    config.return_value = {"http_proxy": "", "https_proxy": "http://c", "no_proxy": ""}
+    env_proxy_settings.return_value = {
+        "http_proxy": "http://m",
+        "https_proxy": "http://m",
+        "NO_PROXY": "10.0.0.0/8,10.1.0.0/16",
+    }
+    assert proxy_settings() == {
+        "http_proxy": "http://m",
+        "https_proxy": "http://c",
+        "no_proxy": "10.0.0.0/8",
+    }
+
+    env_proxy_settings.return_value = None
+    assert proxy_settings()["no_proxy"] == ""
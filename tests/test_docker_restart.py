@@ -0,0 +1,40 @@
+from charms.layer.docker_restart import live_restore_conflicts
+from charms.layer.docker_restart import restart_daemon
+
+
+def test_live_restore_conflicts(engine, socket_path):
+    engine.routes[("GET", "/info")] = (200, {"Swarm": {"LocalNodeState": "inactive"}})
+    assert live_restore_conflicts(socket_path) == []
+
+    engine.routes[("GET", "/info")] = (200, {"Swarm": {"LocalNodeState": "active"}})
+    assert live_restore_conflicts(socket_path) == ["the node is in swarm mode (active)"]
+
+
+def test_live_restore_conflicts_engine_down(socket_path):
+    assert live_restore_conflicts(socket_path) == []
+
+
+def test_restart_daemon(engine, socket_path):
+    engine.routes[("GET", "/containers/json")] = (
+        200,
+        [{"Id": "a" * 64}, {"Id": "b" * 64}],
+    )
+
+    def restart():
+        engine.routes[("GET", "/containers/json")] = (200, [{"Id": "a" * 64}])
+
+    report = restart_daemon(restart, deadline=5, socket_path=socket_path)
+    assert report["before"] == 2
+    assert report["after"] == 1
+    assert report["lost"] == ["b" * 64]
+    assert report["seconds"] >= 0
+
+
+def test_restart_daemon_no_answer(engine, socket_path):
+    engine.routes[("GET", "/containers/json")] = (200, [{"Id": "a" * 64}])
+
+    def restart():
+        del engine.routes[("GET", "/_ping")]
+
+    report = restart_daemon(restart, deadline=0.2, socket_path=socket_path)
+    assert report == {"before": 1, "after": 0, "lost": ["a" * 64], "seconds": None}
@@ -0,0 +1,143 @@
+from unittest.mock import patch
+
+import pytest
+from charms.layer.docker_rolling import RollingRestart
+from charms.layer.docker_rolling import next_grants
+from charms.layer.docker_rolling import parse_max_unavailable
+
+
+class FakeModel:
+    """
+    Stands in for the hook tools of a docker application, sharing relation
+    and leader data between its units. `current` is the unit running a hook.
+    """
+
+    def __init__(self, count, leader="docker/0"):
+        self.units = [f"docker/{i}" for i in range(count)]
+        self.leader = leader
+        self.current = leader
+        self.data = {unit: {} for unit in self.units}
+        self.leader_data = {}
+
+    def local_unit(self):
+        return self.current
+
+    def relation_ids(self, name):
+        return ["docker-peers:0"] if len(self.units) > 1 else []
+
+    def related_units(self, rid):
+        return [u for u in self.units if u != self.current]
+
+    def relation_get(self, unit=None, rid=None):
+        return dict(self.data[unit])
+
+    def relation_set(self, rid, settings):
+        self.data[self.current].update(settings)
+
+    def is_leader(self):
+        return self.current == self.leader
+
+    def leader_get(self, key):
+        return self.leader_data.get(key)
+
+    def leader_set(self, settings):
+        assert self.is_leader()
+        self.leader_data.update(settings)
+
+    def log(self, message, level=None):
+        pass
+
+
+def roll(model, max_unavailable, healthy=lambda unit: True, rounds=20):
+    """
+    Have every unit request a restart in the same hook, then run the hooks
+    each step triggers until no unit is granted the lock anymore.
+
+    :return: Tuple of the units in the order they restarted, and the most
+      units that were restarting at once
+    """
+
+    def lock(unit):
+        model.current = unit
+        return RollingRestart(max_unavailable)
+
+    restarting = {u for u in model.units if lock(u).acquire()}
+    order, most = [], 0
+    for _ in range(rounds):
+        if not restarting:
+            break
+        most = max(most, len(restarting))
+        for unit in sorted(restarting):
+            lock(unit).release(healthy(unit))
+            order.append(unit)
+            # relation-changed on the leader
+            lock(model.leader).update_grants()
+        # leader-settings-changed on the units still waiting
+        restarting = {u for u in model.units if u not in order and lock(u).acquire()}
+    return order, most
+
+
+@pytest.mark.parametrize(
+    "value, units, expected",
+    [("1", 5, 1), ("2", 5, 2), ("40%", 5, 2), ("10%", 5, 1), ("0", 3, 1)],
+)
+def test_parse_max_unavailable(value, units, expected):
+    assert parse_max_unavailable(value, units) == expected
+
+
+def test_parse_max_unavailable_invalid():
+    with pytest.raises(ValueError):
+        parse_max_unavailable("half", 3)
+
+
+def test_next_grants():
+    units = ["a", "b", "c"]
+    requests = {"a": "1.0", "b": "2.0", "c": "3.0"}
+    assert next_grants(units, requests, {}, {}, {}, 1) == {"a": "1.0"}
+    assert next_grants(units, requests, {}, {}, {"a": "1.0"}, 1) == {"a": "1.0"}
+
+    done = {"a": "1.0"}
+    assert next_grants(units, requests, done, {"a": True}, {"a": "1.0"}, 1) == {
+        "b": "2.0"
+    }
+    # Unhealthy units keep the lock, and get it again for their next try.
+    assert next_grants(units, requests, done, {"a": False}, {"a": "1.0"}, 1) == {
+        "a": "1.0"
+    }
+    requests["a"] = "4.0"
+    assert next_grants(units, requests, done, {"a": False}, {"a": "1.0"}, 1) == {
+        "a": "4.0"
+    }
+    # Departed units release the lock.
+    assert next_grants(["b", "c"], requests, {}, {}, {"a": "1.0"}, 1) == {"b": "2.0"}
+
+
+@pytest.mark.parametrize("max_unavailable, most", [("1", 1), ("2", 2), ("40%", 2)])
+def test_rolling_restart(max_unavailable, most):
+    model = FakeModel(5)
+    with patch("charms.layer.docker_rolling.hookenv", model):
+        order, concurrent = roll(model, max_unavailable)
+    assert sorted(order) == model.units
+    assert concurrent == most
+
+
+def test_rolling_restart_stops_at_unhealthy_unit():
+    model = FakeModel(4)
+    with patch("charms.layer.docker_rolling.hookenv", model):
+        order, _ = roll(model, "1", healthy=lambda unit: unit != order_head(model))
+    assert len(order) == 1
+
+
+def order_head(model):
+    # The first unit granted the lock, the one that comes back unhealthy.
+    return min(model.data, key=lambda u: float(model.data[u]["restart-request"]))
+
+
+def test_single_unit_does_not_wait():
+    model = FakeModel(1)
+    with patch("charms.layer.docker_rolling.hookenv", model):
+        lock = RollingRestart()
+        assert lock.acquire()
+        lock.release(True)
+    assert model.data["docker/0"] == {}
+    assert model.leader_data == {}
@@ -0,0 +1,158 @@
+import os
+import shutil
+import stat
+import subprocess
+from unittest.mock import patch
+
+import pytest
+from charms.layer.docker_storage import StorageDriverError
+from charms.layer.docker_storage import backing_filesystem
+from charms.layer.docker_storage import detect_storage_driver
+from charms.layer.docker_storage import migrate_data_root
+from charms.layer.docker_storage import storage_driver_packages
+from charms.layer.docker_storage import validate_backing_filesystem
+
+MOUNTINFO = """\
+22 1 252:1 / / rw,relatime shared:1 - ext4 /dev/vda1 rw
+30 22 0:26 / /proc rw,nosuid shared:12 - proc proc rw
+41 22 253:0 / /var/lib/docker rw,relatime shared:20 - xfs /dev/mapper/vg-docker rw
+42 22 0:40 / /srv/my\\040data rw shared:21 - btrfs /dev/vdb rw
+"""
+
+
+@pytest.fixture
+def mountinfo(tmp_path):
+    path = tmp_path / "mountinfo"
+    path.write_text(MOUNTINFO)
+    return str(path)
+
+
+def test_detect_storage_driver(tmp_path):
+    (tmp_path / "proc").mkdir()
+    filesystems = tmp_path / "proc" / "filesystems"
+
+    filesystems.write_text("nodev\tsysfs\n\text4\nnodev\toverlay\n")
+    assert detect_storage_driver("5.4.0-42-generic", str(tmp_path)) == "overlay2"
+
+    # The overlay module is loaded on demand.
+    filesystems.write_text("nodev\tsysfs\n\text4\n")
+    (tmp_path / "lib/modules/5.4.0-42-generic/kernel/fs/overlayfs").mkdir(parents=True)
+    assert detect_storage_driver("5.4.0-42-generic", str(tmp_path)) == "overlay2"
+
+    filesystems.write_text("nodev\tsysfs\n\text4\nnodev\taufs\n")
+    assert detect_storage_driver("4.4.0-21-generic", str(tmp_path)) == "aufs"
+
+    filesystems.write_text("nodev\tsysfs\n\text4\n")
+    with pytest.raises(StorageDriverError):
+        detect_storage_driver("4.4.0-21-generic", str(tmp_path))
+
+
+def test_storage_driver_packages():
+    assert storage_driver_packages("overlay2", "5.4.0-42-generic") == []
+    assert storage_driver_packages("aufs", "4.4.0-21-generic") == [
+        "aufs-tools",
+        "linux-image-extra-4.4.0-21-generic",
+    ]
+    with pytest.raises(StorageDriverError):
+        storage_driver_packages("overlay", "5.4.0-42-generic")
+
+
+def test_backing_filesystem(mountinfo):
+    assert backing_filesystem("/var/lib/docker/overlay2", mountinfo) == (
+        "xfs",
+        "/var/lib/docker",
+        "/dev/mapper/vg-docker",
+    )
+    assert backing_filesystem("/var/lib/dockerd", mountinfo)[0] == "ext4"
+    assert backing_filesystem("/srv/my data/docker", mountinfo)[1] == "/srv/my data"
+
+
+@patch("charms.layer.docker_storage.check_output")
+def test_validate_backing_filesystem(check_output, mountinfo):
+    check_output.return_value = (
+        b"naming   =version 2  bsize=4096  ascii-ci=0, ftype=1\n"
+    )
+    assert validate_backing_filesystem("overlay2", mountinfo=mountinfo) == "xfs"
+    check_output.assert_called_once_with(["xfs_info", "/var/lib/docker"])
+
+    check_output.return_value = (
+        b"naming   =version 2  bsize=4096  ascii-ci=0, ftype=0\n"
+    )
+    with pytest.raises(StorageDriverError, match="d_type"):
+        validate_backing_filesystem("overlay2", mountinfo=mountinfo)
+
+    with pytest.raises(StorageDriverError, match="needs btrfs"):
+        validate_backing_filesystem("btrfs", mountinfo=mountinfo)
+    assert (
+        validate_backing_filesystem("btrfs", "/srv/my data/docker", mountinfo)
+        == "btrfs"
+    )
+    assert validate_backing_filesystem("vfs", mountinfo=mountinfo) == "xfs"
+
+
+@pytest.fixture
+def fake_rsync(tmp_path, monkeypatch):
+    """An rsync that prints progress like --info=progress2 and copies with cp."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    rsync = bin_dir / "rsync"
+    rsync.write_text(
+        "#!/bin/sh\n"
+        'for arg; do source="$target"; target="$arg"; done\n'
+        "printf '        512  50%%   1.00MB/s    0:00:01\\r'\n"
+        "printf '      1,024 100%%   1.00MB/s    0:00:01 (xfr#1, to-chk=0/2)\\n'\n"
+        'cp -a "$source." "$target"\n'
+    )
+    rsync.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}:{}".format(bin_dir, os.environ["PATH"]))
+
+
+def test_migrate_data_root_progress(fake_rsync, tmp_path):
+    source = tmp_path / "docker"
+    (source / "image").mkdir(parents=True)
+    (source / "image" / "repositories.json").write_text("{}")
+    target = tmp_path / "srv" / "docker"
+
+    progress = []
+    migrate_data_root(str(source), str(target), progress.append)
+    assert progress == [50, 100]
+    assert (target / "image" / "repositories.json").read_text() == "{}"
+
+    # Nothing to copy on a fresh install.
+    migrate_data_root(str(tmp_path / "missing"), str(target), progress.append)
+    assert progress == [50, 100]
+
+
+@pytest.mark.skipif(
+    os.geteuid() != 0 or not shutil.which("rsync") or not shutil.which("mkfs.ext4"),
+    reason="needs root, rsync and mkfs.ext4",
+)
+def test_migrate_data_root_loop_mount(tmp_path):
+    source = tmp_path / "docker"
+    layer = source / "overlay2" / "l1" / "diff"
+    layer.mkdir(parents=True)
+    (layer / "a").write_text("layer")
+    os.link(str(layer / "a"), str(layer / "b"))
+    # overlay2 whiteouts are 0/0 character devices.
+    os.mknod(str(layer / "gone"), 0o600 | stat.S_IFCHR, os.makedev(0, 0))
+
+    image = tmp_path / "fs.img"
+    mount_point = tmp_path / "mnt"
+    mount_point.mkdir()
+    subprocess.check_call(["truncate", "-s", "64M", str(image)])
+    subprocess.check_call(["mkfs.ext4", "-q", str(image)])
+    if subprocess.call(["mount", "-o", "loop", str(image), str(mount_point)]):
+        pytest.skip("loop devices are not available")
+    try:
+        target = str(mount_point / "docker")
+        assert validate_backing_filesystem("overlay2", target) == "ext4"
+        migrate_data_root(str(source), target)
+        (layer / "c").write_text("late")
+        (layer / "b").unlink()
+        migrate_data_root(str(source), target, delete=True)
+
+        copied = mount_point / "docker" / "overlay2" / "l1" / "diff"
+        assert sorted(os.listdir(str(copied))) == ["a", "c", "gone"]
+        assert stat.S_ISCHR(os.lstat(str(copied / "gone")).st_mode)
+    finally:
+        subprocess.check_call(["umount", str(mount_point)])
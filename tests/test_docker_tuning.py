@@ -0,0 +1,143 @@
+import pytest
+from charms.layer import docker_tuning
+from charms.layer.docker_tuning import GIB
+
+
+@pytest.fixture
+def host(tmp_path):
+    """A /proc and /sys tree of a 16 CPU, 64G host with a 25GbE NIC."""
+    proc = tmp_path / "proc"
+    proc.mkdir()
+    (proc / "cpuinfo").write_text(
+        "".join(f"processor\t: {n}\nmodel name\t: x\n\n" for n in range(16))
+    )
+    (proc / "meminfo").write_text(
+        f"MemTotal:       {64 * 1024 * 1024} kB\nMemFree:         1024 kB\n"
+    )
+    sysctl = proc / "sys" / "net" / "core"
+    sysctl.mkdir(parents=True)
+    (sysctl / "somaxconn").write_text("4096\n")
+
+    net = tmp_path / "sys" / "class" / "net"
+    for name, speed, physical in [
+        ("eno1", "25000", True),
+        ("eno2", None, True),
+        ("docker0", "10000", False),
+    ]:
+        (net / name).mkdir(parents=True)
+        if physical:
+            (net / name / "device").mkdir()
+        if speed:
+            (net / name / "speed").write_text(speed + "\n")
+    return tmp_path
+
+
+def test_host_resources(host):
+    assert docker_tuning.host_resources(str(host)) == {
+        "cpus": 16,
+        "memory": 64 * GIB,
+        "nic-speed": 25000,
+    }
+
+
+def test_tuning_default():
+    assert docker_tuning.tuning("default", 64, 256 * GIB, 25000) == ({}, {})
+
+
+def test_tuning_throughput():
+    daemon, sysctl = docker_tuning.tuning("throughput", 64, 256 * GIB, 25000)
+    assert daemon == {
+        "max-concurrent-downloads": 32,
+        "max-concurrent-uploads": 30,
+        "userland-proxy": False,
+    }
+    assert sysctl["net.core.somaxconn"] == 65535
+    assert sysctl["net.netfilter.nf_conntrack_max"] == 2097152
+
+    # A small host with an unknown NIC speed stays close to the defaults.
+    daemon, _ = docker_tuning.tuning("throughput", 2, 4 * GIB, 0)
+    assert daemon["max-concurrent-downloads"] == 3
+    assert daemon["max-concurrent-uploads"] == 5
+
+
+def test_tuning_dense():
+    daemon, sysctl = docker_tuning.tuning("dense", 16, 64 * GIB, 10000)
+    assert daemon["max-concurrent-downloads"] == 8
+    assert daemon["userland-proxy"] is False
+    assert sysctl == {
+        "net.netfilter.nf_conntrack_max": 2097152,
+        "fs.inotify.max_user_instances": 8192,
+        "fs.inotify.max_user_watches": 4194304,
+        "net.core.somaxconn": 4096,
+    }
+
+
+def test_tuning_invalid():
+    with pytest.raises(ValueError):
+        docker_tuning.tuning("fast", 1, GIB, 0)
+
+
+def test_current_sysctl(host):
+    assert docker_tuning.current_sysctl("net.core.somaxconn", str(host)) == 4096
+    assert docker_tuning.current_sysctl("net.core.missing", str(host)) is None
+
+
+@pytest.fixture
+def sysctl_files(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(docker_tuning, "SYSCTL_CONF", str(tmp_path / "sysctl.conf"))
+    monkeypatch.setattr(docker_tuning, "MODULES_CONF", str(tmp_path / "modules.conf"))
+    monkeypatch.setattr(docker_tuning, "check_call", calls.append)
+    return tmp_path, calls
+
+
+def test_apply_sysctl(sysctl_files):
+    tmp_path, calls = sysctl_files
+    settings = {"net.core.somaxconn": 1024, "net.netfilter.nf_conntrack_max": 262144}
+    baseline = {"net.core.somaxconn": 4096, "net.netfilter.nf_conntrack_max": None}
+
+    # The host's higher somaxconn is kept.
+    effective = docker_tuning.apply_sysctl(settings, baseline)
+    assert effective == {
+        "net.core.somaxconn": 4096,
+        "net.netfilter.nf_conntrack_max": 262144,
+    }
+    assert (tmp_path / "sysctl.conf").read_text().splitlines()[1:] == [
+        "net.core.somaxconn = 4096",
+        "net.netfilter.nf_conntrack_max = 262144",
+    ]
+    assert (tmp_path / "modules.conf").read_text() == "nf_conntrack\n"
+    assert ["sysctl", "-e", "-q", "-p", str(tmp_path / "sysctl.conf")] in calls
+
+    # Unchanged, nothing is applied again.
+    calls.clear()
+    docker_tuning.apply_sysctl(settings, baseline)
+    assert ["sysctl", "-e", "-q", "-p", str(tmp_path / "sysctl.conf")] not in calls
+
+    # Back to the default profile, the host's values are restored.
+    calls.clear()
+    assert docker_tuning.apply_sysctl({}, baseline) == {}
+    assert not (tmp_path / "sysctl.conf").exists()
+    assert not (tmp_path / "modules.conf").exists()
+    assert calls == [["sysctl", "-e", "-q", "-w", "net.core.somaxconn=4096"]]
+
+
+def test_apply_sysctl_restores_dropped_settings(sysctl_files):
+    tmp_path, calls = sysctl_files
+    baseline = {
+        "fs.inotify.max_user_instances": 128,
+        "fs.inotify.max_user_watches": 65536,
+        "net.core.somaxconn": 4096,
+        "net.netfilter.nf_conntrack_max": 65536,
+    }
+    dense = docker_tuning.tuning("dense", 8, 16 * GIB, 1000)[1]
+    throughput = docker_tuning.tuning("throughput", 8, 16 * GIB, 1000)[1]
+    docker_tuning.apply_sysctl(dense, baseline)
+
+    # throughput does not raise max_user_watches, put back the host's value.
+    calls.clear()
+    docker_tuning.apply_sysctl(throughput, baseline)
+    assert "fs.inotify.max_user_watches" not in (tmp_path / "sysctl.conf").read_text()
+    assert [c for c in calls if "-w" in c] == [
+        ["sysctl", "-e", "-q", "-w", "fs.inotify.max_user_watches=65536"]
+    ]
@@ -0,0 +1,108 @@
+from subprocess import CalledProcessError
+from unittest.mock import patch
+
+import pytest
+from charms.layer.docker_upgrade import UpgradeError
+from charms.layer.docker_upgrade import upgrade_docker
+
+
+@pytest.fixture
+def upgrade_env():
+    with patch(
+        "charms.layer.docker_upgrade.upgrade_packages", return_value=["docker.io"]
+    ), patch(
+        "charms.layer.docker_upgrade.installed_versions",
+        return_value={"docker.io": "19.03.8-0ubuntu1"},
+    ), patch(
+        "charms.layer.docker_upgrade.render_configuration_template"
+    ), patch(
+        "charms.layer.docker_upgrade.clear_pending_changes"
+    ), patch(
+        "charms.layer.docker_upgrade.check_call"
+    ), patch(
+        "charms.layer.docker_upgrade.host"
+    ) as host, patch(
+        "charms.layer.docker_upgrade.hookenv"
+    ), patch(
+        "charms.layer.docker_upgrade.AptPlan"
+    ) as plan:
+        yield host, plan.return_value
+
+
+def test_upgrade_docker(upgrade_env, engine, socket_path):
+    host, plan = upgrade_env
+    engine.routes[("GET", "/version")] = (200, {"Version": "20.10.7"})
+    engine.routes[("GET", "/containers/json")] = (200, [{"Id": "a" * 64}])
+
+    result = upgrade_docker(deadline=5, socket_path=socket_path)
+    assert result["packages"] == ["docker.io"]
+    assert result["previous"] == {"docker.io": "19.03.8-0ubuntu1"}
+    assert result["engine-version"] == "20.10.7"
+    assert result["containers"]["before"] == result["containers"]["after"] == 1
+    for phase in ("download", "install", "restart"):
+        assert result[phase] >= 0
+    plan.download.assert_called_once_with(["docker.io"])
+    plan.install.assert_called_once_with(["docker.io"])
+    host.service_restart.assert_called_once_with("docker")
+
+
+def test_upgrade_docker_downloaded(upgrade_env, engine, socket_path):
+    _, plan = upgrade_env
+    engine.routes[("GET", "/version")] = (200, {"Version": "20.10.7"})
+    engine.routes[("GET", "/containers/json")] = (200, [])
+
+    result = upgrade_docker(downloaded=True, deadline=5, socket_path=socket_path)
+    assert result["download"] == 0
+    plan.download.assert_not_called()
+
+
+def test_upgrade_docker_rollback(upgrade_env, engine, socket_path):
+    host, plan = upgrade_env
+    engine.routes[("GET", "/containers/json")] = (200, [])
+    # The new engine answers pings, but not the API.
+
+    with pytest.raises(UpgradeError) as e:
+        upgrade_docker(downloaded=True, deadline=5, socket_path=socket_path)
+    assert "did not answer" in str(e.value)
+    assert e.value.report["engine-version"] is None
+    assert plan.install.call_args_list[-1][0] == (["docker.io=19.03.8-0ubuntu1"],)
+    plan.allow_downgrades.assert_called_once_with()
+    assert host.service_restart.call_count == 2
+
+
+def test_upgrade_docker_install_failure(upgrade_env, engine, socket_path):
+    _, plan = upgrade_env
+    plan.execute.side_effect = [
+        CalledProcessError(100, "apt-get", "dpkg was interrupted"),
+        None,
+    ]
+
+    with pytest.raises(UpgradeError, match="returned non-zero exit status 100"):
+        upgrade_docker(downloaded=True, deadline=5, socket_path=socket_path)
+    assert plan.install.call_args_list[-1][0] == (["docker.io=19.03.8-0ubuntu1"],)
+
+
+def test_upgrade_docker_clears_pending_changes(upgrade_env, engine, socket_path):
+    engine.routes[("GET", "/version")] = (200, {"Version": "20.10.7"})
+    engine.routes[("GET", "/containers/json")] = (200, [])
+
+    with patch("charms.layer.docker_upgrade.clear_pending_changes") as clear:
+        upgrade_docker(downloaded=True, deadline=5, socket_path=socket_path)
+    clear.assert_called_once_with()
+
+
+def test_upgrade_docker_rollback_purges_added_packages(
+    upgrade_env, engine, socket_path
+):
+    host, plan = upgrade_env
+    engine.routes[("GET", "/containers/json")] = (200, [])
+
+    with patch(
+        "charms.layer.docker_upgrade.upgrade_packages",
+        return_value=["docker.io", "docker-buildx"],
+    ), pytest.raises(UpgradeError):
+        upgrade_docker(downloaded=True, deadline=5, socket_path=socket_path)
+    plan.purge.assert_called_once_with(["docker-buildx"])
+    plan.unhold.assert_any_call(["docker-buildx"])
+    assert plan.install.call_args_list[-1][0] == (["docker.io=19.03.8-0ubuntu1"],)
+    assert host.service_restart.call_count == 2
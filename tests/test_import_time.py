@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds the reactive module may take to import, leaving out
+# charmhelpers.core, which every charm loads anyway.
+IMPORT_BUDGET_MS = float(os.environ.get("DOCKER_IMPORT_BUDGET_MS", "75"))
+
+# Only needed by a few handlers, which import them themselves.
+LAZY_MODULES = (
+    "charmhelpers.contrib.charmsupport.nrpe",
+    "charmhelpers.fetch",
+    "charms.docker",
+    "charms.layer.docker_apt",
+    "charms.layer.docker_gc",
+    "charms.layer.docker_images",
+    "charms.layer.docker_mirror",
+    "charms.layer.docker_upgrade",
+    "concurrent.futures",
+    "jinja2",
+    "urllib.request",
+)
+
+# The reactive framework and charms.docker are not installed in the test
+# environment, stand in for them with modules whose every attribute is a
+# decorator leaving the function alone. charms.docker is only made when it
+# is imported, so -X importtime reports it. unittest.mock is not used, it
+# would load asyncio and with it concurrent.futures.
+IMPORT_SCRIPT = """
+import importlib.abc
+import importlib.util
+import sys
+import types
+
+
+class Stub(types.ModuleType):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: lambda f: f
+
+
+class StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, name, path, target=None):
+        if name == "charms.docker":
+            return importlib.util.spec_from_loader(name, self)
+
+    def create_module(self, spec):
+        return Stub(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+
+for name in ("charms.reactive", "charms.reactive.helpers"):
+    sys.modules[name] = Stub(name)
+sys.meta_path.insert(0, StubFinder())
+sys.path[:0] = [{reactive!r}, {lib!r}]
+import docker
+"""
+
+
+def _import_times():
+    """
+    Import the reactive module in a fresh interpreter.
+
+    :return: List of Tuples (String module, Integer depth, Integer
+      cumulative microseconds) in the order -X importtime reports them
+    """
+    script = IMPORT_SCRIPT.format(
+        reactive=os.path.join(ROOT, "reactive"), lib=os.path.join(ROOT, "lib")
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            # The header line.
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), depth, int(cumulative)))
+    return times
+
+
+def _reactive_import_ms(times):
+    """
+    :return: Float milliseconds importing the reactive module took, less
+      the charmhelpers.core modules it imports
+    """
+    # The module is reported after everything it imported.
+    index = max(i for i, (name, depth, _) in enumerate(times) if name == "docker")
+    start = index
+    while start and times[start - 1][1] > 0:
+        start -= 1
+    total = times[index][2]
+    for name, depth, cumulative in times[start:index]:
+        if depth == 1 and name.split(".")[:2] == ["charmhelpers", "core"]:
+            total -= cumulative
+    return total / 1000
+
+
+def test_heavy_modules_load_lazily():
+    imported = {name for name, _, _ in _import_times()}
+    assert "docker" in imported
+    assert sorted(imported.intersection(LAZY_MODULES)) == []
+
+
+def test_import_time_budget():
+    # Take the best of a few runs, the first one may have a cold disk cache.
+    elapsed = min(_reactive_import_ms(_import_times()) for _ in range(3))
+    assert elapsed < IMPORT_BUDGET_MS, (
+        f"Importing reactive/docker.py took {elapsed:.1f}ms, the budget is "
+        f"{IMPORT_BUDGET_MS}ms. Import heavy modules in the handlers needing them."
+    )
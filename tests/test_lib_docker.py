@@ -1,11 +1,22 @@
 import json
+import os
 
 from unittest.mock import mock_open
 from unittest.mock import patch
 
+import pytest
+
 from charms.layer.docker import write_daemon_json
 from charms.layer.docker import set_daemon_json
+from charms.layer import docker
 from charms.layer.docker import delete_daemon_json
+from charms.layer.docker import diff_daemon_json
+from charms.layer.docker import diff_unit
+from charms.layer.docker import parse_unit
+from charms.layer.docker import unit_restart_required
+from charms.layer.docker import parse_duration
+from charms.layer.docker import restart_required
+from charms.layer.docker import write_file
 
 
 @patch("charmhelpers.core.unitdata.kv")
@@ -27,14 +38,38 @@ def test_write_daemon_json(config, kv):
         return charm_config[key]
 
     config.side_effect = mock_config
-    kv.return_value.get.return_value = daemon_opts_additions
+    store = {"daemon-opts-additions": daemon_opts_additions}
+    kv.return_value.get.side_effect = lambda key, default=None: store.get(key, default)
 
-    with patch("builtins.open", mock_open(), create=True):
+    with patch("builtins.open", mock_open(), create=True), patch(
+        "charms.layer.docker.write_file"
+    ):
         daemon_opts_additions.update(daemon_opts)
         result = write_daemon_json()
         assert result == daemon_opts_additions
 
 
+@patch("charmhelpers.core.unitdata.kv")
+@patch("charmhelpers.core.hookenv.config")
+def test_write_daemon_json_keeps_data_root_being_moved(config, kv):
+    config.return_value = json.dumps({"data-root": "/srv/docker"})
+    store = {
+        "daemon-opts-additions": {"data-root": "/var/lib/docker"},
+        "docker.data-root-migration": {
+            "source": "/var/lib/docker",
+            "target": "/srv/docker",
+        },
+    }
+    kv.return_value.get.side_effect = lambda key, default=None: store.get(key, default)
+
+    with patch("builtins.open", mock_open(), create=True), patch(
+        "charms.layer.docker.write_file"
+    ):
+        assert write_daemon_json() == {"data-root": "/var/lib/docker"}
+        del store["docker.data-root-migration"]
+        assert write_daemon_json() == {"data-root": "/srv/docker"}
+
+
 @patch("charmhelpers.core.hookenv.config")
 def test_set_daemon_json(config):
     daemon_opts = {
@@ -52,7 +87,9 @@ def test_set_daemon_json(config):
     # Test that charm can't override a config value
     assert set_daemon_json("log-driver", "new value") is False
 
-    with patch("builtins.open", mock_open(), create=True):
+    with patch("builtins.open", mock_open(), create=True), patch(
+        "charms.layer.docker.write_file"
+    ):
         result = set_daemon_json("log-driver", "json-file")
         assert result["log-driver"] == "json-file"
         result = set_daemon_json("my-extra-config", "value")
@@ -71,3 +108,210 @@ def test_delete_daemon_json(kv):
         kv.return_value.get.return_value = daemon_opts_additions
         assert delete_daemon_json("foo") is True
         kv().set.assert_called_once_with("daemon-opts-additions", {})
+
+
+def test_diff_daemon_json():
+    old = {"debug": False, "log-driver": "json-file", "labels": ["a"]}
+    new = {"debug": True, "log-driver": "json-file", "registry-mirrors": ["m"]}
+    changed = diff_daemon_json(old, new)
+    assert changed == {"debug", "labels", "registry-mirrors"}
+    assert restart_required(changed) is False
+
+    changed = diff_daemon_json(new, {"debug": True, "log-driver": "local"})
+    assert changed == {"log-driver", "registry-mirrors"}
+    assert restart_required(changed) is True
+
+
+@patch("charmhelpers.core.unitdata.kv")
+@patch("charmhelpers.core.hookenv.config")
+def test_write_daemon_json_records_changes(config, kv):
+    config.return_value = json.dumps({"debug": True, "log-driver": "json-file"})
+    store = {"daemon-opts-additions": {}, "daemon-json-pending": ["labels"]}
+    kv.return_value.get.side_effect = lambda key, default=None: store.get(key)
+
+    previous = json.dumps({"debug": False, "log-driver": "json-file"})
+    with patch("builtins.open", mock_open(read_data=previous), create=True), patch(
+        "charms.layer.docker.write_file"
+    ):
+        write_daemon_json()
+    kv().set.assert_called_once_with("daemon-json-pending", ["debug", "labels"])
+
+    kv.reset_mock()
+    current = json.dumps({"debug": True, "log-driver": "json-file"})
+    with patch("builtins.open", mock_open(read_data=current), create=True), patch(
+        "charms.layer.docker.write_file"
+    ):
+        write_daemon_json()
+    kv().set.assert_not_called()
+
+
+def test_diff_unit():
+    old = parse_unit(
+        "[Service]\n"
+        "# a comment\n"
+        "TasksMax=infinity\n"
+        "ExecStart=\n"
+        "ExecStart=/usr/bin/dockerd -H fd://\n"
+    )
+    assert old == {
+        "Service.TasksMax": ["infinity"],
+        "Service.ExecStart": ["/usr/bin/dockerd -H fd://"],
+    }
+
+    new = parse_unit(
+        "[Service]\n"
+        "TasksMax=4096\n"
+        "ExecStart=\n"
+        "ExecStart=/usr/bin/dockerd -H fd://\n"
+    )
+    changed = diff_unit(old, new)
+    assert changed == {"Service.TasksMax"}
+    assert unit_restart_required(changed) is False
+
+    changed = diff_unit(new, parse_unit("[Service]\nTasksMax=4096\n"))
+    assert changed == {"Service.ExecStart"}
+    assert unit_restart_required(changed) is True
+
+
+@pytest.fixture
+def dropins(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHARM_DIR", os.path.dirname(os.path.dirname(__file__)))
+    paths = {
+        template: str(tmp_path / os.path.basename(path))
+        for template, path in docker.DOCKER_DROPINS.items()
+    }
+    monkeypatch.setattr(docker, "DOCKER_DROPINS", paths)
+    monkeypatch.setattr(docker, "DOCKER_PROXY_ENV", paths["docker-proxy.env"])
+    return paths
+
+
+def test_render_dropins(dropins):
+    units = docker._render_dropins({"http_proxy": "", "https_proxy": ""})
+    assert units[dropins["docker-proxy.conf"]] is None
+    assert units[dropins["docker-proxy.env"]] is None
+    exec_start = parse_unit(units[dropins["docker-exec.conf"]])["Service.ExecStart"]
+    assert exec_start == ["/usr/bin/dockerd -H fd:// $DOCKER_OPTS"]
+
+    # A NO_PROXY longer than a unit file line goes in the environment file.
+    no_proxy = ",".join(f"10.0.{n}.0/24" for n in range(200))
+    units = docker._render_dropins(
+        {"http_proxy": "http://squid:3128", "https_proxy": "", "no_proxy": no_proxy}
+    )
+    env = units[dropins["docker-proxy.env"]].splitlines()
+    assert f"NO_PROXY={no_proxy}" in env
+    proxy = parse_unit(units[dropins["docker-proxy.conf"]])
+    assert proxy == {"Service.EnvironmentFile": [dropins["docker-proxy.env"]]}
+
+
+def test_dropins_clear_replaced_unit_proxies(dropins):
+    from charmhelpers.core.templating import render
+
+    # The unit the replace mode rendered stays in place after switching.
+    proxies = {
+        "http_proxy": "http://squid:3128",
+        "https_proxy": "http://squid:3128",
+        "no_proxy": "10.0.0.0/8",
+    }
+    replaced = render("docker.systemd", None, proxies)
+
+    def effective(units):
+        # The unit followed by its drop-ins, as systemd reads them.
+        files = [
+            content
+            for path, content in sorted(units.items())
+            if content and path != dropins["docker-proxy.env"]
+        ]
+        return parse_unit("\n".join([replaced] + files))
+
+    unit = effective(docker._render_dropins(proxies))
+    assert unit["Service.Environment"] == []
+    assert dropins["docker-proxy.env"] in unit["Service.EnvironmentFile"]
+
+    # Clearing the proxy config leaves no proxy in effect.
+    unit = effective(docker._render_dropins({"http_proxy": "", "https_proxy": ""}))
+    assert unit["Service.Environment"] == []
+    assert dropins["docker-proxy.env"] not in unit["Service.EnvironmentFile"]
+
+
+def test_write_unit_file(dropins):
+    path = dropins["docker-limits.conf"]
+    assert docker._write_unit_file(path, "[Service]\nTasksMax=infinity\n") == (
+        True,
+        {"Service.TasksMax"},
+    )
+    assert docker._write_unit_file(path, "[Service]\nTasksMax=infinity\n") == (
+        False,
+        set(),
+    )
+    # Comments are not properties.
+    assert docker._write_unit_file(path, "# new\n[Service]\nTasksMax=infinity\n") == (
+        True,
+        set(),
+    )
+    assert docker._write_unit_file(path, None) == (True, {"Service.TasksMax"})
+    assert not os.path.exists(path)
+
+    env = dropins["docker-proxy.env"]
+    assert docker._write_unit_file(env, "HTTP_PROXY=http://squid:3128\n") == (
+        True,
+        {"Service.Environment"},
+    )
+    assert os.stat(env).st_mode & 0o777 == 0o600
+
+
+def test_write_file(tmp_path):
+    path = tmp_path / "etc" / "docker.service"
+    assert write_file(str(path), "[Service]\n") is True
+    assert path.read_text() == "[Service]\n"
+    assert path.stat().st_mode & 0o777 == 0o444
+
+    mtime = path.stat().st_mtime_ns
+    assert write_file(str(path), b"[Service]\n") is False
+    assert path.stat().st_mtime_ns == mtime
+
+    assert write_file(str(path), "[Unit]\n", perms=0o644) is True
+    assert path.read_text() == "[Unit]\n"
+    assert sorted(p.name for p in path.parent.iterdir()) == ["docker.service"]
+
+
+@patch("charms.layer.docker._boot_id")
+@patch("charms.layer.docker.check_output")
+@patch("charmhelpers.core.unitdata.kv")
+def test_host_fact(kv, check_output, boot_id):
+    store = {}
+    kv.return_value.get.side_effect = lambda key, default=None: store.get(key, default)
+    kv.return_value.set.side_effect = store.__setitem__
+    check_output.return_value = b"amd64\n"
+    boot_id.return_value = "boot-1"
+
+    with patch.dict(docker._host_facts, clear=True), patch.dict(
+        docker._host_fact_stats, {"spawned": 0, "saved": 0}
+    ), patch("charmhelpers.core.hookenv.atexit"):
+        assert docker.arch() == "amd64"
+        assert docker.arch() == "amd64"
+        check_output.assert_called_once_with(["dpkg", "--print-architecture"])
+        assert docker.host_fact_stats() == {"spawned": 1, "saved": 1}
+
+        # A later hook reuses the stored fact until the machine reboots.
+        docker._host_facts.clear()
+        assert docker.host_fact("arch") == "amd64"
+        assert check_output.call_count == 1
+        boot_id.return_value = "boot-2"
+        docker._host_facts.clear()
+        assert docker.host_fact("arch") == "amd64"
+        assert check_output.call_count == 2
+
+        docker.invalidate_host_facts("arch")
+        check_output.return_value = b"arm64\n"
+        assert docker.arch() == "arm64"
+        assert docker.host_fact_stats() == {"spawned": 3, "saved": 2}
+
+
+def test_parse_duration():
+    assert parse_duration("") is None
+    assert parse_duration("90s") == 90
+    assert parse_duration("30m") == 1800
+    assert parse_duration("24h") == 86400
+    assert parse_duration("7d") == 604800
+    with pytest.raises(ValueError):
+        parse_duration("1 week")
@@ -0,0 +1,390 @@
+import json
+from unittest.mock import MagicMock
+from unittest.mock import call
+
+import pytest
+
+
+@pytest.fixture
+def daemon(reactive, monkeypatch):
+    """
+    Mock out what the recycle queue acts on. `files`, `keys` and
+    `properties` hold the pending changes the render leaves behind.
+    """
+    mocks = MagicMock()
+    mocks.files, mocks.keys, mocks.properties = [], [], []
+    mocks.restart_daemon.return_value = {
+        "seconds": 1.0,
+        "before": 2,
+        "after": 2,
+        "lost": [],
+    }
+    mocks.RollingRestart.return_value.acquire.return_value = True
+    mocks.service_reload.return_value = True
+    monkeypatch.setattr(reactive.hookenv, "atexit", mocks.atexit)
+    monkeypatch.setattr(reactive.hookenv, "log", mocks.log)
+    monkeypatch.setattr(reactive.host, "service_reload", mocks.service_reload)
+    monkeypatch.setattr(reactive.docker, "clear_pending_changes", mocks.clear)
+    monkeypatch.setattr(
+        reactive.docker, "pending_file_changes", lambda: list(mocks.files)
+    )
+    monkeypatch.setattr(
+        reactive.docker, "pending_daemon_json_changes", lambda: list(mocks.keys)
+    )
+    monkeypatch.setattr(
+        reactive.docker, "pending_unit_changes", lambda: list(mocks.properties)
+    )
+    for name in (
+        "config",
+        "status_set",
+        "validate_config",
+        "render_configuration_template",
+        "reload_system_daemons",
+        "RollingRestart",
+        "restart_daemon",
+        "_probe_runtime_availability",
+    ):
+        monkeypatch.setattr(reactive, name, getattr(mocks, name))
+    return mocks
+
+
+def _flush(daemon):
+    """Run what the hook queued to run at exit."""
+    for args, _ in daemon.atexit.call_args_list:
+        args[0]()
+
+
+def test_recycle_requests_restart_once(reactive, daemon):
+    daemon.keys = ["storage-driver", "debug"]
+    reactive.recycle_daemon("storage driver changed")
+    reactive.recycle_daemon("proxy changed", restart=False)
+    reactive.recycle_daemon("storage driver changed", restart=False)
+    daemon.atexit.assert_called_once_with(reactive._flush_recycle_daemon)
+    daemon.restart_daemon.assert_not_called()
+
+    _flush(daemon)
+    daemon.render_configuration_template.assert_called_once_with(service=True)
+    daemon.restart_daemon.assert_called_once()
+    daemon.service_reload.assert_not_called()
+    daemon.RollingRestart.return_value.release.assert_called_once_with(healthy=True)
+    daemon.clear.assert_called_once_with()
+    assert reactive._recycle_requests == {}
+
+
+def test_recycle_reloads_reloadable_changes(reactive, daemon):
+    daemon.keys = ["debug", "labels"]
+    reactive.recycle_daemon("debug changed", restart=False)
+    reactive.recycle_daemon("labels changed", restart=False)
+    _flush(daemon)
+    daemon.service_reload.assert_called_once_with("docker")
+    daemon.restart_daemon.assert_not_called()
+    daemon.RollingRestart.assert_not_called()
+    daemon.clear.assert_called_once_with()
+
+
+def test_recycle_restarts_when_reload_fails(reactive, daemon):
+    daemon.keys = ["debug"]
+    daemon.service_reload.return_value = False
+    reactive.recycle_daemon("debug changed", restart=False)
+    _flush(daemon)
+    daemon.restart_daemon.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "files, keys, properties",
+    [
+        (["/etc/default/docker"], [], []),
+        ([], ["debug", "storage-driver"], []),
+        ([], [], ["Service.LimitNOFILE"]),
+    ],
+)
+def test_recycle_restarts_for_other_changes(reactive, daemon, files, keys, properties):
+    daemon.files, daemon.keys, daemon.properties = files, keys, properties
+    reactive.recycle_daemon("configuration changed", restart=False)
+    _flush(daemon)
+    daemon.restart_daemon.assert_called_once()
+    daemon.service_reload.assert_not_called()
+
+
+def test_recycle_leaves_unchanged_daemon_alone(reactive, daemon):
+    reactive.recycle_daemon("proxy changed", restart=False)
+    reactive.recycle_daemon("registry mirrors changed", restart=False)
+    _flush(daemon)
+    daemon.render_configuration_template.assert_called_once_with(service=True)
+    daemon.restart_daemon.assert_not_called()
+    daemon.service_reload.assert_not_called()
+    daemon.reload_system_daemons.assert_not_called()
+    daemon.clear.assert_not_called()
+
+
+def test_recycle_waits_for_rolling_restart_lock(reactive, daemon):
+    daemon.RollingRestart.return_value.acquire.return_value = False
+    reactive.recycle_daemon("storage driver changed")
+    _flush(daemon)
+    daemon.restart_daemon.assert_not_called()
+    daemon.clear.assert_not_called()
+    assert "docker.restart.queued" in reactive.flags
+
+
+@pytest.fixture
+def storage(reactive, monkeypatch, engine, socket_path, tmp_path):
+    """
+    Run the storage driver handler on an installed unit whose engine, the
+    fake one, runs with aufs.
+    """
+    mocks = MagicMock()
+    mocks.config = {"daemon-opts": "{}", "storage-driver": "auto"}
+    mocks.set_daemon_json.return_value = True
+    engine.routes[("GET", "/info")] = (200, {"Driver": "aufs"})
+    reactive.flags.add("docker.ready")
+    request = reactive.docker_engine.request
+    monkeypatch.setattr(
+        reactive.docker_engine,
+        "request",
+        lambda *args, **kwargs: request(*args, socket_path=socket_path, **kwargs),
+    )
+    monkeypatch.setattr(reactive, "config", lambda key: mocks.config[key])
+    monkeypatch.setattr(reactive, "data_root", lambda: "/var/lib/docker")
+    monkeypatch.setattr(reactive.hookenv, "log", mocks.log)
+    monkeypatch.setattr(reactive.docker, "DAEMON_JSON", str(tmp_path / "daemon.json"))
+    monkeypatch.setattr(reactive.docker, "host_fact", lambda name: "5.15.0-1-generic")
+    monkeypatch.setattr(reactive.docker, "set_daemon_json", mocks.set_daemon_json)
+    for name in (
+        "detect_storage_driver",
+        "storage_driver_packages",
+        "validate_backing_filesystem",
+        "recycle_daemon",
+    ):
+        monkeypatch.setattr(reactive, name, getattr(mocks, name))
+    mocks.storage_driver_packages.return_value = []
+    mocks.detect_storage_driver.return_value = "overlay2"
+    return mocks
+
+
+def test_storage_driver_auto_keeps_running_driver(reactive, storage):
+    # The storage-driver option is new on upgrade-charm, so it "changed".
+    reactive.storage_driver_changed()
+    storage.detect_storage_driver.assert_not_called()
+    storage.set_daemon_json.assert_called_once_with("storage-driver", "aufs")
+
+
+def test_storage_driver_auto_keeps_driver_of_stopped_engine(
+    reactive, storage, engine, tmp_path
+):
+    del engine.routes[("GET", "/info")]
+    reactive.storage_driver_changed()
+    storage.detect_storage_driver.assert_not_called()
+    storage.set_daemon_json.assert_not_called()
+
+    (tmp_path / "daemon.json").write_text('{"storage-driver": "btrfs"}')
+    reactive.storage_driver_changed()
+    storage.set_daemon_json.assert_called_once_with("storage-driver", "btrfs")
+
+
+def test_storage_driver_auto_detects_before_install(reactive, storage, engine):
+    reactive.flags.clear()
+    del engine.routes[("GET", "/info")]
+    assert reactive.storage_driver() == "overlay2"
+
+
+def test_storage_driver_explicit_switch(reactive, storage):
+    storage.config["storage-driver"] = "overlay2"
+    reactive.storage_driver_changed()
+    storage.set_daemon_json.assert_called_once_with("storage-driver", "overlay2")
+    storage.recycle_daemon.assert_called_once_with(
+        "storage driver changed to overlay2", restart=False
+    )
+
+
+def test_upgrade_restart_finishes_migration(reactive, daemon, monkeypatch):
+    from charms.layer import docker_upgrade
+
+    steps = MagicMock()
+
+    def upgrade_docker(downloaded, deadline, restart):
+        steps.upgrade(downloaded=downloaded)
+        restart()
+        return {
+            "engine-version": "24.0.5",
+            "install": 1.0,
+            "restart": 1.0,
+            "containers": daemon.restart_daemon.return_value,
+        }
+
+    migration = {"source": "/var/lib/docker", "target": "/srv/docker"}
+    reactive.unitdata.kv().set("docker.data-root-migration", migration)
+    reactive.flags.add("docker.upgrade.queued")
+    monkeypatch.setattr(docker_upgrade, "upgrade_docker", upgrade_docker)
+    for name in ("service_stop", "service_start", "service_restart"):
+        monkeypatch.setattr(reactive.host, name, getattr(steps, name))
+    monkeypatch.setattr(reactive, "_finish_data_root_migration", steps.migrate)
+
+    reactive.recycle_daemon("upgrade-docker")
+    _flush(daemon)
+    # Stopped, migrated and started again by the upgrade, not restarted.
+    assert steps.mock_calls == [
+        call.upgrade(downloaded=True),
+        call.service_stop("docker.socket"),
+        call.service_stop("docker"),
+        call.migrate(migration),
+        call.service_start("docker"),
+    ]
+    daemon.restart_daemon.assert_not_called()
+    assert "docker.upgrade.queued" not in reactive.flags
+
+
+@pytest.fixture
+def mirrors(reactive, monkeypatch, tmp_path):
+    """A unit that is not the leader and has no related mirrors."""
+    from charms.layer import docker_mirror
+
+    mocks = MagicMock()
+    mocks.config = {"daemon-opts": "{}", "registry-mirror": ""}
+    mocks.hook_name.return_value = "update-status"
+    mocks.is_leader.return_value = False
+    mocks.relation_ids.return_value = []
+    mocks.mirror_healthy.return_value = True
+    monkeypatch.setattr(reactive, "config", lambda key: mocks.config[key])
+    monkeypatch.setattr(reactive.hookenv, "config", lambda key: mocks.config[key])
+    for name in ("hook_name", "is_leader", "leader_get", "relation_ids", "log"):
+        monkeypatch.setattr(reactive.hookenv, name, getattr(mocks, name))
+    monkeypatch.setattr(reactive.docker, "DAEMON_JSON", str(tmp_path / "daemon.json"))
+    monkeypatch.setattr(docker_mirror, "mirror_healthy", mocks.mirror_healthy)
+    monkeypatch.setattr(reactive, "recycle_daemon", mocks.recycle_daemon)
+    return mocks
+
+
+def test_update_status_skips_unused_registry_mirror(reactive, mirrors):
+    reactive.registry_mirror_check()
+    assert "docker.registry-mirror.check" not in reactive.flags
+
+    mirrors.hook_name.return_value = "leader-settings-changed"
+    reactive.registry_mirror_check()
+    assert "docker.registry-mirror.check" in reactive.flags
+    reactive.configure_registry_mirror()
+    mirrors.mirror_healthy.assert_not_called()
+    mirrors.recycle_daemon.assert_not_called()
+
+
+def test_registry_mirrors_recycle_only_on_change(reactive, mirrors):
+    mirrors.config["registry-mirror"] = "http://10.0.0.5:5000"
+    reactive.registry_mirror_check()
+    reactive.configure_registry_mirror()
+    mirrors.recycle_daemon.assert_called_once_with(
+        "registry mirrors changed", restart=False
+    )
+    with open(reactive.docker.DAEMON_JSON) as f:
+        assert json.load(f) == {"registry-mirrors": ["http://10.0.0.5:5000"]}
+
+    # The daemon picked the mirrors up, later checks find nothing to do.
+    reactive.docker.clear_pending_changes()
+    reactive.configure_registry_mirror()
+    assert mirrors.recycle_daemon.call_count == 1
+
+    mirrors.mirror_healthy.return_value = False
+    reactive.configure_registry_mirror()
+    assert mirrors.recycle_daemon.call_count == 2
+    with open(reactive.docker.DAEMON_JSON) as f:
+        assert json.load(f) == {}
+
+
+@pytest.fixture
+def relocation(reactive, monkeypatch, engine, socket_path, tmp_path):
+    """
+    A unit deployed before the data-root was recorded, whose daemon-opts
+    already moved it to /srv/docker.
+    """
+    mocks = MagicMock()
+    mocks.config = {"daemon-opts": '{"data-root": "/srv/docker"}', "data-root": ""}
+    mocks.installed_packages.return_value = ["rsync"]
+    engine.routes[("GET", "/info")] = (200, {"DockerRootDir": "/srv/docker"})
+    request = reactive.docker_engine.request
+    monkeypatch.setattr(
+        reactive.docker_engine,
+        "request",
+        lambda *args, **kwargs: request(*args, socket_path=socket_path, **kwargs),
+    )
+    monkeypatch.setattr(reactive, "config", lambda key: mocks.config[key])
+    monkeypatch.setattr(reactive.hookenv, "config", lambda key: mocks.config[key])
+    monkeypatch.setattr(reactive.hookenv, "log", mocks.log)
+    monkeypatch.setattr(reactive.hookenv, "storage_list", lambda name: [])
+    monkeypatch.setattr(reactive.docker, "DAEMON_JSON", str(tmp_path / "daemon.json"))
+    monkeypatch.setattr(
+        "charms.layer.docker_apt.installed_packages", mocks.installed_packages
+    )
+    for name in (
+        "storage_driver",
+        "validate_backing_filesystem",
+        "migrate_data_root",
+        "recycle_daemon",
+        "status_set",
+    ):
+        monkeypatch.setattr(reactive, name, getattr(mocks, name))
+    return mocks
+
+
+def test_upgraded_unit_keeps_data_root_of_daemon_opts(reactive, relocation, engine):
+    reactive.move_data_root()
+    relocation.migrate_data_root.assert_not_called()
+    relocation.recycle_daemon.assert_not_called()
+    assert reactive.unitdata.kv().get("docker.data-root") == "/srv/docker"
+
+
+def test_upgraded_unit_reads_data_root_of_stopped_engine(
+    reactive, relocation, engine, tmp_path
+):
+    del engine.routes[("GET", "/info")]
+    (tmp_path / "daemon.json").write_text('{"data-root": "/srv/docker"}')
+    reactive.move_data_root()
+    relocation.migrate_data_root.assert_not_called()
+
+    # Moving it on from there copies from the root docker runs with.
+    relocation.config["daemon-opts"] = '{"data-root": "/data/docker"}'
+    reactive.move_data_root()
+    relocation.migrate_data_root.assert_called_once()
+    assert relocation.migrate_data_root.call_args[0][:2] == (
+        "/srv/docker",
+        "/data/docker",
+    )
+
+
+def test_data_root_switched_over_once_daemon_stopped(reactive, relocation, engine):
+    relocation.config["daemon-opts"] = "{}"
+    relocation.config["data-root"] = "/srv/docker"
+    engine.routes[("GET", "/info")] = (200, {"DockerRootDir": "/var/lib/docker"})
+    reactive.docker.set_daemon_json("data-root", "/var/lib/docker")
+
+    reactive.move_data_root()
+    relocation.recycle_daemon.assert_called_once_with("data-root moved to /srv/docker")
+    reactive.docker.write_daemon_json()
+    with open(reactive.docker.DAEMON_JSON) as f:
+        assert json.load(f)["data-root"] == "/var/lib/docker"
+
+    migration = reactive.unitdata.kv().get("docker.data-root-migration")
+    reactive._finish_data_root_migration(migration)
+    with open(reactive.docker.DAEMON_JSON) as f:
+        assert json.load(f)["data-root"] == "/srv/docker"
+    assert reactive.unitdata.kv().get("docker.data-root") == "/srv/docker"
+
+
+def test_cgroups_configured_once_docker_ready(reactive, monkeypatch):
+    mocks = MagicMock()
+    settings = {"enable-cgroups": True, "cgroup-driver": "auto"}
+    mocks.required_cmdline.return_value = []
+    mocks.set_accounting.return_value = []
+    monkeypatch.setattr(reactive, "config", lambda key: settings[key])
+    monkeypatch.setattr(reactive, "configure_cgroup_driver", lambda: False)
+    for name in ("set_accounting", "required_cmdline"):
+        monkeypatch.setattr(reactive.docker_cgroups, name, getattr(mocks, name))
+
+    # A hook later than the one enable-cgroups was set in.
+    reactive.configure_cgroups()
+    mocks.set_accounting.assert_called_once_with()
+    reactive.configure_cgroups()
+    mocks.set_accounting.assert_called_once_with()
+
+    settings["enable-cgroups"] = False
+    reactive.configure_cgroups()
+    settings["enable-cgroups"] = True
+    reactive.configure_cgroups()
+    assert mocks.set_accounting.call_count == 2